@@ -0,0 +1,204 @@
+import argparse
+import binascii
+import csv
+import json
+import mmap
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import IO, Any, Callable, Iterator
+from opcodes import ScriptParseError
+from program import ScriptEncoding, normalize_script
+from simulator import TraceMode
+from templates import evaluate
+from workers import get_program
+
+
+# Validates large files of scripts, one script per line, without going through
+# the web server:
+#
+#   python batch.py scripts.txt --format jsonl --output results.jsonl
+#   python batch.py dump.hex --encoding hex --mmap --workers 8
+#   cat scripts.txt | python batch.py -
+#
+# Each result holds the line index of the script, whether it is valid, and for
+# failing scripts the step and opcode they failed at (or the parse error).
+
+RESULT_FIELDS = ["index", "valid", "failing_step", "failing_opcode", "error"]
+
+CHUNK_SIZE = 1000
+
+
+# Result of validating one script, as (index, valid, failing_step, failing_opcode, error)
+Result = tuple[int, bool, int | None, str | None, str | None]
+
+def validate_line(index: int, line: bytes | memoryview, encoding: ScriptEncoding) -> Result:
+    try:
+        if encoding == ScriptEncoding.HEX:
+            key = binascii.unhexlify(line)
+        else:
+            key = normalize_script(bytes(line).decode())
+        program = get_program(key)
+    except (ScriptParseError, binascii.Error, UnicodeDecodeError) as error:
+        return index, False, None, None, str(error)
+
+    # an error of the interpreter fails this line, not the rest of the file
+    try:
+        simulation, _ = evaluate(program, TraceMode.ON_FAILURE)
+    except Exception as error:
+        return index, False, None, None, str(error)
+
+    for step in simulation.steps:
+        if step.failed:
+            return index, False, step.position, None if step.op is None else str(step.op), step.message
+
+    return index, simulation.valid, None, None, None
+
+
+def validate_chunk(chunk: list[tuple[int, bytes]], encoding: ScriptEncoding) -> list[Result]:
+    return [validate_line(index, line, encoding) for index, line in chunk]
+
+
+# Splits the input into chunks of (line index, line) pairs, skipping blank lines.
+# A memory mapped file is sliced without copying it, unless the lines are going
+# to be sent to worker processes.
+def read_chunks(source: IO[bytes], use_mmap: bool, copy: bool) -> Iterator[list[tuple[int, bytes | memoryview]]]:
+    if use_mmap and os.fstat(source.fileno()).st_size > 0:
+        mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        lines = iter_mapped_lines(mapped, view, copy)
+    else:
+        lines = (line.strip() for line in source)
+
+    chunk = []
+    for index, line in enumerate(lines):
+        if len(line) == 0:
+            continue
+        chunk.append((index, line))
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def iter_mapped_lines(mapped: mmap.mmap, view: memoryview, copy: bool) -> Iterator[bytes | memoryview]:
+    start, end = 0, len(mapped)
+    while start < end:
+        stop = mapped.find(b"\n", start)
+        if stop == -1:
+            stop = end
+        line = view[start:stop]
+        if len(line) and line[-1] == 0x0d:
+            line = line[:-1]
+        # pickling for the worker processes copies the line anyway
+        yield bytes(line).strip() if copy else line
+        start = stop + 1
+
+
+# Runs job(arg) for every (arg, tag) item on the executor, or inline without
+# one, keeping at most a few jobs per worker in flight, and yields the
+# (tag, result) pairs in input order. Tags stay in this process, for what the
+# caller needs back with a result but shouldn't be sent to the workers.
+def run_ordered(job: Callable, items: Iterator[tuple[Any, Any]], executor: ProcessPoolExecutor | None, workers: int) -> Iterator[tuple[Any, Any]]:
+    if executor is None:
+        for arg, tag in items:
+            yield tag, job(arg)
+        return
+
+    pending = deque()
+    for arg, tag in items:
+        pending.append((tag, executor.submit(job, arg)))
+        if len(pending) >= workers * 2:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+
+    while pending:
+        tag, future = pending.popleft()
+        yield tag, future.result()
+
+
+# Runs the chunks on a process pool and yields the results in input order
+def validate_chunks(chunks: Iterator[list], encoding: ScriptEncoding, workers: int) -> Iterator[Result]:
+    job = partial(validate_chunk, encoding=encoding)
+    items = ((chunk, None) for chunk in chunks)
+    if workers == 0:
+        for _, results in run_ordered(job, items, None, 0):
+            yield from results
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _, results in run_ordered(job, items, executor, workers):
+            yield from results
+
+
+# Writes records with write while counting the valid and invalid ones, and
+# reports the progress on stderr: the number of records (counted as noun) and
+# the throughput in units, of which each record weighs size. Returns the stats.
+def write_records(records: Iterator, write: Callable[[Any], None], is_valid: Callable[[Any], bool], progress_interval: float,
+                  noun: str = "scripts", unit: str = "scripts", size: Callable[[Any], int] = lambda record: 1) -> dict:
+    stats = {noun: 0, unit: 0, "valid": 0, "invalid": 0}
+    start = last_report = time.monotonic()
+
+    for record in records:
+        write(record)
+        stats[noun] += 1
+        if unit != noun:
+            stats[unit] += size(record)
+        stats["valid" if is_valid(record) else "invalid"] += 1
+
+        now = time.monotonic()
+        if progress_interval and now - last_report >= progress_interval:
+            last_report = now
+            print(f"{stats[noun]} {noun}, {stats[unit] / (now - start):.0f} {unit}/s", file=sys.stderr)
+
+    stats["seconds"] = time.monotonic() - start
+    stats[f"{unit}_per_second"] = stats[unit] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def write_results(results: Iterator[Result], output: IO[str], format: str, progress_interval: float) -> dict:
+    if format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(RESULT_FIELDS)
+        write = writer.writerow
+    else:
+        def write(result: Result) -> None:
+            output.write(json.dumps(dict(zip(RESULT_FIELDS, result))) + "\n")
+
+    return write_records(results, write, lambda result: result[1], progress_interval)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Validate a file of scripts, one per line")
+    parser.add_argument("input", help="file of scripts, or - for stdin")
+    parser.add_argument("--encoding", choices=[e.value for e in ScriptEncoding], default=ScriptEncoding.ASM.value)
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--output", help="file to write results to, stdout by default")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 0 to validate inline")
+    parser.add_argument("--mmap", action="store_true", help="memory map the input file instead of reading it")
+    parser.add_argument("--progress", type=float, default=5.0, help="seconds between progress reports, 0 to disable")
+    args = parser.parse_args()
+
+    encoding = ScriptEncoding(args.encoding)
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    output = sys.stdout if args.output is None else open(args.output, "w", newline="")
+
+    with source, output:
+        chunks = read_chunks(source, args.mmap and args.input != "-", copy=args.workers > 0)
+        results = validate_chunks(chunks, encoding, args.workers)
+        stats = write_results(results, output, args.format, args.progress)
+
+    print(
+        f"{stats['scripts']} scripts ({stats['valid']} valid, {stats['invalid']} invalid) "
+        f"in {stats['seconds']:.2f}s, {stats['scripts_per_second']:.0f} scripts/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from typing import Callable
+from urllib.parse import urlencode
+from hashes import hash160
+from opcodes import OPCODES, construct_script, deserialize_script
+from program import Program, compile_bytes, compile_script
+from secp256k1 import point_mul, serialize_pubkey, sign_ecdsa
+from simulator import HANDLERS, HASH_CACHE, SIGNATURE_CACHE, ScriptContext, TraceMode, op_not_supported, op_reserved, simulate_script
+from transaction import Transaction, TxIn, TxOut
+
+
+# Benchmarks parsing, simulating and serving scripts over a fixed corpus, and
+# compares the timings with a stored baseline:
+#
+#   python bench.py --save baseline.json
+#   python bench.py --baseline baseline.json --output results.json
+#   python bench.py --groups templates stress --benchmarks simulate endpoint
+#
+# Every case is timed with the signature and hash caches cleared before each
+# call, so that repeated calls do the same work as the first one. The
+# endpoint is called through an in-process ASGI client, with jobs run inline
+# and the result cache cleared, so it measures request handling on top of the
+# simulation rather than the network or the process pool.
+
+BENCHMARKS = ["parse", "simulate", "endpoint"]
+GROUPS = ["opcodes", "templates", "stress"]
+
+# A case is slower than its baseline when its median time is this many times larger
+REGRESSION_THRESHOLD = 1.25
+
+
+# A script of the corpus. Scripts are written in asm, or in hex when they
+# push bytes asm can't express. Cases in the opcodes group measure a single
+# op on top of SETUP, whose own cost is reported by the "setup" case. Stress
+# cases are simulated with the final trace only: serving the full trace of a
+# script with a deep stack takes seconds, as every step copies the stack.
+class Case:
+    __slots__ = ("name", "group", "script", "encoding", "sighash", "tx", "trace", "endpoint")
+
+    def __init__(self, name: str, group: str, script: str, encoding: str = "asm", sighash: bytes | None = None,
+                 tx: Transaction | None = None, trace: TraceMode = TraceMode.FULL, endpoint: bool = True) -> None:
+        self.name = name
+        self.group = group
+        self.script = script
+        self.encoding = encoding
+        self.sighash = sighash
+        self.tx = tx
+        self.trace = trace
+        self.endpoint = endpoint
+
+    def compile(self) -> Program:
+        return compile_script(self.script) if self.encoding == "asm" else compile_bytes(bytes.fromhex(self.script))
+
+    def parse(self) -> list:
+        return construct_script(self.script) if self.encoding == "asm" else deserialize_script(bytes.fromhex(self.script))
+
+
+SETUP = "1 1 1 1 1 1"
+
+# Scripts of the opcodes that need more than SETUP to run successfully
+OPCODE_SCRIPTS = {
+    "OP_IF":                    f"{SETUP} OP_IF OP_ENDIF",
+    "OP_NOTIF":                 f"{SETUP} OP_NOTIF OP_ENDIF",
+    "OP_ELSE":                  f"{SETUP} OP_IF OP_ELSE OP_ENDIF",
+    "OP_ENDIF":                 f"{SETUP} OP_IF OP_ENDIF",
+    "OP_FROMALTSTACK":          f"{SETUP} OP_TOALTSTACK OP_FROMALTSTACK",
+    "OP_CHECKSIG":              "SIGA PKA OP_CHECKSIG",
+    "OP_CHECKSIGVERIFY":        "1 SIGA PKA OP_CHECKSIGVERIFY",
+    "OP_CHECKMULTISIG":         "OP_0 SIGA 1 PKA 1 OP_CHECKMULTISIG",
+    "OP_CHECKMULTISIGVERIFY":   "1 OP_0 SIGA 1 PKA 1 OP_CHECKMULTISIGVERIFY",
+}
+
+# The spending transaction the locktime opcodes are checked against
+LOCKTIME_TX = Transaction(2, [TxIn(bytes(32), 0, b"", 1)], [TxOut(0, b"\x51")], 1)
+
+
+def opcode_cases() -> list[Case]:
+    cases = [Case("setup", "opcodes", SETUP, endpoint=False)]
+    for name, opcode in OPCODES.items():
+        if opcode.disabled or HANDLERS[opcode.code] in (op_not_supported, op_reserved) or opcode.code <= OPCODES["OP_16"].code:
+            continue
+        script = OPCODE_SCRIPTS.get(name, f"{SETUP} {name}")
+        cases.append(Case(name, "opcodes", script, tx=LOCKTIME_TX, endpoint=False))
+    return cases
+
+
+def push(data: bytes) -> str:
+    return (bytes([len(data)]) + data).hex()
+
+# Standard scripts, with placeholder signatures and with real ECDSA ones
+def template_cases() -> list[Case]:
+    secret = 0xB7C
+    sighash = bytes(range(32))
+    pubkey = serialize_pubkey(point_mul(secret))
+    signature = sign_ecdsa(secret, sighash, nonce=0x5EED) + b"\x01"
+    pubkeys = " ".join(f"PK{i}" for i in range(15))
+    signatures = " ".join(f"SIG{i}" for i in range(15))
+
+    return [
+        Case("p2pk", "templates", "SIGA PKA OP_CHECKSIG"),
+        Case("p2pk_ecdsa", "templates", push(signature) + push(pubkey) + "ac", "hex", sighash),
+        Case("p2pkh_ecdsa", "templates", push(signature) + push(pubkey) + "76a9" + push(hash160(pubkey)) + "88ac", "hex", sighash),
+        Case("multisig_2_of_3", "templates", "OP_0 SIG0 SIG2 OP_2 PK0 PK1 PK2 OP_3 OP_CHECKMULTISIG"),
+        Case("multisig_15_of_15", "templates", f"OP_0 {signatures} 15 {pubkeys} 15 OP_CHECKMULTISIG"),
+    ]
+
+# Scripts at the consensus limits: the deepest stack, the most ops, the
+# deepest nesting and the largest pushes
+def stress_cases() -> list[Case]:
+    big_push = "4d0802" + "ab" * 520
+    cases = [
+        ("full_stack", "1 " * 1000, "asm"),
+        ("deep_roll", "1 " * 998 + "997 OP_ROLL", "asm"),
+        ("deep_pick", "1 " * 998 + " ".join(["997 OP_PICK OP_DROP"] * 60), "asm"),
+        ("long_script", "1 " + "OP_DUP OP_DROP " * 100, "asm"),
+        ("nested_ifs", "1 " * 100 + "OP_IF " * 100 + "1 " + "OP_ENDIF " * 100, "asm"),
+        ("hash_chain", "1 " + "OP_SHA256 " * 200, "asm"),
+        ("large_pushes", (big_push + "a8") * 19, "hex"),
+        ("arithmetic_chain", "1 " + "OP_1ADD " * 200, "asm"),
+    ]
+    return [Case(name, "stress", script, encoding, trace=TraceMode.FINAL) for name, script, encoding in cases]
+
+
+def corpus(groups: list[str] = GROUPS) -> list[Case]:
+    builders = {"opcodes": opcode_cases, "templates": template_cases, "stress": stress_cases}
+    return [case for group in groups for case in builders[group]()]
+
+
+# Calls an ASGI app in process with a request, the way a server would, and
+# returns the status and body of the response
+async def asgi_request(app, method: str, path: str, params: dict, body: bytes = b"", content_type: str | None = None) -> tuple[int, bytes]:
+    headers = [(b"host", b"bench")]
+    if content_type is not None:
+        headers.append((b"content-type", content_type.encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(params, doseq=True).encode(),
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    response = {"status": 0, "body": []}
+    requested = False
+
+    # the body is sent at once, after which the client stays connected until
+    # the response is done, as streaming responses listen for a disconnect
+    async def receive() -> dict:
+        nonlocal requested
+        if requested:
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message: dict) -> None:
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+async def asgi_get(app, path: str, params: dict) -> tuple[int, bytes]:
+    return await asgi_request(app, "GET", path, params)
+
+
+def clear_caches() -> None:
+    SIGNATURE_CACHE.clear()
+    HASH_CACHE.clear()
+
+
+# The function timed for a benchmark of a case, None when it doesn't apply
+def benchmark_function(benchmark: str, case: Case) -> Callable[[], object] | None:
+    if benchmark == "parse":
+        return case.parse
+
+    if benchmark == "simulate":
+        program = case.compile()
+        def simulate() -> None:
+            clear_caches()
+            simulate_script(program, case.trace, ScriptContext(case.sighash, tx=case.tx))
+        return simulate
+
+    if not case.endpoint:
+        return None
+
+    # jobs run inline, without a process pool, so that the caches they fill
+    # are the ones of this process, and requests aren't logged
+    import server
+    import workers
+    if server.POOL.workers != 0:
+        server.POOL.shutdown()
+        server.POOL = workers.SimulationPool(workers=0)
+    server.logger.setLevel(logging.WARNING)
+
+    loop = asyncio.new_event_loop()
+    params = {"script": case.script, "encoding": case.encoding, "trace": case.trace.value}
+    if case.sighash is not None:
+        params["sighash"] = case.sighash.hex()
+
+    status, body = loop.run_until_complete(asgi_get(server.app, "/simulate", params))
+    if status != 200:
+        raise RuntimeError(f"/simulate returned {status} for {case.name}: {body[:200]!r}")
+
+    def endpoint() -> None:
+        clear_caches()
+        server.RESULT_CACHE.clear()
+        workers.PROGRAM_CACHE.clear()
+        loop.run_until_complete(asgi_get(server.app, "/simulate", params))
+    return endpoint
+
+
+# Times function in repeat rounds of the same number of calls, which is
+# doubled until a round takes at least min_time seconds, and returns the
+# median and fastest time per call in microseconds
+def measure(function: Callable[[], object], repeat: int, min_time: float) -> dict:
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        calls *= 2
+
+    rounds = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        rounds.append(time.perf_counter() - start)
+
+    per_call = [round_time / calls * 1e6 for round_time in rounds]
+    return {"median_us": statistics.median(per_call), "min_us": min(per_call), "calls": calls, "repeat": repeat}
+
+
+def run(cases: list[Case], benchmarks: list[str], repeat: int = 5, min_time: float = 0.05, progress: bool = False) -> list[dict]:
+    results = []
+    for case in cases:
+        for benchmark in benchmarks:
+            function = benchmark_function(benchmark, case)
+            if function is None:
+                continue
+            result = {"name": case.name, "group": case.group, "benchmark": benchmark}
+            result.update(measure(function, repeat, min_time))
+            results.append(result)
+            if progress:
+                print(f"{case.group}/{case.name} {benchmark}: {result['median_us']:.1f}us", file=sys.stderr)
+    return results
+
+
+# Matches results with the baseline by (group, name, benchmark), and reports
+# the ratio of their median times
+def compare(results: list[dict], baseline: list[dict], threshold: float = REGRESSION_THRESHOLD) -> list[dict]:
+    previous = {(result["group"], result["name"], result["benchmark"]): result for result in baseline}
+    comparison = []
+    for result in results:
+        base = previous.get((result["group"], result["name"], result["benchmark"]))
+        if base is None or not base["median_us"]:
+            continue
+        ratio = result["median_us"] / base["median_us"]
+        comparison.append({
+            "name": result["name"],
+            "group": result["group"],
+            "benchmark": result["benchmark"],
+            "baseline_us": base["median_us"],
+            "median_us": result["median_us"],
+            "ratio": ratio,
+            "regression": ratio > threshold,
+        })
+    return comparison
+
+
+def environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": time.time(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark parsing, simulating and serving scripts")
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=GROUPS)
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument("--cases", nargs="+", help="only run the cases with these names")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds timed per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.05, help="minimum seconds per round")
+    parser.add_argument("--output", help="file to write the results to, stdout by default")
+    parser.add_argument("--save", help="also write the results to this file, as a baseline for later runs")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="slowdown ratio counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 when a benchmark regressed")
+    args = parser.parse_args()
+
+    cases = [case for case in corpus(args.groups) if args.cases is None or case.name in args.cases]
+    results = run(cases, args.benchmarks, args.repeat, args.min_time, progress=True)
+    report = {"environment": environment(), "results": results}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        report["baseline_environment"] = baseline.get("environment")
+        report["comparison"] = compare(results, baseline["results"], args.threshold)
+        regressions = [entry for entry in report["comparison"] if entry["regression"]]
+        for entry in regressions:
+            print(f"regression: {entry['group']}/{entry['name']} {entry['benchmark']} {entry['ratio']:.2f}x slower", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.save:
+        with open(args.save, "w") as output:
+            output.write(text + "\n")
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
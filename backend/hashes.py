@@ -0,0 +1,118 @@
+import hashlib
+import struct
+
+# Digests computed by the crypto opcodes. They accept any buffer, so pushes
+# that are memoryviews into a larger script are hashed in place.
+
+def sha1(data: bytes | memoryview) -> bytes:
+    return hashlib.sha1(data).digest()
+
+def sha256(data: bytes | memoryview) -> bytes:
+    return hashlib.sha256(data).digest()
+
+def hash160(data: bytes | memoryview) -> bytes:
+    return ripemd160(hashlib.sha256(data).digest())
+
+def hash256(data: bytes | memoryview) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+# RIPEMD-160 comes from OpenSSL through hashlib, which doesn't provide it in
+# every build (OpenSSL 3 moved it to the legacy provider). The pure Python
+# version below is used in that case.
+
+# message word used by each of the 80 steps, and the amount it's rotated by,
+# for the left and right lines
+_WORDS_LEFT = (
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8,
+    3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12,
+    1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2,
+    4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13,
+)
+_WORDS_RIGHT = (
+    5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12,
+    6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2,
+    15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13,
+    8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14,
+    12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11,
+)
+_SHIFTS_LEFT = (
+    11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8,
+    7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12,
+    11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5,
+    11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12,
+    9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6,
+)
+_SHIFTS_RIGHT = (
+    8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6,
+    9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11,
+    9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5,
+    15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8,
+    8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11,
+)
+_CONSTANTS_LEFT = (0x00000000, 0x5A827999, 0x6ED9EBA1, 0x8F1BBCDC, 0xA953FD4E)
+_CONSTANTS_RIGHT = (0x50A28BE6, 0x5C4DD124, 0x6D703EF3, 0x7A6D76E9, 0x00000000)
+
+MASK = 0xFFFFFFFF
+
+
+def _rotate(x: int, n: int) -> int:
+    return ((x << n) | (x >> (32 - n))) & MASK
+
+def _f(round: int, x: int, y: int, z: int) -> int:
+    if round == 0:
+        return x ^ y ^ z
+    if round == 1:
+        return (x & y) | (~x & z)
+    if round == 2:
+        return (x | ~y) ^ z
+    if round == 3:
+        return (x & z) | (y & ~z)
+    return x ^ (y | ~z)
+
+def _compress(state: list[int], block: bytes | memoryview) -> None:
+    words = struct.unpack("<16I", block)
+    al, bl, cl, dl, el = state
+    ar, br, cr, dr, er = state
+
+    for j in range(80):
+        round = j >> 4
+        t = (al + _f(round, bl, cl, dl) + words[_WORDS_LEFT[j]] + _CONSTANTS_LEFT[round]) & MASK
+        al, el, dl, cl, bl = el, dl, _rotate(cl, 10), bl, (_rotate(t, _SHIFTS_LEFT[j]) + el) & MASK
+
+        t = (ar + _f(4 - round, br, cr, dr) + words[_WORDS_RIGHT[j]] + _CONSTANTS_RIGHT[round]) & MASK
+        ar, er, dr, cr, br = er, dr, _rotate(cr, 10), br, (_rotate(t, _SHIFTS_RIGHT[j]) + er) & MASK
+
+    state[:] = (
+        (state[1] + cl + dr) & MASK,
+        (state[2] + dl + er) & MASK,
+        (state[3] + el + ar) & MASK,
+        (state[4] + al + br) & MASK,
+        (state[0] + bl + cr) & MASK,
+    )
+
+# Full blocks are compressed straight from a view of the data, and only the
+# last partial block is copied for padding
+def _ripemd160(data: bytes | memoryview) -> bytes:
+    view = memoryview(data).cast("B")
+    state = [0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0]
+
+    full = len(view) - len(view) % 64
+    for offset in range(0, full, 64):
+        _compress(state, view[offset:offset + 64])
+
+    tail = bytes(view[full:]) + b"\x80" + bytes((55 - len(view)) % 64) + struct.pack("<Q", 8 * len(view))
+    for offset in range(0, len(tail), 64):
+        _compress(state, tail[offset:offset + 64])
+
+    return struct.pack("<5I", *state)
+
+def _hashlib_ripemd160(data: bytes | memoryview) -> bytes:
+    return hashlib.new("ripemd160", data).digest()
+
+try:
+    hashlib.new("ripemd160")
+    ripemd160 = _hashlib_ripemd160
+except ValueError:
+    ripemd160 = _ripemd160
@@ -0,0 +1,82 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Logging settings, overridable through environment variables. Records below
+# WARNING are kept with probability LOG_SAMPLE_RATE, and full simulation traces
+# are only logged when LOG_TRACES is enabled.
+LOG_LEVEL = os.environ.get("BTC_SCRIPT_LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("BTC_SCRIPT_LOG_SAMPLE_RATE", 1.0))
+LOG_TRACES = os.environ.get("BTC_SCRIPT_LOG_TRACES", "0").lower() in ("1", "true", "yes")
+
+# attributes every LogRecord has, so anything else was passed through extra=
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+# Formats each record as one JSON object per line, including the fields passed
+# to the logging call through extra=
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES:
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, default=str)
+
+
+# Drops a random share of the records below WARNING
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+_listener = None
+
+# Records are handed to a queue by the logging call and written to stdout by a
+# background thread, so logging never blocks the event loop on I/O.
+def setup_logging() -> None:
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    if LOG_SAMPLE_RATE < 1:
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+    root = logging.getLogger("btc_script")
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+
+    _listener = QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(f"btc_script.{name}")
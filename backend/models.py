@@ -0,0 +1,79 @@
+from pydantic import BaseModel
+from opcodes import Data, Opcode, ScriptOp
+from simulator import Simulation, SimulationStep
+from templates import ScriptType
+
+
+# Pydantic models for the API. The interpreter works on the lightweight classes
+# in opcodes.py and simulator.py, which are only converted to these models when
+# a simulation is returned to a client.
+
+class DataModel(BaseModel):
+    category: str = "data"
+    value: str | int
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+class OpcodeModel(BaseModel):
+    category: str
+    value: str
+    code: int
+    arg_count: int = 0
+    disabled: bool = False
+
+    def __str__(self) -> str:
+        return str(self.value)
+
+class SimulationStepModel(BaseModel):
+    message: str | None = None
+    script: list[OpcodeModel | DataModel]
+    stack: list[OpcodeModel | DataModel]
+    altstack: list[OpcodeModel | DataModel] = []
+    failed: bool = False
+
+class SimulationModel(BaseModel):
+    steps: list[SimulationStepModel]
+    valid: bool
+    script_type: ScriptType = ScriptType.NONSTANDARD
+
+
+# opcodes are singletons, so each one only needs to be converted once
+OPCODE_MODELS: dict[Opcode, OpcodeModel] = {}
+
+def op_to_model(op: ScriptOp) -> OpcodeModel | DataModel:
+    if type(op) is Data:
+        value = op.value
+        if isinstance(value, (bytes, memoryview)):
+            value = value.hex()
+        return DataModel(value=value)
+
+    model = OPCODE_MODELS.get(op)
+    if model is None:
+        model = OpcodeModel(
+            category=op.category,
+            value=op.value,
+            code=op.code,
+            arg_count=op.arg_count,
+            disabled=op.disabled,
+        )
+        OPCODE_MODELS[op] = model
+    return model
+
+
+def step_to_model(step: SimulationStep) -> SimulationStepModel:
+    return SimulationStepModel(
+        message=step.message,
+        script=[op_to_model(op) for op in step.script],
+        stack=[op_to_model(op) for op in step.stack],
+        altstack=[op_to_model(op) for op in step.altstack],
+        failed=step.failed,
+    )
+
+
+def simulation_to_model(sim: Simulation, script_type: ScriptType = ScriptType.NONSTANDARD) -> SimulationModel:
+    return SimulationModel(
+        steps=[step_to_model(step) for step in sim.steps],
+        valid=sim.valid,
+        script_type=script_type,
+    )
@@ -1,146 +1,209 @@
-from pydantic import BaseModel
+# Items of a script: either data pushed to the stack or an opcode. These are
+# plain __slots__ classes so the interpreter can create and compare them
+# cheaply; the pydantic models used by the API live in models.py.
+class ScriptOp:
+    __slots__ = ()
+    category = "data"
 
-class ScriptOp(BaseModel):
-    category: str = "data"
-    
     def __repr__(self) -> str:
-        if type(self) == Data:
-            return str(self.value)
-        elif type(self) == Opcode:
-            return str(self.value)
-        
+        return str(self)
+
     def __str__(self) -> str:
-        if type(self) == Data:
-            return str(self.value)
-        elif type(self) == Opcode:
-            return str(self.value)
+        if isinstance(self.value, (bytes, memoryview)):
+            return self.value.hex()
+        return str(self.value)
+
+    def as_num(self) -> int:
+        raise ValueError(f"Requires a number, but found {self.value}")
 
+# Data parsed from serialized scripts holds bytes, usually as a memoryview into
+# the buffer the script was parsed from. Numbers are kept as ints, and each
+# item converts between the two forms lazily, caching the result, so that a
+# number is only encoded when its bytes are needed (hashing, comparing with
+# bytes) and bytes are only decoded when used as a number.
 class Data(ScriptOp):
-    value: str | int
+    __slots__ = ("value", "_num", "_bytes")
+
+    def __init__(self, value: str | int | bytes | memoryview) -> None:
+        self.value = value
+        self._num = None
+        self._bytes = None
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not Data:
+            return False
+        if type(self.value) is type(other.value):
+            return self.value == other.value
+        return self.as_bytes() == other.as_bytes()
+
+    def __hash__(self) -> int:
+        return hash(bytes(self.as_bytes()))
+
+    # the value as a script number, limited to 4 bytes like the operands of
+    # the arithmetic opcodes
+    def as_num(self) -> int:
+        if type(self.value) is int:
+            if not -MAX_NUM < self.value < MAX_NUM:
+                raise ValueError(f"Numbers are limited to {MAX_NUM_SIZE} bytes")
+            return self.value
+        if type(self.value) is str:
+            raise ValueError("Requires type Int, but found type String")
+        if self._num is None:
+            self._num = decode_num(self.value)
+        return self._num
+
+    # the value as bytes: data as it is, numbers in their script encoding and
+    # placeholder names in UTF-8
+    def as_bytes(self) -> bytes | memoryview:
+        if isinstance(self.value, (bytes, memoryview)):
+            return self.value
+        if self._bytes is None:
+            self._bytes = encode_num(self.value) if type(self.value) is int else self.value.encode()
+        return self._bytes
 
+# Opcodes are singletons defined once below, so they compare and hash by identity
 class Opcode(ScriptOp):
-    value: str
-    arg_count: int = 0
-    disabled: bool = False
+    __slots__ = ("value", "category", "code", "arg_count", "disabled")
+
+    def __init__(self, value: str, category: str, code: int, arg_count: int = 0, disabled: bool = False) -> None:
+        self.value = value
+        self.category = category
+        self.code = code            # byte value in serialized scripts, also used as the opcode's id
+        self.arg_count = arg_count
+        self.disabled = disabled
+
+    # unpickle to the module-level singleton of the same name
+    def __reduce__(self) -> str:
+        return self.value
 
 # Constants
-OP_0            = Opcode(value='OP_0', category='constants')
-OP_PUSHDATA1    = Opcode(value='OP_PUSHDATA1', category='constants')
-OP_PUSHDATA2    = Opcode(value='OP_PUSHDATA2', category='constants')
-OP_PUSHDATA4    = Opcode(value='OP_PUSHDATA4', category='constants')
-OP_1NEGATE      = Opcode(value='OP_1NEGATE', category='constants')
-OP_RESERVED     = Opcode(value='OP_RESERVED', category='constants')
-OP_1            = Opcode(value='OP_1', category='constants')
-OP_2            = Opcode(value='OP_2', category='constants')
-OP_3            = Opcode(value='OP_3', category='constants')
-OP_4            = Opcode(value='OP_4', category='constants')
-OP_5            = Opcode(value='OP_5', category='constants')
-OP_6            = Opcode(value='OP_6', category='constants')
-OP_7            = Opcode(value='OP_7', category='constants')
-OP_8            = Opcode(value='OP_8', category='constants')
-OP_9            = Opcode(value='OP_9', category='constants')
-OP_10           = Opcode(value='OP_10', category='constants')
-OP_11           = Opcode(value='OP_11', category='constants')
-OP_12           = Opcode(value='OP_12', category='constants')
-OP_13           = Opcode(value='OP_13', category='constants')
-OP_14           = Opcode(value='OP_14', category='constants')
-OP_15           = Opcode(value='OP_15', category='constants')
-OP_16           = Opcode(value='OP_16', category='constants')
+OP_0            = Opcode(value='OP_0', category='constants', code=0x00)
+OP_PUSHDATA1    = Opcode(value='OP_PUSHDATA1', category='constants', code=0x4c)
+OP_PUSHDATA2    = Opcode(value='OP_PUSHDATA2', category='constants', code=0x4d)
+OP_PUSHDATA4    = Opcode(value='OP_PUSHDATA4', category='constants', code=0x4e)
+OP_1NEGATE      = Opcode(value='OP_1NEGATE', category='constants', code=0x4f)
+OP_RESERVED     = Opcode(value='OP_RESERVED', category='constants', code=0x50)
+OP_1            = Opcode(value='OP_1', category='constants', code=0x51)
+OP_2            = Opcode(value='OP_2', category='constants', code=0x52)
+OP_3            = Opcode(value='OP_3', category='constants', code=0x53)
+OP_4            = Opcode(value='OP_4', category='constants', code=0x54)
+OP_5            = Opcode(value='OP_5', category='constants', code=0x55)
+OP_6            = Opcode(value='OP_6', category='constants', code=0x56)
+OP_7            = Opcode(value='OP_7', category='constants', code=0x57)
+OP_8            = Opcode(value='OP_8', category='constants', code=0x58)
+OP_9            = Opcode(value='OP_9', category='constants', code=0x59)
+OP_10           = Opcode(value='OP_10', category='constants', code=0x5a)
+OP_11           = Opcode(value='OP_11', category='constants', code=0x5b)
+OP_12           = Opcode(value='OP_12', category='constants', code=0x5c)
+OP_13           = Opcode(value='OP_13', category='constants', code=0x5d)
+OP_14           = Opcode(value='OP_14', category='constants', code=0x5e)
+OP_15           = Opcode(value='OP_15', category='constants', code=0x5f)
+OP_16           = Opcode(value='OP_16', category='constants', code=0x60)
 
 # Flow Control
-OP_NOP          = Opcode(value='OP_NOP', category='flow control')
-OP_VER          = Opcode(value='OP_VER', category='flow control')
-OP_IF           = Opcode(value='OP_IF', category='flow control')
-OP_NOTIF        = Opcode(value='OP_NOTIF', category='flow control')
-OP_VERIF        = Opcode(value='OP_VERIF', category='flow control')
-OP_VERNOTIF     = Opcode(value='OP_VERNOTIF', category='flow control')
-OP_ELSE         = Opcode(value='OP_ELSE', category='flow control')
-OP_ENDIF        = Opcode(value='OP_ENDIF', category='flow control')
-OP_VERIFY       = Opcode(value='OP_VERIFY', category='flow control')
-OP_RETURN       = Opcode(value='OP_RETURN', category='flow control')
+OP_NOP          = Opcode(value='OP_NOP', category='flow control', code=0x61)
+OP_VER          = Opcode(value='OP_VER', category='flow control', code=0x62)
+OP_IF           = Opcode(value='OP_IF', category='flow control', arg_count=1, code=0x63)
+OP_NOTIF        = Opcode(value='OP_NOTIF', category='flow control', arg_count=1, code=0x64)
+OP_VERIF        = Opcode(value='OP_VERIF', category='flow control', code=0x65)
+OP_VERNOTIF     = Opcode(value='OP_VERNOTIF', category='flow control', code=0x66)
+OP_ELSE         = Opcode(value='OP_ELSE', category='flow control', code=0x67)
+OP_ENDIF        = Opcode(value='OP_ENDIF', category='flow control', code=0x68)
+OP_VERIFY       = Opcode(value='OP_VERIFY', category='flow control', arg_count=1, code=0x69)
+OP_RETURN       = Opcode(value='OP_RETURN', category='flow control', code=0x6a)
 
 # Stack
-OP_TOALTSTACK   = Opcode(value='OP_TOALTSTACK', category='stack')
-OP_FROMALTSTACK = Opcode(value='OP_FROMALTSTACK', category='stack')
-OP_2DROP        = Opcode(value='OP_2DROP', category='stack', arg_count=2)
-OP_2DUP         = Opcode(value='OP_2DUP', category='stack', arg_count=2)
-OP_3DUP         = Opcode(value='OP_3DUP', category='stack', arg_count=3)
-OP_2OVER        = Opcode(value='OP_2OVER', category='stack', arg_count=4)
-OP_2ROT         = Opcode(value='OP_2ROT', category='stack', arg_count=6)
-OP_2SWAP        = Opcode(value='OP_2SWAP', category='stack', arg_count=4)
-OP_IFDUP        = Opcode(value='OP_IFDUP', category='stack', arg_count=1)
-OP_DEPTH        = Opcode(value='OP_DEPTH', category='stack', arg_count=0)
-OP_DROP         = Opcode(value='OP_DROP', category='stack', arg_count=1)
-OP_DUP          = Opcode(value='OP_DUP', category='stack', arg_count=1)
-OP_NIP          = Opcode(value='OP_NIP', category='stack', arg_count=2)
-OP_OVER         = Opcode(value='OP_OVER', category='stack', arg_count=2)
-OP_PICK         = Opcode(value='OP_PICK', category='stack', arg_count=2)
-OP_ROLL         = Opcode(value='OP_ROLL', category='stack', arg_count=2)
-OP_ROT          = Opcode(value='OP_ROT', category='stack', arg_count=3)
-OP_SWAP         = Opcode(value='OP_SWAP', category='stack', arg_count=2)
-OP_TUCK         = Opcode(value='OP_TUCK', category='stack', arg_count=2)
+OP_TOALTSTACK   = Opcode(value='OP_TOALTSTACK', category='stack', arg_count=1, code=0x6b)
+OP_FROMALTSTACK = Opcode(value='OP_FROMALTSTACK', category='stack', code=0x6c)
+OP_2DROP        = Opcode(value='OP_2DROP', category='stack', arg_count=2, code=0x6d)
+OP_2DUP         = Opcode(value='OP_2DUP', category='stack', arg_count=2, code=0x6e)
+OP_3DUP         = Opcode(value='OP_3DUP', category='stack', arg_count=3, code=0x6f)
+OP_2OVER        = Opcode(value='OP_2OVER', category='stack', arg_count=4, code=0x70)
+OP_2ROT         = Opcode(value='OP_2ROT', category='stack', arg_count=6, code=0x71)
+OP_2SWAP        = Opcode(value='OP_2SWAP', category='stack', arg_count=4, code=0x72)
+OP_IFDUP        = Opcode(value='OP_IFDUP', category='stack', arg_count=1, code=0x73)
+OP_DEPTH        = Opcode(value='OP_DEPTH', category='stack', arg_count=0, code=0x74)
+OP_DROP         = Opcode(value='OP_DROP', category='stack', arg_count=1, code=0x75)
+OP_DUP          = Opcode(value='OP_DUP', category='stack', arg_count=1, code=0x76)
+OP_NIP          = Opcode(value='OP_NIP', category='stack', arg_count=2, code=0x77)
+OP_OVER         = Opcode(value='OP_OVER', category='stack', arg_count=2, code=0x78)
+OP_PICK         = Opcode(value='OP_PICK', category='stack', arg_count=2, code=0x79)
+OP_ROLL         = Opcode(value='OP_ROLL', category='stack', arg_count=2, code=0x7a)
+OP_ROT          = Opcode(value='OP_ROT', category='stack', arg_count=3, code=0x7b)
+OP_SWAP         = Opcode(value='OP_SWAP', category='stack', arg_count=2, code=0x7c)
+OP_TUCK         = Opcode(value='OP_TUCK', category='stack', arg_count=2, code=0x7d)
 
 # Splice
-OP_CAT          = Opcode(value='OP_CAT', category='splice', disabled=True)
-OP_SUBSTR       = Opcode(value='OP_SUBSTR', category='splice', disabled=True)
-OP_LEFT         = Opcode(value='OP_LEFT', category='splice', disabled=True)
-OP_RIGHT        = Opcode(value='OP_RIGHT', category='splice', disabled=True)
-OP_SIZE         = Opcode(value='OP_SIZE', category='splice')
+OP_CAT          = Opcode(value='OP_CAT', category='splice', disabled=True, code=0x7e)
+OP_SUBSTR       = Opcode(value='OP_SUBSTR', category='splice', disabled=True, code=0x7f)
+OP_LEFT         = Opcode(value='OP_LEFT', category='splice', disabled=True, code=0x80)
+OP_RIGHT        = Opcode(value='OP_RIGHT', category='splice', disabled=True, code=0x81)
+OP_SIZE         = Opcode(value='OP_SIZE', category='splice', arg_count=1, code=0x82)
 
 # Bitwise Logic
-OP_INVERT       = Opcode(value='OP_INVERT', category='bitwise logic', disabled=True)
-OP_AND          = Opcode(value='OP_AND', category='bitwise logic', disabled=True)
-OP_OR           = Opcode(value='OP_OR', category='bitwise logic', disabled=True)
-OP_XOR          = Opcode(value='OP_XOR', category='bitwise logic', disabled=True)
-OP_EQUAL        = Opcode(value='OP_EQUAL', category='bitwise logic', arg_count=2)
-OP_EQUALVERIFY  = Opcode(value='OP_EQUALVERIFY', category='bitwise logic', arg_count=2)
+OP_INVERT       = Opcode(value='OP_INVERT', category='bitwise logic', disabled=True, code=0x83)
+OP_AND          = Opcode(value='OP_AND', category='bitwise logic', disabled=True, code=0x84)
+OP_OR           = Opcode(value='OP_OR', category='bitwise logic', disabled=True, code=0x85)
+OP_XOR          = Opcode(value='OP_XOR', category='bitwise logic', disabled=True, code=0x86)
+OP_EQUAL        = Opcode(value='OP_EQUAL', category='bitwise logic', arg_count=2, code=0x87)
+OP_EQUALVERIFY  = Opcode(value='OP_EQUALVERIFY', category='bitwise logic', arg_count=2, code=0x88)
 
 # Arithmetic
-OP_RESERVED1            = Opcode(value='OP_RESERVED1', category='arithmetic')
-OP_RESERVED2            = Opcode(value='OP_RESERVED2', category='arithmetic')
-OP_1ADD                 = Opcode(value='OP_1ADD', category='arithmetic', arg_count=1)
-OP_1SUB                 = Opcode(value='OP_1SUB', category='arithmetic', arg_count=1)
-OP_2MUL                 = Opcode(value='OP_2MUL', category='arithmetic', disabled=True)
-OP_2DIV                 = Opcode(value='OP_2DIV', category='arithmetic', disabled=True)
-OP_NEGATE               = Opcode(value='OP_NEGATE', category='arithmetic', arg_count=1)
-OP_ABS                  = Opcode(value='OP_ABS', category='arithmetic', arg_count=1)
-OP_NOT                  = Opcode(value='OP_NOT', category='arithmetic', arg_count=1)
-OP_0NOTEQUAL            = Opcode(value='OP_0NOTEQUAL', category='arithmetic', arg_count=1)
-OP_ADD                  = Opcode(value='OP_ADD', category='arithmetic', arg_count=2)
-OP_SUB                  = Opcode(value='OP_SUB', category='arithmetic', arg_count=2)
-OP_MUL                  = Opcode(value='OP_MUL', category='arithmetic', arg_count=2, disabled=True)
-OP_DIV                  = Opcode(value='OP_DIV', category='arithmetic', arg_count=2, disabled=True)
-OP_MOD                  = Opcode(value='OP_MOD', category='arithmetic', arg_count=2, disabled=True)
-OP_LSHIFT               = Opcode(value='OP_LSHIFT', category='arithmetic', arg_count=2, disabled=True)
-OP_RSHIFT               = Opcode(value='OP_RSHIFT', category='arithmetic', arg_count=2, disabled=True)
-OP_BOOLAND              = Opcode(value='OP_BOOLAND', category='arithmetic', arg_count=2)
-OP_BOOLOR               = Opcode(value='OP_BOOLOR', category='arithmetic', arg_count=2)
-OP_NUMEQUAL             = Opcode(value='OP_NUMEQUAL', category='arithmetic', arg_count=2)
-OP_NUMEQUALVERIFY       = Opcode(value='OP_NUMEQUALVERIFY', category='arithmetic', arg_count=2)
-OP_NUMNOTEQUAL          = Opcode(value='OP_NUMNOTEQUAL', category='arithmetic', arg_count=2)
-OP_LESSTHAN             = Opcode(value='OP_LESSTHAN', category='arithmetic', arg_count=2)
-OP_GREATERTHAN          = Opcode(value='OP_GREATERTHAN', category='arithmetic', arg_count=2)
-OP_LESSTHANOREQUAL      = Opcode(value='OP_LESSTHANOREQUAL', category='arithmetic', arg_count=2)
-OP_GREATERTHANOREQUAL   = Opcode(value='OP_GREATERTHANOREQUAL', category='arithmetic', arg_count=2)
-OP_MIN                  = Opcode(value='OP_MIN', category='arithmetic', arg_count=2)
-OP_MAX                  = Opcode(value='OP_MAX', category='arithmetic', arg_count=2)
-OP_WITHIN               = Opcode(value='OP_WITHIN', category='arithmetic', arg_count=3)
+OP_RESERVED1            = Opcode(value='OP_RESERVED1', category='arithmetic', code=0x89)
+OP_RESERVED2            = Opcode(value='OP_RESERVED2', category='arithmetic', code=0x8a)
+OP_1ADD                 = Opcode(value='OP_1ADD', category='arithmetic', arg_count=1, code=0x8b)
+OP_1SUB                 = Opcode(value='OP_1SUB', category='arithmetic', arg_count=1, code=0x8c)
+OP_2MUL                 = Opcode(value='OP_2MUL', category='arithmetic', disabled=True, code=0x8d)
+OP_2DIV                 = Opcode(value='OP_2DIV', category='arithmetic', disabled=True, code=0x8e)
+OP_NEGATE               = Opcode(value='OP_NEGATE', category='arithmetic', arg_count=1, code=0x8f)
+OP_ABS                  = Opcode(value='OP_ABS', category='arithmetic', arg_count=1, code=0x90)
+OP_NOT                  = Opcode(value='OP_NOT', category='arithmetic', arg_count=1, code=0x91)
+OP_0NOTEQUAL            = Opcode(value='OP_0NOTEQUAL', category='arithmetic', arg_count=1, code=0x92)
+OP_ADD                  = Opcode(value='OP_ADD', category='arithmetic', arg_count=2, code=0x93)
+OP_SUB                  = Opcode(value='OP_SUB', category='arithmetic', arg_count=2, code=0x94)
+OP_MUL                  = Opcode(value='OP_MUL', category='arithmetic', arg_count=2, disabled=True, code=0x95)
+OP_DIV                  = Opcode(value='OP_DIV', category='arithmetic', arg_count=2, disabled=True, code=0x96)
+OP_MOD                  = Opcode(value='OP_MOD', category='arithmetic', arg_count=2, disabled=True, code=0x97)
+OP_LSHIFT               = Opcode(value='OP_LSHIFT', category='arithmetic', arg_count=2, disabled=True, code=0x98)
+OP_RSHIFT               = Opcode(value='OP_RSHIFT', category='arithmetic', arg_count=2, disabled=True, code=0x99)
+OP_BOOLAND              = Opcode(value='OP_BOOLAND', category='arithmetic', arg_count=2, code=0x9a)
+OP_BOOLOR               = Opcode(value='OP_BOOLOR', category='arithmetic', arg_count=2, code=0x9b)
+OP_NUMEQUAL             = Opcode(value='OP_NUMEQUAL', category='arithmetic', arg_count=2, code=0x9c)
+OP_NUMEQUALVERIFY       = Opcode(value='OP_NUMEQUALVERIFY', category='arithmetic', arg_count=2, code=0x9d)
+OP_NUMNOTEQUAL          = Opcode(value='OP_NUMNOTEQUAL', category='arithmetic', arg_count=2, code=0x9e)
+OP_LESSTHAN             = Opcode(value='OP_LESSTHAN', category='arithmetic', arg_count=2, code=0x9f)
+OP_GREATERTHAN          = Opcode(value='OP_GREATERTHAN', category='arithmetic', arg_count=2, code=0xa0)
+OP_LESSTHANOREQUAL      = Opcode(value='OP_LESSTHANOREQUAL', category='arithmetic', arg_count=2, code=0xa1)
+OP_GREATERTHANOREQUAL   = Opcode(value='OP_GREATERTHANOREQUAL', category='arithmetic', arg_count=2, code=0xa2)
+OP_MIN                  = Opcode(value='OP_MIN', category='arithmetic', arg_count=2, code=0xa3)
+OP_MAX                  = Opcode(value='OP_MAX', category='arithmetic', arg_count=2, code=0xa4)
+OP_WITHIN               = Opcode(value='OP_WITHIN', category='arithmetic', arg_count=3, code=0xa5)
 
 # Crypto
-OP_RIPEMD160            = Opcode(value='OP_RIPEMD160', category='crypto')
-OP_SHA1                 = Opcode(value='OP_SHA1', category='crypto')
-OP_SHA256               = Opcode(value='OP_SHA256', category='crypto')
-OP_HASH160              = Opcode(value='OP_HASH160', category='crypto')
-OP_HASH256              = Opcode(value='OP_HASH256', category='crypto')
-OP_CODESEPARATOR        = Opcode(value='OP_CODESEPARATOR', category='crypto')
-OP_CHECKSIG             = Opcode(value='OP_CHECKSIG', category='crypto')
-OP_CHECKSIGVERIFY       = Opcode(value='OP_CHECKSIGVERIFY', category='crypto')
-OP_CHECKMULTISIG        = Opcode(value='OP_CHECKMULTISIG', category='crypto')
-OP_CHECKMULTISIGVERIFY  = Opcode(value='OP_CHECKMULTISIGVERIFY', category='crypto')
+OP_RIPEMD160            = Opcode(value='OP_RIPEMD160', category='crypto', arg_count=1, code=0xa6)
+OP_SHA1                 = Opcode(value='OP_SHA1', category='crypto', arg_count=1, code=0xa7)
+OP_SHA256               = Opcode(value='OP_SHA256', category='crypto', arg_count=1, code=0xa8)
+OP_HASH160              = Opcode(value='OP_HASH160', category='crypto', arg_count=1, code=0xa9)
+OP_HASH256              = Opcode(value='OP_HASH256', category='crypto', arg_count=1, code=0xaa)
+OP_CODESEPARATOR        = Opcode(value='OP_CODESEPARATOR', category='crypto', code=0xab)
+OP_CHECKSIG             = Opcode(value='OP_CHECKSIG', category='crypto', arg_count=2, code=0xac)
+OP_CHECKSIGVERIFY       = Opcode(value='OP_CHECKSIGVERIFY', category='crypto', arg_count=2, code=0xad)
+OP_CHECKMULTISIG        = Opcode(value='OP_CHECKMULTISIG', category='crypto', arg_count=1, code=0xae)
+OP_CHECKMULTISIGVERIFY  = Opcode(value='OP_CHECKMULTISIGVERIFY', category='crypto', arg_count=1, code=0xaf)
 
 # Locktime
-OP_CHECKLOCKTIMEVERIFY  = Opcode(value='OP_CHECKLOCKTIMEVERIFY', category='locktime')
-OP_CHECKSEQUENCEVERIFY  = Opcode(value='OP_CHECKSEQUENCEVERIFY', category='locktime')
+OP_CHECKLOCKTIMEVERIFY  = Opcode(value='OP_CHECKLOCKTIMEVERIFY', category='locktime', arg_count=1, code=0xb1)
+OP_CHECKSEQUENCEVERIFY  = Opcode(value='OP_CHECKSEQUENCEVERIFY', category='locktime', arg_count=1, code=0xb2)
+
+# Reserved no-ops
+OP_NOP1                 = Opcode(value='OP_NOP1', category='flow control', code=0xb0)
+OP_NOP4                 = Opcode(value='OP_NOP4', category='flow control', code=0xb3)
+OP_NOP5                 = Opcode(value='OP_NOP5', category='flow control', code=0xb4)
+OP_NOP6                 = Opcode(value='OP_NOP6', category='flow control', code=0xb5)
+OP_NOP7                 = Opcode(value='OP_NOP7', category='flow control', code=0xb6)
+OP_NOP8                 = Opcode(value='OP_NOP8', category='flow control', code=0xb7)
+OP_NOP9                 = Opcode(value='OP_NOP9', category='flow control', code=0xb8)
+OP_NOP10                = Opcode(value='OP_NOP10', category='flow control', code=0xb9)
 
 
 OPCODES = {
@@ -254,69 +317,21 @@ OPCODES = {
 
     "OP_CHECKLOCKTIMEVERIFY": OP_CHECKLOCKTIMEVERIFY,
     "OP_CHECKSEQUENCEVERIFY": OP_CHECKSEQUENCEVERIFY,
+
+    "OP_NOP1": OP_NOP1,
+    "OP_NOP4": OP_NOP4,
+    "OP_NOP5": OP_NOP5,
+    "OP_NOP6": OP_NOP6,
+    "OP_NOP7": OP_NOP7,
+    "OP_NOP8": OP_NOP8,
+    "OP_NOP9": OP_NOP9,
+    "OP_NOP10": OP_NOP10,
 }
 
-# Opcodes that take ONE value as input, and returns one value as output
-UNARY_OPS = [
-    OP_1ADD,
-    OP_1SUB,
-    OP_NEGATE,
-    OP_ABS,
-    OP_NOT,
-    OP_0NOTEQUAL,
-]
-
-# Opcodes that take TWO values as inputs, and returns ONE value as output
-BINARY_OPS = [
-    OP_ADD,
-    OP_SUB,
-    OP_BOOLAND,
-    OP_BOOLOR,
-    OP_NUMEQUAL,
-    OP_NUMEQUALVERIFY,
-    OP_NUMNOTEQUAL,
-    OP_LESSTHAN,
-    OP_GREATERTHAN,
-    OP_LESSTHANOREQUAL,
-    OP_GREATERTHANOREQUAL,
-    OP_MIN,
-    OP_MAX,
-]
-
-# Opcodes that modify the stack
-STACK_OPS = [
-    OP_DEPTH,
-    OP_DUP,
-    OP_DROP,
-    OP_2DROP,
-    OP_2DUP,
-    OP_2OVER,
-    OP_2ROT,
-    OP_2SWAP,
-    OP_3DUP,
-    OP_IFDUP,
-    OP_NIP,
-    OP_OVER,
-    OP_PICK,
-    OP_ROLL,
-    OP_ROT,
-    OP_SWAP,
-    OP_TUCK,
-]
-
-# Opcodes that deal with pubkeys and signatures
-SIGNATURE_OPS = [
-    OP_CHECKSIG,
-    OP_CHECKSIGVERIFY,
-    OP_CHECKMULTISIG,
-    OP_CHECKMULTISIGVERIFY,
-]
-
-# Opcodes that deal with equality
-EQUALITY_OPS = [
-    OP_EQUAL,
-    OP_EQUALVERIFY
-]
+# Opcodes indexed by their code, None for codes with no opcode defined
+OPCODES_BY_CODE: list[Opcode | None] = [None] * 256
+for opcode in OPCODES.values():
+    OPCODES_BY_CODE[opcode.code] = opcode
 
 def str_to_op(s: str):
     s = s.upper()
@@ -326,7 +341,7 @@ def str_to_op(s: str):
 
     if s.startswith("SIG") or s.startswith("PK"):
         val = s
-    elif s.isdigit() or (len(s) > 1 and s[1:].isdigit()):
+    elif s.isdigit() or (len(s) > 1 and s[0] == "-" and s[1:].isdigit()):
         val = int(s)
     else:
         val = s
@@ -335,4 +350,88 @@ def str_to_op(s: str):
 
 
 def construct_script(script: str) -> list[ScriptOp]:
-    return [str_to_op(op) for op in script.split()]
\ No newline at end of file
+    return [str_to_op(op) for op in script.split()]
+
+
+# Script numbers are stored in the minimal little-endian sign-magnitude
+# encoding, and the arithmetic opcodes only accept operands of up to 4 bytes
+MAX_NUM_SIZE = 4
+MAX_NUM = 2 ** (8 * MAX_NUM_SIZE - 1)
+
+def encode_num(value: int) -> bytes:
+    if value == 0:
+        return b""
+    magnitude = abs(value)
+    data = bytearray(magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "little"))
+    if data[-1] & 0x80:
+        data.append(0x80 if value < 0 else 0)
+    elif value < 0:
+        data[-1] |= 0x80
+    return bytes(data)
+
+def decode_num(data: bytes | memoryview, max_size: int = MAX_NUM_SIZE) -> int:
+    if len(data) > max_size:
+        raise ValueError(f"Numbers are limited to {max_size} bytes, but found {len(data)}")
+    if len(data) == 0:
+        return 0
+    # the last byte only holds the sign when the one before needs its top bit
+    if data[-1] & 0x7f == 0 and (len(data) == 1 or not data[-2] & 0x80):
+        raise ValueError(f"Number {data.hex()} is not minimally encoded")
+
+    value = int.from_bytes(data, "little")
+    if data[-1] & 0x80:
+        return -(value ^ (0x80 << 8 * (len(data) - 1)))
+    return value
+
+
+# The data pushed by OP_0, OP_1NEGATE and OP_1..OP_16, indexed by opcode code.
+# Each is created once, with its bytes precomputed.
+NUMBER_CONSTANTS: dict[int, Data] = {OP_0.code: Data(value=0), OP_1NEGATE.code: Data(value=-1)}
+for n in range(1, 17):
+    NUMBER_CONSTANTS[OPCODES[f"OP_{n}"].code] = Data(value=n)
+for constant in NUMBER_CONSTANTS.values():
+    constant.as_bytes()
+
+
+# Raised for serialized scripts that can't be parsed
+class ScriptParseError(ValueError):
+    pass
+
+
+# Parses a serialized script into its ops. Pushed data is returned as
+# memoryview slices of script, so payloads are never copied.
+def deserialize_script(script: bytes | memoryview) -> list[ScriptOp]:
+    view = memoryview(script)
+    ops = []
+    i, end = 0, len(view)
+
+    while i < end:
+        start = i
+        code = view[i]
+        i += 1
+
+        if 0x01 <= code <= 0x4b:
+            size = code
+        elif code == 0x4c:
+            size = view[i] if i < end else -1
+            i += 1
+        elif code == 0x4d:
+            size = int.from_bytes(view[i:i + 2], "little") if i + 2 <= end else -1
+            i += 2
+        elif code == 0x4e:
+            size = int.from_bytes(view[i:i + 4], "little") if i + 4 <= end else -1
+            i += 4
+        else:
+            opcode = OPCODES_BY_CODE[code]
+            if opcode is None:
+                raise ScriptParseError(f"Unknown opcode 0x{code:02x} at byte {start}")
+            ops.append(opcode)
+            continue
+
+        if size < 0 or i + size > end:
+            raise ScriptParseError(f"Push of 0x{code:02x} at byte {start} runs past the end of the script")
+
+        ops.append(Data(value=view[i:i + size]))
+        i += size
+
+    return ops
\ No newline at end of file
@@ -0,0 +1,209 @@
+from enum import Enum
+from opcodes import *
+
+
+# Consensus limits on scripts
+MAX_SCRIPT_SIZE = 10_000    # bytes of a serialized script
+MAX_OPS_PER_SCRIPT = 201    # non-push opcodes, plus the pubkeys of every multisig
+MAX_STACK_SIZE = 1_000      # items on the main and alt stacks combined
+MAX_ELEMENT_SIZE = 520      # bytes of a stack item
+MAX_PUBKEYS_PER_MULTISIG = 20
+
+
+# A script compiled once into a form the simulator can execute any number of
+# times. Each instruction in code is either an opcode code (>= 0), or ~i for a
+# push of consts[i]. ops keeps the original script items for traces, and jumps
+# maps the position of every IF/NOTIF/ELSE to the position execution continues
+# at when the branch that follows it is skipped. unbalanced is the position of
+# the first IF/NOTIF/ELSE/ENDIF that isn't properly nested, if any, and
+# always_fails the position of the first op that fails the script even in a
+# branch that isn't executed. size,
+# op_count and max_push measure the script against the consensus limits: its
+# serialized size in bytes, its number of non-push opcodes, and the size of its
+# largest push. starts holds the positions where the scripts joined with +
+# after the first one start, and op_counts the op count of each of them.
+class Program:
+    __slots__ = ("ops", "code", "consts", "jumps", "unbalanced", "always_fails", "size", "op_count", "max_push", "starts", "op_counts")
+
+    def __init__(self, ops: tuple[ScriptOp, ...], code: tuple[int, ...], consts: tuple[Data, ...], jumps: dict[int, int], unbalanced: int | None = None,
+                 always_fails: int | None = None, size: int = 0, op_count: int = 0, max_push: int = 0, starts: tuple[int, ...] = (),
+                 op_counts: tuple[int, ...] | None = None) -> None:
+        self.ops = ops
+        self.code = code
+        self.consts = consts
+        self.jumps = jumps
+        self.unbalanced = unbalanced
+        self.always_fails = always_fails
+        self.size = size
+        self.op_count = op_count
+        self.max_push = max_push
+        self.starts = starts
+        self.op_counts = op_counts if op_counts is not None else (op_count,)
+
+    def __len__(self) -> int:
+        return len(self.code)
+
+    def __repr__(self) -> str:
+        return f"Program({list(self.ops)})"
+
+    # Runs other after self, e.g. an unlocking script followed by a compiled
+    # locking script, without compiling either of them again. As in Bitcoin,
+    # conditionals can't span the two scripts, the size and op count limits
+    # apply to each script on its own, and each script starts with an empty
+    # alt stack.
+    def __add__(self, other: "Program") -> "Program":
+        offset, const_offset = len(self.code), len(self.consts)
+        code = self.code + tuple(c if c >= 0 else ~(~c + const_offset) for c in other.code)
+        jumps = self.jumps | {pc + offset: target + offset for pc, target in other.jumps.items()}
+        unbalanced = self.unbalanced if other.unbalanced is None or self.unbalanced is not None else other.unbalanced + offset
+        always_fails = self.always_fails if other.always_fails is None or self.always_fails is not None else other.always_fails + offset
+        starts = self.starts + (offset,) + tuple(start + offset for start in other.starts)
+        return Program(self.ops + other.ops, code, self.consts + other.consts, jumps, unbalanced, always_fails,
+                       max(self.size, other.size), max(self.op_count, other.op_count), max(self.max_push, other.max_push), starts,
+                       self.op_counts + other.op_counts)
+
+
+# Finds, for every IF/NOTIF/ELSE, the next ELSE or ENDIF at the same nesting
+# level. Unbalanced conditionals are left without a target.
+def find_jumps(code: tuple[int, ...]) -> dict[int, int]:
+    jumps = {}
+    open_branches = []
+
+    for pc, c in enumerate(code):
+        if c == OP_IF.code or c == OP_NOTIF.code:
+            open_branches.append(pc)
+        elif c == OP_ELSE.code and open_branches:
+            jumps[open_branches.pop()] = pc + 1
+            open_branches.append(pc)
+        elif c == OP_ENDIF.code and open_branches:
+            jumps[open_branches.pop()] = pc + 1
+
+    return jumps
+
+
+def find_unbalanced(code: tuple[int, ...]) -> int | None:
+    open_branches = []
+
+    for pc, c in enumerate(code):
+        if c == OP_IF.code or c == OP_NOTIF.code:
+            open_branches.append(pc)
+        elif c == OP_ELSE.code and not open_branches:
+            return pc
+        elif c == OP_ENDIF.code:
+            if not open_branches:
+                return pc
+            open_branches.pop()
+
+    return open_branches[0] if open_branches else None
+
+
+# Disabled opcodes and OP_VERIF/OP_VERNOTIF fail a script wherever they are,
+# executed or not
+ALWAYS_FAILING = frozenset({opcode.code for opcode in OPCODES_BY_CODE if opcode is not None and opcode.disabled} | {OP_VERIF.code, OP_VERNOTIF.code})
+
+def find_always_failing(code: tuple[int, ...]) -> int | None:
+    for pc, c in enumerate(code):
+        if c in ALWAYS_FAILING:
+            return pc
+    return None
+
+
+def data_size(data: Data) -> int:
+    return len(data.as_bytes())
+
+# Bytes the push of data takes in a serialized script, with the smallest push opcode
+def push_size(data: Data) -> int:
+    if type(data.value) is int and -1 <= data.value <= 16:
+        return 1
+    size = data_size(data)
+    if size <= 75:
+        return 1 + size
+    if size <= 0xff:
+        return 2 + size
+    if size <= 0xffff:
+        return 3 + size
+    return 5 + size
+
+
+# Compiles a list of ops. The serialized size of the script is computed from
+# the ops unless it's known from the bytes they were parsed from.
+# OP_0, OP_1NEGATE and OP_1..OP_16 compile to pushes of NUMBER_CONSTANTS.
+def compile_ops(ops: list[ScriptOp], size: int | None = None) -> Program:
+    ops = tuple(ops)
+    code = []
+    consts = []
+    op_count = 0
+    max_push = 0
+    ops_size = 0
+
+    for op in ops:
+        if type(op) is Data:
+            code.append(~len(consts))
+            consts.append(op)
+            max_push = max(max_push, data_size(op))
+            ops_size += push_size(op)
+        elif op.code in NUMBER_CONSTANTS:
+            # small numbers are pushed from their precomputed constants
+            code.append(~len(consts))
+            consts.append(NUMBER_CONSTANTS[op.code])
+            ops_size += 1
+        else:
+            code.append(op.code)
+            op_count += op.code > OP_16.code
+            ops_size += 1
+
+    if size is None:
+        size = ops_size
+
+    code = tuple(code)
+    return Program(ops, code, tuple(consts), find_jumps(code), find_unbalanced(code), find_always_failing(code), size, op_count, max_push)
+
+
+# How the text of a script is written: whitespace separated opcodes and data
+# (asm), or the serialized script bytes in hexadecimal (hex)
+class ScriptEncoding(str, Enum):
+    ASM = "asm"
+    HEX = "hex"
+
+
+# The tokens construct_script parses a script from, which is also the form
+# scripts are cached under: "op_dup  1" and "OP_DUP 1" normalize the same.
+def normalize_script(script: str) -> tuple[str, ...]:
+    tokens = tuple(script.upper().split())
+    # every token takes at least a byte, so longer scripts are rejected before compiling them
+    if len(tokens) > MAX_SCRIPT_SIZE:
+        raise ScriptParseError(f"Script has {len(tokens)} items, more than the {MAX_SCRIPT_SIZE} bytes a script may take")
+    return tokens
+
+
+def compile_tokens(tokens: tuple[str, ...]) -> Program:
+    return compile_ops([str_to_op(token) for token in tokens])
+
+
+def compile_script(script: str) -> Program:
+    return compile_ops(construct_script(script))
+
+
+def compile_bytes(script: bytes | memoryview) -> Program:
+    return compile_ops(deserialize_script(script), len(script))
+
+
+# Normalizes a script written in the given encoding into the key it is cached
+# under: its tokens for asm, or its bytes for hex
+def normalize(script: str, encoding: ScriptEncoding) -> tuple[str, ...] | bytes:
+    if encoding == ScriptEncoding.HEX:
+        try:
+            data = bytes.fromhex(script)
+        except ValueError as error:
+            raise ScriptParseError(f"Invalid hex script: {error}")
+        if len(data) > MAX_SCRIPT_SIZE:
+            raise ScriptParseError(f"Script is {len(data)} bytes, more than the limit of {MAX_SCRIPT_SIZE}")
+        return data
+    return normalize_script(script)
+
+
+# Compiles a script from the key normalize returned for it
+def compile_normalized(key: tuple[str, ...] | bytes) -> Program:
+    if type(key) is bytes:
+        return compile_bytes(key)
+    return compile_tokens(key)
@@ -0,0 +1,294 @@
+import hashlib
+import secrets
+
+# libsecp256k1 bindings are used when they're installed, otherwise everything
+# runs on the pure Python arithmetic below
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+
+# Curve parameters: y^2 = x^3 + 7 over the field of size P, with a generator G
+# of prime order N
+P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (
+    0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+    0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8,
+)
+
+# Points are affine (x, y) tuples, or None for the point at infinity. The
+# arithmetic works on Jacobian (X, Y, Z) coordinates, with x = X/Z^2 and
+# y = Y/Z^3, so that adding and doubling don't need a modular inverse.
+Point = tuple[int, int] | None
+
+INFINITY = (1, 1, 0)
+
+
+def _jacobian(point: Point) -> tuple[int, int, int]:
+    return INFINITY if point is None else (point[0], point[1], 1)
+
+def _affine(point: tuple[int, int, int]) -> Point:
+    x, y, z = point
+    if z == 0:
+        return None
+    z_inv = pow(z, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return x * z_inv2 % P, y * z_inv2 * z_inv % P
+
+def _double(point: tuple[int, int, int]) -> tuple[int, int, int]:
+    x, y, z = point
+    if z == 0 or y == 0:
+        return INFINITY
+    yy = y * y % P
+    s = 4 * x * yy % P
+    m = 3 * x * x % P
+    x3 = (m * m - 2 * s) % P
+    return x3, (m * (s - x3) - 8 * yy * yy) % P, 2 * y * z % P
+
+def _add(p1: tuple[int, int, int], p2: tuple[int, int, int]) -> tuple[int, int, int]:
+    x1, y1, z1 = p1
+    x2, y2, z2 = p2
+    if z1 == 0:
+        return p2
+    if z2 == 0:
+        return p1
+
+    z1z1 = z1 * z1 % P
+    z2z2 = z2 * z2 % P
+    u1 = x1 * z2z2 % P
+    u2 = x2 * z1z1 % P
+    s1 = y1 * z2 * z2z2 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u1 == u2:
+        return _double(p1) if s1 == s2 else INFINITY
+
+    h = u2 - u1
+    r = s2 - s1
+    hh = h * h % P
+    hhh = h * hh % P
+    v = u1 * hh % P
+    x3 = (r * r - hhh - 2 * v) % P
+    return x3, (r * (v - x3) - s1 * hhh) % P, z1 * z2 * h % P
+
+
+# Computes k1*P1 + k2*P2 + ... with Pippenger's bucket method: the scalars are
+# read c bits at a time, and each point is added once per window into the
+# bucket of its digit. All the terms share the same 256 doublings, so the cost
+# per term shrinks as more terms are combined, which is what makes verifying
+# signatures in batches cheaper than one at a time.
+def multi_mul(terms: list[tuple[int, Point]]) -> Point:
+    terms = [(k % N, _jacobian(point)) for k, point in terms if point is not None]
+    c = 1 if len(terms) < 4 else min(16, len(terms).bit_length() - 1)
+    mask = (1 << c) - 1
+
+    result = INFINITY
+    for shift in reversed(range(0, 256, c)):
+        for _ in range(c):
+            result = _double(result)
+
+        buckets = [INFINITY] * (mask + 1)
+        for k, point in terms:
+            digit = (k >> shift) & mask
+            if digit:
+                buckets[digit] = _add(buckets[digit], point)
+
+        # sum of digit * bucket, as a running sum of the buckets from the top
+        running = total = INFINITY
+        for digit in range(mask, 0, -1):
+            running = _add(running, buckets[digit])
+            total = _add(total, running)
+        result = _add(result, total)
+
+    return _affine(result)
+
+def point_mul(k: int, point: Point = G) -> Point:
+    return multi_mul([(k, point)])
+
+
+# The point with coordinate x and an even y, if there is one
+def lift_x(x: int) -> Point:
+    if x >= P:
+        return None
+    c = (pow(x, 3, P) + 7) % P
+    y = pow(c, (P + 1) // 4, P)
+    if y * y % P != c:
+        return None
+    return x, y if y % 2 == 0 else P - y
+
+# Parses a compressed (33 bytes) or uncompressed (65 bytes) SEC public key
+def parse_pubkey(data: bytes) -> Point:
+    if len(data) == 33 and data[0] in (2, 3):
+        point = lift_x(int.from_bytes(data[1:], "big"))
+        if point is None:
+            return None
+        x, y = point
+        return (x, y) if y % 2 == data[0] % 2 else (x, P - y)
+
+    if len(data) == 65 and data[0] == 4:
+        x, y = int.from_bytes(data[1:33], "big"), int.from_bytes(data[33:], "big")
+        if x >= P or y >= P or (y * y - x * x * x - 7) % P != 0:
+            return None
+        return x, y
+
+    return None
+
+def serialize_pubkey(point: Point, compressed: bool = True) -> bytes:
+    x, y = point
+    if compressed:
+        return bytes([2 + y % 2]) + x.to_bytes(32, "big")
+    return b"\x04" + x.to_bytes(32, "big") + y.to_bytes(32, "big")
+
+
+# Parses a DER encoded ECDSA signature into its (r, s) integers
+def parse_der(signature: bytes) -> tuple[int, int] | None:
+    if len(signature) < 8 or signature[0] != 0x30 or signature[1] != len(signature) - 2:
+        return None
+
+    values = []
+    position = 2
+    for _ in range(2):
+        if position + 2 > len(signature) or signature[position] != 0x02:
+            return None
+        length = signature[position + 1]
+        value = signature[position + 2:position + 2 + length]
+        if length == 0 or len(value) != length:
+            return None
+        values.append(int.from_bytes(value, "big"))
+        position += 2 + length
+
+    if position != len(signature):
+        return None
+    return values[0], values[1]
+
+def encode_der(r: int, s: int) -> bytes:
+    def integer(value: int) -> bytes:
+        data = value.to_bytes((value.bit_length() + 8) // 8, "big")
+        return bytes([0x02, len(data)]) + data
+
+    body = integer(r) + integer(s)
+    return bytes([0x30, len(body)]) + body
+
+
+# Verifies a DER signature of a 32 byte message hash. As in Bitcoin's
+# consensus rules, signatures with a high s are accepted.
+def verify_ecdsa(msg_hash: bytes, signature: bytes, pubkey: bytes) -> bool:
+    rs = parse_der(signature)
+    if rs is None:
+        return False
+    r, s = rs
+    if not (0 < r < N and 0 < s < N):
+        return False
+
+    if coincurve is not None:
+        try:
+            return coincurve.PublicKey(pubkey).verify(encode_der(r, min(s, N - s)), msg_hash, hasher=None)
+        except ValueError:
+            return False
+
+    point = parse_pubkey(pubkey)
+    if point is None:
+        return False
+
+    z = int.from_bytes(msg_hash, "big")
+    s_inv = pow(s, -1, N)
+    R = multi_mul([(z * s_inv, G), (r * s_inv, point)])
+    return R is not None and R[0] % N == r
+
+def sign_ecdsa(secret: int, msg_hash: bytes, nonce: int | None = None) -> bytes:
+    z = int.from_bytes(msg_hash, "big")
+    while True:
+        k = nonce or secrets.randbelow(N - 1) + 1
+        r = point_mul(k)[0] % N
+        s = pow(k, -1, N) * (z + r * secret) % N
+        if r and s:
+            return encode_der(r, min(s, N - s))
+        nonce = None
+
+
+def tagged_hash(tag: str, data: bytes) -> bytes:
+    tag_hash = hashlib.sha256(tag.encode()).digest()
+    return hashlib.sha256(tag_hash + tag_hash + data).digest()
+
+# Parses the parts of a BIP340 check: the (r, s) of the 64 byte signature, the
+# lifted x-only pubkey, and the challenge e
+def _schnorr_terms(msg: bytes, signature: bytes, pubkey: bytes) -> tuple[int, int, Point, int] | None:
+    if len(signature) != 64 or len(pubkey) != 32:
+        return None
+    point = lift_x(int.from_bytes(pubkey, "big"))
+    r, s = int.from_bytes(signature[:32], "big"), int.from_bytes(signature[32:], "big")
+    if point is None or r >= P or s >= N:
+        return None
+    e = int.from_bytes(tagged_hash("BIP0340/challenge", signature[:32] + pubkey + msg), "big") % N
+    return r, s, point, e
+
+# Verifies a BIP340 Schnorr signature against an x-only public key
+def verify_schnorr(msg: bytes, signature: bytes, pubkey: bytes) -> bool:
+    xonly = getattr(coincurve, "PublicKeyXOnly", None)
+    if xonly is not None:
+        try:
+            return xonly(pubkey).verify(signature, msg)
+        except ValueError:
+            return False
+
+    terms = _schnorr_terms(msg, signature, pubkey)
+    if terms is None:
+        return False
+    r, s, point, e = terms
+    R = multi_mul([(s, G), (N - e, point)])
+    return R is not None and R[1] % 2 == 0 and R[0] == r
+
+# Verifies BIP340 signatures all at once: with random weights a_i (a_1 = 1),
+# they are all valid only if (sum a_i*s_i)*G = sum a_i*R_i + sum a_i*e_i*P_i,
+# which is a single multi-scalar multiplication
+def verify_schnorr_batch(items: list[tuple[bytes, bytes, bytes]]) -> bool:
+    terms = []
+    s_sum = 0
+    for i, (msg, signature, pubkey) in enumerate(items):
+        parsed = _schnorr_terms(msg, signature, pubkey)
+        if parsed is None:
+            return False
+        r, s, point, e = parsed
+        R = lift_x(r)
+        if R is None:
+            return False
+
+        a = 1 if i == 0 else secrets.randbelow(N - 1) + 1
+        s_sum += a * s
+        terms.append((N - a, R))
+        terms.append((N - a * e % N, point))
+
+    terms.append((s_sum, G))
+    return multi_mul(terms) is None
+
+def sign_schnorr(secret: int, msg: bytes, aux: bytes = bytes(32)) -> bytes:
+    x, y = point_mul(secret)
+    d = secret if y % 2 == 0 else N - secret
+    pubkey = x.to_bytes(32, "big")
+
+    t = (d ^ int.from_bytes(tagged_hash("BIP0340/aux", aux), "big")).to_bytes(32, "big")
+    k = int.from_bytes(tagged_hash("BIP0340/nonce", t + pubkey + msg), "big") % N
+    rx, ry = point_mul(k)
+    k = k if ry % 2 == 0 else N - k
+    r = rx.to_bytes(32, "big")
+
+    e = int.from_bytes(tagged_hash("BIP0340/challenge", r + pubkey + msg), "big") % N
+    return r + ((k + e * d) % N).to_bytes(32, "big")
+
+
+# Collects Schnorr checks from many simulations and verifies them in one batch.
+# Each check is recorded with the simulation it belongs to, so that when the
+# batch fails the checks are redone one at a time to find the culprits.
+class BatchVerifier:
+    def __init__(self) -> None:
+        self.checks: list[tuple[int, bytes, bytes, bytes]] = []
+
+    def add(self, owner: int, msg: bytes, signature: bytes, pubkey: bytes) -> None:
+        self.checks.append((owner, msg, signature, pubkey))
+
+    # owners of the checks that failed
+    def verify(self) -> set[int]:
+        if not self.checks or verify_schnorr_batch([check[1:] for check in self.checks]):
+            return set()
+        return {owner for owner, *check in self.checks if not verify_schnorr(*check)}
@@ -1,9 +1,48 @@
-from fastapi import FastAPI
+import json
+import os
+import time
+from cache import LRUCache
+from contextlib import asynccontextmanager, contextmanager
+from enum import Enum
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
-from simulator import construct_script, simulate_script, print_simulation
+from log import LOG_TRACES, get_logger
+from models import SimulationModel, step_to_model
+from pydantic import TypeAdapter
+from opcodes import ScriptParseError
+from program import ScriptEncoding, normalize
+from simulator import ScriptContext, TraceMode, iter_simulation
+from templates import classify
+from transaction import TransactionParseError
+from workers import PoolBusy, SimulationPool, TransactionKey, get_program, get_transaction, simulate_chunk, simulate_job
 
 
-app = FastAPI()
+# Cache of finished simulations, weighed by the number of script and stack items
+# in their steps. Compiled programs are cached by the workers running them.
+RESULT_CACHE_CAPACITY = int(os.environ.get("BTC_SCRIPT_RESULT_CACHE_CAPACITY", 10_000_000))
+CACHE_TTL = float(os.environ.get("BTC_SCRIPT_CACHE_TTL", 3600))
+
+def simulation_size(sim: SimulationModel) -> int:
+    return sum(len(step.script) + len(step.stack) + len(step.altstack) + 1 for step in sim.steps)
+
+RESULT_CACHE = LRUCache(RESULT_CACHE_CAPACITY, CACHE_TTL, sizeof=simulation_size)
+
+BATCH_ADAPTER = TypeAdapter(list[SimulationModel])
+
+POOL = SimulationPool()
+
+logger = get_logger("server")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    POOL.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost",
@@ -23,13 +62,197 @@ app.add_middleware(
 async def root():
     return {'message': 'welcome to btc-script'}
 
+
+# turns scripts that fail to parse and failures of jobs on the simulation pool
+# into HTTP errors
+@contextmanager
+def pool_errors():
+    try:
+        yield
+    except (ScriptParseError, TransactionParseError) as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except PoolBusy as error:
+        raise HTTPException(status_code=503, detail=f"Simulation queue is full: {error}")
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Simulation timed out after {POOL.timeout}s")
+
+
+# Signatures are checked against the sighash given as a hex query parameter,
+# which has to be a 32 byte hash
+def parse_sighash(sighash: str | None) -> bytes | None:
+    if sighash is None:
+        return None
+    try:
+        digest = bytes.fromhex(sighash)
+    except ValueError:
+        digest = b""
+    if len(digest) != 32:
+        raise HTTPException(status_code=400, detail="sighash must be a hex encoded 32 byte hash")
+    return digest
+
+
+# A script can be evaluated as the one of an input of a spending transaction:
+# tx is the hex serialized transaction, input the index of the input, and
+# prevouts the outputs it spends, one "amount:script" (satoshis and hex) per
+# input, which segwit and taproot signatures commit to. The transaction is
+# parsed here to reject invalid ones, and is then cached by the workers along
+# with its signature hash midstates.
+def parse_transaction_key(tx: str | None, input_index: int, prevouts: list[str] | None) -> TransactionKey | None:
+    if tx is None:
+        if prevouts:
+            raise HTTPException(status_code=400, detail="prevouts require a transaction")
+        return None
+
+    try:
+        raw = bytes.fromhex(tx)
+        spent = None if not prevouts else tuple((int(amount), bytes.fromhex(script)) for amount, script in (prevout.split(":") for prevout in prevouts))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="tx must be hex encoded, and prevouts amount:script pairs with hex encoded scripts")
+
+    key = (raw, spent)
+    with pool_errors():
+        inputs = len(get_transaction(key).inputs)
+    if input_index >= inputs:
+        raise HTTPException(status_code=400, detail=f"input {input_index} is out of range for a transaction with {inputs} inputs")
+    return key
+
+
+# max_steps optionally caps the number of ops a simulation may execute, on top
+# of the consensus limits every script is held to
 @app.get('/simulate')
-async def get_simulation(script: str):
-    print(f"Constructing script: {script}")
-    constructed_script = construct_script(script)
-
-    print(f"Simulating script: {constructed_script}")
-    simulation = simulate_script(constructed_script)
-    
-    print_simulation(simulation)
-    return simulation
\ No newline at end of file
+async def get_simulation(script: str, trace: TraceMode = TraceMode.FULL, encoding: ScriptEncoding = ScriptEncoding.ASM, sighash: str | None = None,
+                         max_steps: int | None = Query(None, ge=1), tx: str | None = None, input: int = Query(0, ge=0),
+                         prevouts: list[str] | None = Query(None)) -> SimulationModel:
+    digest = parse_sighash(sighash)
+    tx_key = parse_transaction_key(tx, input, prevouts)
+    with pool_errors():
+        key = normalize(script, encoding)
+
+    cache_key = (key, trace, digest, max_steps, tx_key, input)
+    result = RESULT_CACHE.get(cache_key)
+    if result is not None:
+        return result
+
+    logger.info("simulating script", extra={"script": script, "trace": trace.value, "encoding": encoding.value})
+    with pool_errors():
+        result = await POOL.run(simulate_job, key, trace, digest, max_steps, tx_key, input)
+
+    if LOG_TRACES:
+        logger.info("simulation trace", extra={"script": script, "simulation": result.model_dump()})
+    RESULT_CACHE.put(cache_key, result)
+    return result
+
+
+# Simulates many scripts in one request. The body is either a JSON array of
+# scripts or NDJSON with one script per line (as a JSON string), and results
+# come back in the same order. Identical scripts are only simulated once, and
+# the ones not already cached are split into chunks across the pool's workers,
+# each of which verifies the Schnorr signatures of its chunk as one batch.
+@app.post('/simulate/batch', response_model=list[SimulationModel])
+async def post_batch_simulation(request: Request, trace: TraceMode = TraceMode.FINAL, encoding: ScriptEncoding = ScriptEncoding.ASM, sighash: str | None = None,
+                                max_steps: int | None = Query(None, ge=1)):
+    digest = parse_sighash(sighash)
+    body = await request.body()
+
+    try:
+        if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+            scripts = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            scripts = json.loads(body)
+    except json.JSONDecodeError as error:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {error}")
+
+    if type(scripts) != list or any(type(script) != str for script in scripts):
+        raise HTTPException(status_code=400, detail="Batch body must be a list of script strings")
+
+    with pool_errors():
+        keys = [normalize(script, encoding) for script in scripts]
+
+    unique_results = {}
+    for key in keys:
+        if key not in unique_results:
+            unique_results[key] = RESULT_CACHE.get((key, trace, digest, max_steps))
+
+    missing = [key for key, result in unique_results.items() if result is None]
+    logger.info("simulating batch", extra={"scripts": len(scripts), "unique": len(unique_results), "uncached": len(missing), "trace": trace.value})
+    with pool_errors():
+        missing_results = await POOL.map_chunks(simulate_chunk, missing, trace, digest, max_steps)
+
+    for key, result in zip(missing, missing_results):
+        unique_results[key] = result
+        RESULT_CACHE.put((key, trace, digest, max_steps), result)
+
+    results = [unique_results[key] for key in keys]
+    return Response(BATCH_ADAPTER.dump_json(results), media_type='application/json')
+
+
+class StreamFormat(str, Enum):
+    NDJSON = "ndjson"
+    SSE = "sse"
+
+
+# Streams the steps of a simulation as they are executed, each one as an NDJSON
+# line or a Server-Sent Event, followed by a final record with the validity and
+# standard type of the script. Steps are serialized and dropped one at a time.
+# Steps can't be streamed out of a worker process, so the simulation runs on
+# the response's thread, but it still takes a place in the pool's queue and
+# is cut off with an error record after the pool's timeout.
+@app.get('/simulate/stream')
+async def stream_simulation(script: str, trace: TraceMode = TraceMode.FULL, format: StreamFormat = StreamFormat.NDJSON, encoding: ScriptEncoding = ScriptEncoding.ASM, sighash: str | None = None,
+                            max_steps: int | None = Query(None, ge=1), tx: str | None = None, input: int = Query(0, ge=0),
+                            prevouts: list[str] | None = Query(None)):
+    digest = parse_sighash(sighash)
+    tx_key = parse_transaction_key(tx, input, prevouts)
+    logger.info("streaming script", extra={"script": script, "trace": trace.value, "format": format.value, "encoding": encoding.value})
+    with pool_errors():
+        program = get_program(normalize(script, encoding))
+
+    if format == StreamFormat.SSE:
+        media_type = 'text/event-stream'
+        def encode(event: str, data: str) -> str:
+            return f"event: {event}\ndata: {data}\n\n"
+    else:
+        media_type = 'application/x-ndjson'
+        def encode(event: str, data: str) -> str:
+            return f"{data}\n"
+
+    # the place taken in the pool's queue is released once, by whichever of the
+    # generator ending and the response finishing comes first
+    reserved = [True]
+    def release():
+        if reserved:
+            reserved.pop()
+            POOL.release()
+
+    # a plain generator, which the response iterates on a worker thread
+    def stream():
+        try:
+            deadline = time.monotonic() + POOL.timeout
+            spending = None if tx_key is None else get_transaction(tx_key)
+            simulation = iter_simulation(program, trace, ScriptContext(digest, max_steps=max_steps, tx=spending, input_index=input))
+            while True:
+                if time.monotonic() > deadline:
+                    yield encode('error', json.dumps({'error': f"Simulation timed out after {POOL.timeout}s"}))
+                    return
+                try:
+                    step = next(simulation)
+                except StopIteration as result:
+                    yield encode('result', json.dumps({'valid': result.value, 'script_type': classify(program).value}))
+                    return
+                yield encode('step', step_to_model(step).model_dump_json())
+        finally:
+            release()
+
+    with pool_errors():
+        POOL.reserve()
+    return StreamingResponse(stream(), media_type=media_type, background=BackgroundTask(release))
+
+
+@app.get('/stats/cache')
+async def get_cache_stats():
+    return {'results': RESULT_CACHE.stats(), **POOL.cache_stats()}
+
+
+@app.get('/stats/pool')
+async def get_pool_stats():
+    return {'workers': POOL.workers, 'pending': POOL.pending, 'max_queue': POOL.max_queue, 'timeout': POOL.timeout}
@@ -1,34 +1,376 @@
+import os
+from cache import LRUCache
+from enum import Enum
+from hashes import hash160, hash256, ripemd160, sha1, sha256
+from typing import Callable, Generator
 from opcodes import *
-from pydantic import BaseModel
+from program import MAX_ELEMENT_SIZE, MAX_OPS_PER_SCRIPT, MAX_PUBKEYS_PER_MULTISIG, MAX_SCRIPT_SIZE, MAX_STACK_SIZE, Program, compile_ops
+from secp256k1 import BatchVerifier, verify_ecdsa, verify_schnorr
+from transaction import SEQUENCE_DISABLE_FLAG, SIGHASH_DEFAULT, SigVersion, Transaction, locktime_satisfied, sequence_satisfied
+
+
+# Main stack of the interpreter, stored as a persistent cons list: each node is
+# an immutable (item, next) pair, and the head node is the top of the stack.
+# Push/pop are O(1), and since nodes are never mutated a snapshot of the stack
+# is just a reference to the current head. Every accessor addresses items by
+# their depth, where depth 0 is the top of the stack.
+class Stack:
+    __slots__ = ("_head", "_size")
+
+    def __init__(self, head: tuple | None = None, size: int = 0) -> None:
+        self._head = head
+        self._size = size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __bool__(self) -> bool:
+        return self._size > 0
+
+    def __repr__(self) -> str:
+        return repr(self.top_first())
+
+    def push(self, item: ScriptOp) -> None:
+        self._head = (item, self._head)
+        self._size += 1
+
+    def pop(self, depth: int = 0) -> ScriptOp:
+        if depth >= self._size:
+            self._underflow(depth)
+        if depth == 0:
+            item, self._head = self._head
+            self._size -= 1
+            return item
+
+        above, node = self._unwind(depth)
+        item, node = node
+        self._rewind(above, node)
+        self._size -= 1
+        return item
+
+    def peek(self, depth: int = 0) -> ScriptOp:
+        if depth >= self._size:
+            self._underflow(depth)
+        node = self._head
+        for _ in range(depth):
+            node = node[1]
+        return node[0]
+
+    # inserts item so that it ends up at the given depth
+    def insert(self, depth: int, item: ScriptOp) -> None:
+        above, node = self._unwind(depth)
+        self._rewind(above, (item, node))
+        self._size += 1
+
+    # swaps the items at depth1 and depth2, and then returns them
+    def swap(self, depth1: int, depth2: int) -> tuple[ScriptOp, ScriptOp]:
+        shallow, deep = min(depth1, depth2), max(depth1, depth2)
+        above, node = self._unwind(deep)
+        deep_item, rest = node
+        shallow_item = above[shallow]
+        above[shallow] = deep_item
+        self._rewind(above, (shallow_item, rest))
+
+        if depth1 < depth2:
+            return deep_item, shallow_item
+        return shallow_item, deep_item
+
+    # O(1) copy of the current stack, unaffected by later pushes and pops
+    def snapshot(self) -> "Stack":
+        return Stack(self._head, self._size)
+
+    # items ordered from the top of the stack down, as the API reports them
+    def top_first(self) -> list[ScriptOp]:
+        items = []
+        node = self._head
+        while node is not None:
+            item, node = node
+            items.append(item)
+        return items
+
+    # handlers read the items their opcode's arg_count guarantees, so this only
+    # happens for ops that read deeper than that; the script fails either way
+    def _underflow(self, depth: int) -> None:
+        raise ScriptError(f"Tried to read the item at depth {depth} of a stack of {self._size} items; stack underflow")
+
+    # returns the items above the given depth (top first) and the node at that depth
+    def _unwind(self, depth: int) -> tuple[list[ScriptOp], tuple | None]:
+        if depth > self._size:
+            self._underflow(depth)
+        above = []
+        node = self._head
+        for _ in range(depth):
+            item, node = node
+            above.append(item)
+        return above, node
+
+    # pushes the items back on top of node, restoring their original order
+    def _rewind(self, above: list[ScriptOp], node: tuple | None) -> None:
+        for item in reversed(above):
+            node = (item, node)
+        self._head = node
+
+
+# How much of the execution trace simulate_script records:
+#   full        every step, from the initial setup to the last executed op
+#   final       only the last step
+#   on_failure  only the failing step, and nothing at all for valid scripts
+class TraceMode(str, Enum):
+    FULL = "full"
+    FINAL = "final"
+    ON_FAILURE = "on_failure"
+
+
+# Handlers describe what they did with a message template followed by its
+# arguments. It is only formatted if the step ends up being serialized.
+Message = tuple
+
+
+# Raised by handlers when the script fails at the current op
+class ScriptError(Exception):
+    def __init__(self, *message) -> None:
+        super().__init__(*message)
+        self.message = message
+
+
+# What handlers may need about an execution besides the stack: the signature
+# hash that signatures are checked against, and, when simulations are verified
+# together, the batch collecting their Schnorr checks with the index of the
+# simulation they belong to. Flow control handlers set skip_branch to have the
+# interpreter jump over the branch following the current op. The alt stack is
+# a second Stack, and op_count the number of ops counted against the consensus
+# limit, both reset whenever a simulation or one of its joined scripts starts. max_steps caps the number of
+# ops a simulation may execute. With a spending transaction, the script is
+# evaluated as the one of its input at input_index: signatures are checked
+# against the transaction's signature hashes instead of sighash, and the
+# locktime opcodes against its locktime and sequences. sigversion, when known,
+# fixes the signature scheme and hash the script's signatures are checked
+# with; otherwise the scheme follows the size of each pubkey.
+class ScriptContext:
+    __slots__ = ("sighash", "batch", "owner", "max_steps", "tx", "input_index", "sigversion", "skip_branch", "altstack", "op_count")
+
+    def __init__(self, sighash: bytes | None = None, batch: BatchVerifier | None = None, owner: int = 0, max_steps: int | None = None,
+                 tx: Transaction | None = None, input_index: int = 0, sigversion: SigVersion | None = None) -> None:
+        self.sighash = sighash
+        self.batch = batch
+        self.owner = owner
+        self.max_steps = max_steps
+        self.tx = tx
+        self.input_index = input_index
+        self.sigversion = sigversion
+        self.skip_branch = False
+        self.altstack = Stack()
+        self.op_count = 0
+
+
+# One step of a simulation. The script and stacks are recorded as O(1)
+# snapshots: the immutable script tuple with the position of the next op, and
+# the persistent main and alt stacks. They are only expanded into lists when read.
+class SimulationStep:
+    __slots__ = ("failed", "_message", "_script", "_pc", "_stack", "_altstack")
+
+    def __init__(self, message: Message, script: tuple[ScriptOp, ...], pc: int, stack: Stack, altstack: Stack | None = None, failed: bool = False) -> None:
+        self.failed = failed
+        self._message = message
+        self._script = script
+        self._pc = pc
+        self._stack = stack.snapshot()
+        self._altstack = altstack.snapshot() if altstack else None
+
+    @property
+    def message(self) -> str | None:
+        template, *args = self._message
+        if not args:
+            return template
+        return template.format(*args)
+
+    @property
+    def script(self) -> list[ScriptOp]:
+        return list(self._script[self._pc:])
+
+    @property
+    def stack(self) -> list[ScriptOp]:
+        return self._stack.top_first()
+
+    @property
+    def altstack(self) -> list[ScriptOp]:
+        return self._altstack.top_first() if self._altstack else []
+
+    # number of ops executed when the step was recorded
+    @property
+    def position(self) -> int:
+        return self._pc
+
+    # the op executed by this step, None for the initial setup
+    @property
+    def op(self) -> ScriptOp | None:
+        return self._script[self._pc - 1] if self._pc > 0 else None
+
+class Simulation:
+    __slots__ = ("steps", "valid")
+
+    def __init__(self, steps: list[SimulationStep], valid: bool) -> None:
+        self.steps = steps
+        self.valid = valid
+
+
+def enough_args(arg_count: int, stack: Stack) -> bool: 
+    return arg_count <= len(stack)
 
 
-class SimulationStep(BaseModel):
-    script: list[Opcode | Data]
-    stack: list[Opcode | Data]
-    message: str | None = None
-    failed: bool = False
+# zero values are false, every other item is true. As bytes, zero is any
+# number of zero bytes, where the last one may be the sign bit (negative zero).
+def is_false(item: ScriptOp) -> bool:
+    if type(item) is not Data or type(item.value) is str:
+        return False
+    if type(item.value) is int:
+        return item.value == 0
+    data = item.value
+    return len(data) == 0 or (not any(data[:-1]) and data[-1] & 0x7f == 0)
+
+
+# The number a stack item holds, None if it isn't one
+def item_num(item: ScriptOp) -> int | None:
+    try:
+        return item.as_num()
+    except ValueError:
+        return None
+
+# Pops the number operand of an arithmetic op
+def pop_num(stack: Stack, operation: str) -> int:
+    item = stack.pop()
+    try:
+        return item.as_num()
+    except ValueError as error:
+        raise ScriptError(f"Failure trying to perform {operation} on <{item}>; {error}")
+
+
+# Results of signature checks, keyed by (signature, pubkey) and shared by all
+# the simulations run in a process
+SIGNATURE_CACHE_CAPACITY = int(os.environ.get("BTC_SCRIPT_SIGNATURE_CACHE_CAPACITY", 100_000))
+SIGNATURE_CACHE = LRUCache(SIGNATURE_CACHE_CAPACITY)
+
+# Digests of stack items, keyed by (opcode code, item bytes). Only items up to
+# HASH_CACHE_MAX_ITEM bytes (pubkeys, signatures, hashes) are memoized, so a
+# key never holds on to a large push, which is hashed in place instead.
+HASH_CACHE_CAPACITY = int(os.environ.get("BTC_SCRIPT_HASH_CACHE_CAPACITY", 100_000))
+HASH_CACHE_MAX_ITEM = 128
+HASH_CACHE = LRUCache(HASH_CACHE_CAPACITY)
+
+HASH_FUNCTIONS = {
+    OP_RIPEMD160.code:  ripemd160,
+    OP_SHA1.code:       sha1,
+    OP_SHA256.code:     sha256,
+    OP_HASH160.code:    hash160,
+    OP_HASH256.code:    hash256,
+}
+
+def hash_item(opcode: Opcode, data: bytes | memoryview) -> bytes:
+    function = HASH_FUNCTIONS[opcode.code]
+    if len(data) > HASH_CACHE_MAX_ITEM:
+        return function(data)
+
+    key = (opcode.code, bytes(data))
+    digest = HASH_CACHE.get(key)
+    if digest is None:
+        digest = function(data)
+        HASH_CACHE.put(key, digest)
+    return digest
+
+
+# The bytes of a stack item, None for opcodes left on the stack
+def item_bytes(item: ScriptOp) -> bytes | memoryview | None:
+    return item.as_bytes() if type(item) is Data else None
+
+
+# Signatures and pubkeys written as SIG<name> and PK<name> in scripts stand in
+# for real ones, and match when their names do. Real signatures (bytes) are
+# verified against the message they sign (see signed_message): ECDSA for SEC
+# pubkeys, BIP340 Schnorr for 32 byte x-only pubkeys. With a batch in the
+# context, Schnorr checks are deferred to it and pass for now, unless defer is
+# off because the caller acts on a failure.
+def check_sig(signature: Data, pubkey: Data, context: ScriptContext | None = None, defer: bool = True) -> bool:
+    if not is_signature(signature) or not is_pubkey(pubkey):
+        return False
 
-class Simulation(BaseModel):
-    steps: list[SimulationStep]
-    valid: bool
+    if type(signature.value) is str or type(pubkey.value) is str:
+        key = (signature.value, pubkey.value)
+        passed = SIGNATURE_CACHE.get(key)
+        if passed is None:
+            passed = type(signature.value) is type(pubkey.value) and signature.value[3:] == pubkey.value[2:]
+            SIGNATURE_CACHE.put(key, passed)
+        return passed
+
+    sig, pk = bytes(signature.value), bytes(pubkey.value)
+    # Schnorr signatures are 64 bytes, plus the sighash type when it isn't the
+    # default, and ECDSA ones are DER followed by the sighash type
+    sigversion = context.sigversion if context is not None else None
+    schnorr = len(pk) == 32 if sigversion is None else sigversion == SigVersion.TAPSCRIPT
+    if schnorr and len(pk) != 32:
+        # BIP342: pubkeys of unknown types pass, left for future soft forks
+        return True
+    if not schnorr and len(pk) == 32:
+        return False
+    if schnorr and len(sig) not in (64, 65):
+        return False
 
+    msg = signed_message(sig, schnorr, context)
+    if msg is None:
+        return False
 
+    key = (sig, pk, msg)
+    passed = SIGNATURE_CACHE.get(key)
+    if passed is not None:
+        return passed
 
-def enough_args(arg_count: int, stack: list[ScriptOp]) -> bool: 
-    return arg_count <= len(stack)
+    if schnorr:
+        if defer and context.batch is not None:
+            context.batch.add(context.owner, msg, sig[:64], pk)
+            return True
+        passed = verify_schnorr(msg, sig[:64], pk)
+    else:
+        passed = verify_ecdsa(msg, sig[:-1], pk)
 
+    SIGNATURE_CACHE.put(key, passed)
+    return passed
 
-def check_sig(signature: Data, pubkey: Data) -> bool:
-    if not is_signature(signature) or not is_pubkey(pubkey):
-        return False
-    
-    if signature.value[3:] == pubkey.value[2:]:
-        return True
+
+# The message a signature signs: the signature hash of the context's
+# transaction for the hash type of the signature, or else the sighash given in
+# the context. None when there is neither, or the hash type isn't valid.
+def signed_message(sig: bytes, schnorr: bool, context: ScriptContext | None) -> bytes | None:
+    if context is None:
+        return None
+    if context.tx is None:
+        return context.sighash
+
+    if schnorr:
+        hashtype = sig[64] if len(sig) == 65 else SIGHASH_DEFAULT
+        if len(sig) == 65 and hashtype == SIGHASH_DEFAULT:
+            return None
     else:
-        return False
+        hashtype = sig[-1]
+    return context.tx.signature_hash(context.input_index, hashtype, schnorr, context.sigversion)
 
 
-def check_multisig(signatures: list[Data], pubkeys: list[Data], sig_count: int, pk_count: int) -> bool:
+# An empty item (an empty push, or OP_0) in place of a signature: its check
+# fails, which is how scripts give up a check without failing under NULLFAIL
+def is_empty_signature(signature: ScriptOp) -> bool:
+    data = item_bytes(signature)
+    return data is not None and type(signature.value) is not str and len(data) == 0
+
+# NULLFAIL: a signature check that fails has to be given an empty signature,
+# otherwise the script fails. Only enforced for real signatures.
+def null_fail(signature: ScriptOp) -> bool:
+    return type(signature) is Data and type(signature.value) is not str and not is_empty_signature(signature)
+
+
+# As in Bitcoin, signatures have to be in the same order as their pubkeys, so
+# they are matched in a single pass: each signature is checked against the
+# pubkeys following the last matched one, and a pubkey that doesn't match is
+# never tried again. Deferring a check would match a signature with the first
+# pubkey it's tried against, so they are all verified right away.
+def check_multisig(signatures: list[Data], pubkeys: list[Data], sig_count: int, pk_count: int, context: ScriptContext | None = None) -> bool:
     for sig in signatures:
         if not is_signature(sig):
             return False
@@ -37,464 +379,643 @@ def check_multisig(signatures: list[Data], pubkeys: list[Data], sig_count: int,
         if not is_pubkey(pk):
             return False
 
-    verified_pairs = []
+    remaining = iter(pubkeys)
     for sig in signatures:
-        for pk in pubkeys:
-            if (sig, pk) not in verified_pairs and check_sig(sig, pk):
-                verified_pairs.append((sig, pk))
+        if not any(check_sig(sig, pk, context, defer=False) for pk in remaining):
+            return False
+
+    return len(signatures) >= sig_count
 
-    if len(verified_pairs) >= sig_count:
-        return True
-    else:
-        return False
-    
 
 def is_pubkey(pubkey: Data) -> bool:
-    if type(pubkey.value) != str:
-        return False
-    return pubkey.value.startswith("PK")
+    if type(pubkey.value) is str:
+        return pubkey.value.startswith("PK")
+    if isinstance(pubkey.value, (bytes, memoryview)):
+        return len(pubkey.value) == 32 or (len(pubkey.value) == 33 and pubkey.value[0] in (2, 3)) or (len(pubkey.value) == 65 and pubkey.value[0] == 4)
+    return False
 
 def is_signature(signature: Data) -> bool:
-    if type(signature.value) != str:
-        return False
-    return signature.value.startswith("SIG")
+    if type(signature.value) is str:
+        return signature.value.startswith("SIG")
+    return isinstance(signature.value, (bytes, memoryview)) and len(signature.value) > 0
 
 
-def push_data(data: Data, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    stack.insert(0, data)
-    message = f"Pushed <{data.value}> to stack"
-    
-    return SimulationStep(script=script, stack=stack, message=message)
+def push_data(data: Data, stack: Stack) -> Message:
+    stack.push(data)
+    return "Pushed <{}> to stack", data
 
 
-def unary_operation(opcode: Opcode, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    operand = stack.pop(0).value
-    operation = opcode.value[3:]
+# Every opcode handler takes the opcode being executed, the stack and the
+# context of the execution, updates the stack, and returns the message for the
+# step (or raises ScriptError). They are looked up by opcode code in HANDLERS,
+# at the bottom of this section.
+Handler = Callable[[Opcode, Stack, ScriptContext], Message]
+
 
-    if type(operand) != int:
-        msg = f"Failure trying to perform {operation} on {operand}; Requires type Int, but found String"
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-
-    msg = f"Performed {operation} on <{operand}>; "
-
-    if opcode == OP_1ADD:
-        result = operand + 1
-    elif opcode == OP_1SUB:
-        result = operand - 1
-    elif opcode == OP_NEGATE:
-        result = -operand
-    elif opcode == OP_ABS:
-        result = -operand if operand < 0 else operand
-    elif opcode == OP_NOT:
-        result = int(operand==0)
-    elif opcode == OP_0NOTEQUAL:
-        result = int(opcode!=0)
+# builds the handler of an opcode that replaces the top value with function(top)
+def unary_operation(function: Callable[[int], int]) -> Handler:
+    def handler(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+        operation = opcode.value[3:]
+        operand = pop_num(stack, operation)
+
+        result = function(operand)
+        stack.push(Data(value=result))
+        
+        return "Performed {} on <{}>; Pushed <{}> to stack", operation, operand, result
+
+    return handler
+
+
+# builds the handler of an opcode that replaces the top two values with
+# function(second, top), so that e.g. "5 3 OP_SUB" computes 5 - 3; with verify
+# set, the result is consumed instead and the script fails when it is 0
+def binary_operation(function: Callable[[int, int], int], verify: bool = False) -> Handler:
+    def handler(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+        operation = opcode.value[3:]
+        op2 = pop_num(stack, operation)
+        op1 = pop_num(stack, operation)
+
+        result = function(op1, op2)
+
+        if verify:
+            if result != 1:
+                raise ScriptError(f"Performed {operation} on <{op1}> and <{op2}>; Verify failed")
+            return "Performed {} on <{}> and <{}>; Verify passed", operation, op1, op2
+
+        stack.push(Data(value=result))
+        return "Performed {} on <{}> and <{}>; Pushed <{}> to stack", operation, op1, op2, result
+
+    return handler
+
+
+# OP_0, OP_1NEGATE and OP_1..OP_16 are compiled into pushes, so this only runs
+# for ops executed one at a time with simulate_step
+def op_push_number(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    return push_data(NUMBER_CONSTANTS[opcode.code], stack)
+
+
+def op_depth(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    depth = len(stack)
+    stack.push(Data(value=depth))
+    return "Performed DEPTH; Pushed <{}> to stack", depth
+
+def op_dup(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first = stack.peek(0)
+    stack.push(first)
+    return "Performed DUP; Duplicated <{}>, and pushed it to stack", first
+
+def op_drop(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first = stack.pop()
+    return "Performed DROP; Popped <{}> from stack", first
+
+def op_2drop(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first  = stack.pop()
+    second = stack.pop()
+    return "Performed 2DROP; Popped <{}> and <{}> from stack", first, second
+
+def op_2dup(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first  = stack.peek(0)
+    second = stack.peek(1)
+    stack.push(second)
+    stack.push(first)
+    return "Performed 2DUP; Duplicated <{}> and <{}> and pushed them to stack", first, second
+
+def op_2over(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    third  = stack.peek(2)
+    fourth = stack.peek(3)
+    stack.push(fourth)
+    stack.push(third)
+    return "Performed 2OVER; Duplicated <{}> and <{}> and pushed them to stack", third, fourth
+
+def op_2rot(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    fifth = stack.pop(4)
+    sixth = stack.pop(4)
+    stack.push(sixth)
+    stack.push(fifth)
+    return "Performed 2ROT; Moved <{}> and <{}> to top of stack", fifth, sixth
+
+def op_2swap(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first, third = stack.swap(0, 2)     # swap 1st and 3rd values
+    second, fourth = stack.swap(1, 3)   # swap 2nd and 4th values
+    return "Performed 2SWAP; Swapped <{}> and <{}> with <{}> and <{}>", first, second, third, fourth
+
+def op_3dup(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first  = stack.peek(0)
+    second = stack.peek(1)
+    third  = stack.peek(2)
+    stack.push(third)
+    stack.push(second)
+    stack.push(first)
+    return "Performed 3DUP; Duplicated <{}>, <{}>, <{}>, and pushed them to stack", first, second, third
+
+def op_ifdup(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    top = stack.peek(0)
+    if not is_false(top):
+        stack.push(top)
+        return "Performed IFDUP; <{}> is true; Duplicated <{}>, and pushed it to stack", top, top
     else:
-        msg = f"UNARY OPERATION ERROR: (OPCODE: {opcode}, OPERAND: {operand})"
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-    
-    stack.insert(0, Data(value=result))
-    msg += f"Pushed <{result}> to stack"
-    
-    return SimulationStep(script=script, stack=stack, message=msg)
+        return "Performed IFDUP; <{}> is false; Stack is left the same", top
 
+def op_nip(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    second = stack.pop(1)
+    return "Performed NIP; Popped <{}> from stack", second
 
-def binary_operation(opcode: Opcode, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    op1 = stack.pop(0).value
-    op2 = stack.pop(0).value
-    operation = opcode.value[3:]
+def op_over(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    second = stack.peek(1)
+    stack.push(second)
+    return "Performed OVER; Duplicated <{}>, and pushed it to stack", second
 
-    if type(op1) != int or type(op2) != int:
-        msg = f"Failure trying to perform {operation} on {op1} and {op2};"
-
-        if type(op1) != int: msg += f" Operand 1 requires type Int, but found type String"
-        if type(op1) != int and type(op2) != int: msg += "; "
-        if type(op2) != int: msg += f" Operand 2 requires type Int, but found type String"
-
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-
-    msg = f"Performed {operation} on <{op1}> and <{op2}>; " 
-
-    if opcode == OP_ADD:
-        result = op1 + op2
-    elif opcode == OP_SUB:
-        result = op1 - op2
-    elif opcode == OP_BOOLAND:
-        # If both op1 and op2 are not 0, the output is 1. Otherwise 0.
-        result = int(op1 != 0 and op2 != 0)
-    elif opcode == OP_BOOLOR:
-        # If op1 or op2 is not 0, the output is 1. Otherwise 0.
-        result = op1 != 0 or op2 != 0
-    elif opcode == OP_NUMEQUAL:
-        result = int(op1 == op2)
-    elif opcode == OP_NUMEQUALVERIFY:
-        result = int(op1 == op2)
-        if result == 1:
-            msg += "Verify passed; "
-        else:
-            msg += "Verify failed"
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-    elif opcode == OP_NUMNOTEQUAL:
-        result = op1 != op2
-    elif opcode == OP_LESSTHAN:
-        result = int(op1 < op2)
-    elif opcode == OP_GREATERTHAN:
-        result = int(op1 > op2)
-    elif opcode == OP_LESSTHANOREQUAL:
-        result = int(op1 <= op2)
-    elif opcode == OP_GREATERTHANOREQUAL:
-        result = int(op1 >= op2)
-    elif opcode == OP_MIN:
-        result = min(op1, op2)
-    elif opcode == OP_MAX:
-        result = max(op1, op2)
-    else:
-        msg = f"BINARY OPERATION ERROR: (OPCODE: {opcode}, OPERAND1: {op1}, OPERAND2: {op2})"
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
+def op_pick_roll(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    operation = opcode.value[3:]
+    item = stack.pop()
+    n = item_num(item)
+    if n is None or not (0 <= n < len(stack)):
+        raise ScriptError(f"Performed {operation}; <{item}> out of bounds [0, {len(stack)}]")
     
-    stack.insert(0, Data(value=result))
-    msg += f"Pushed <{result}> to stack"
+    if opcode is OP_ROLL:
+        x = stack.pop(n)
+        action = "Popped"
+    else:
+        x = stack.peek(n)
+        action = "Duplicated"
 
-    return SimulationStep(script=script, stack=stack, message=msg)
+    stack.push(x)
+    return "Performed {}; {} element at position {}; Pushed <{}> to stack", operation, action, n, x
 
+def op_rot(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    third = stack.pop(2)
+    stack.push(third)
+    return "Performed ROT; Moved <{}> to top of stack", third
 
-# swaps elements at idx1 and idx2 of stack, and then returns them
-def swap(idx1: int, idx2: int, stack: list[ScriptOp]) -> tuple[ScriptOp,ScriptOp]:
-    temp = stack[idx1]
-    stack[idx1] = stack[idx2]
-    stack[idx2] = temp
+def op_swap(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first, second = stack.swap(0, 1)
+    return "Performed SWAP; Swapped <{}> and <{}>", first, second
 
-    return stack[idx1], temp 
+def op_toaltstack(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    item = stack.pop()
+    context.altstack.push(item)
+    return "Performed TOALTSTACK; Moved <{}> to the alt stack", item
 
+def op_fromaltstack(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    if not context.altstack:
+        raise ScriptError("FROMALTSTACK requires an item on the alt stack, but it is empty")
+    item = context.altstack.pop()
+    stack.push(item)
+    return "Performed FROMALTSTACK; Moved <{}> from the alt stack", item
 
-def stack_operation(opcode: Opcode, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    operation = opcode.value[3:]
-    msg = f"Performed {operation}; " 
-    
-    if opcode == OP_DEPTH:
-        depth = len(stack)
-        msg += f"Pushed <{depth}> to stack"
-    elif opcode == OP_DUP:
-        first = stack[0]
-        stack.insert(0, first)
-        msg += f"Duplicated <{first}>, and pushed it to stack"
-    elif opcode == OP_DROP:
-        first = stack.pop(0)
-        msg += f"Popped <{first}> from stack"
-    elif opcode == OP_2DROP:
-        first  = stack.pop(0)
-        second = stack.pop(0)
-        msg += f"Popped <{first}> and <{second}> from stack"
-    elif opcode == OP_2DUP:
-        first  = stack[0]
-        second = stack[1]
-        stack.insert(0, second)
-        stack.insert(0, first)
-        msg += f"Duplicated <{first}> and <{second}> and pushed them to stack"
-    elif opcode == OP_2OVER:
-        third  = stack[2]
-        fourth = stack[3]
-        stack.insert(0, fourth)
-        stack.insert(0, third)
-        msg += f"Duplicated <{third}> and <{fourth}> and pushed them to stack"
-    elif opcode == OP_2ROT:
-        print(f"{len(stack)=}")
-        fifth = stack.pop(4)
-        sixth = stack.pop(4)
-        stack.insert(0, sixth)
-        stack.insert(0, fifth)
-        msg += f"Moved <{fifth}> and <{sixth}> to top of stack"
-    elif opcode == OP_2SWAP:
-        first, third = swap(0, 2, stack)    # swap 1st and 3rd values
-        second, fourth = swap(1, 3, stack)  # swap 2nd and 4th values
-        msg += f"Swapped <{first}> and <{second}> with <{third}> and <{fourth}>"
-    elif opcode == OP_3DUP:
-        first  = stack[0]
-        second = stack[1]
-        third  = stack[2]
-        stack.insert(0, third)
-        stack.insert(0, second)
-        stack.insert(0, first)
-        msg += f"Duplicated <{first}>, <{second}>, <{third}>, and pushed them to stack"
-    elif opcode == OP_IFDUP:
-        top = stack[0]
-        if bool(top) == True:
-            stack.insert(0, top)
-            msg += f"<{top}> is true; Duplicated <{top}>, and pushed it to stack"
-        else:
-            msg += f"<{top}> is false; Stack is left the same"
-    elif opcode == OP_NIP:
-        second = stack.pop(1)
-        msg += f"Popped <{second}> from stack"
-    elif opcode == OP_OVER:
-        second = stack[1]
-        stack.insert(0, second)
-        msg += f"Duplicated <{second}>, and pushed it to stack"
-    elif opcode == OP_PICK or opcode == OP_ROLL:
-        n = stack.pop(0)
-        if not (0 <= n < len(stack)):
-            msg += f"<{n}> out of bounds [0, {len(stack)}]"
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-        
-        x = stack[n]
-        if opcode == OP_ROLL:
-            stack.pop(n)
-            msg += f"Popped element at position {n}; "
-        else:
-            msg += f"Duplicated element at position {n}; "
-
-        stack.insert(0, x)
-        msg += f"Pushed <{x}> to stack"
-    elif opcode == OP_ROT:
-        third = stack.pop(2)
-        stack.insert(0, third)
-        msg += f"Moved <{third}> to top of stack"
-    elif opcode == OP_SWAP:
-        first, second = swap(0, 1, stack)
-        msg += f"Swapped <{first}> and <{second}>"
-    elif opcode == OP_TUCK:
-        top = stack[0]
-        stack.insert(2, top)
-        msg += f"Duplicated <{top}> and inserted it after the second element"
-    else:
-        msg = f"STACK OPERATION ERROR: (OPCODE: {opcode})"
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
 
-    return SimulationStep(script=script, stack=stack, message=msg)
+def op_tuck(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    top = stack.peek(0)
+    stack.insert(2, top)
+    return "Performed TUCK; Duplicated <{}> and inserted it after the second element", top
 
 
-def signature_operation(opcode: Opcode, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
+def op_checksig(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
     operation = opcode.value[3:]
-    msg = f"Performed {operation}; "
-
+    pubkey = stack.pop()
+    signature = stack.pop()
 
-    if opcode == OP_CHECKSIG or OP_CHECKSIGVERIFY:
-        pubkey = stack.pop(0)
-        signature = stack.pop(0)
+    if type(pubkey.value) == int:
+        raise ScriptError(f"Failure performing {operation}; Pubkey requires type String, but found type Int")
 
-        if type(pubkey.value) != str or type(signature.value) != str:
-            msg = f"Failure performing {operation};"
+    passed = not is_empty_signature(signature) and check_sig(signature, pubkey, context)
+    if not passed and null_fail(signature):
+        raise ScriptError("Performed {}; Checksig on pubkey <{}> failed with non-empty signature <{}>", operation, pubkey, signature)
 
-            if type(pubkey.value) != str:  msg += f"Pubkey requires type String, but found type Int"
-            if type(pubkey.value) != str and type(signature.value): msg += "; "
-            if type(signature.value) != str: msg += f"Signature requires type String, but found type Int"
-            
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
+    result = "passed" if passed else "failed"
+    msg = "Performed {}; Checksig on pubkey <{}> {} with signature <{}>"
 
-        if check_sig(signature, pubkey):
-            stack.insert(0, Data(value=1))
-            msg += f"Checksig on pubkey <{pubkey.value}> passed with signature <{signature.value}>; Pushed <1> to stack"
+    # the verify variant consumes the result instead of pushing it
+    if opcode is OP_CHECKSIGVERIFY:
+        if passed:
+            return msg + "; Verify Passed", operation, pubkey, result, signature
         else:
-            stack.insert(0, Data(value=0))
-            msg += f"Checksig on pubkey <{pubkey.value}> failed with signature <{signature.value}>; Pushed <0> to stack"
+            raise ScriptError(msg + "; Verify Failed", operation, pubkey, result, signature)
 
-        if opcode == OP_CHECKSIGVERIFY:
-            if check_sig(signature, pubkey):
-                msg += "; Verify Passed"
-            else:
-                msg += "; Verify Failed"
-                return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-
-        return SimulationStep(script=script, stack=stack, message=msg)
-
-
-    elif opcode == OP_CHECKMULTISIG or opcode == OP_CHECKMULTISIGVERIFY:
-        num_pubkeys = stack.pop(0)
-        if num_pubkeys >= len(stack):
-            msg += f"Too many pubkeys required, number of necessary pubkeys specified: <{num_pubkeys}>, stack size: <{len(stack)}>; Checkmultisig failed"
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-                    
-        pubkeys = []
-        for _ in range(num_pubkeys):
-            pubkey = stack.pop(0)
-            if not is_pubkey(pubkey):
-                msg += f"Not enough pubkeys, needed <{num_pubkeys}>, received <{len(pubkeys)}>; Checkmultisig failed"
-                return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-            
-            pubkeys.append(pubkey)
-
-        num_signatures = stack.pop(0)
-        if num_signatures >= len(stack) or num_signatures > num_pubkeys:
-            msg += f"Too many signatures required, number of necessary signatures specified: <{num_pubkeys}>, stack size: <{len(stack)}>; Checkmultisig failed"
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-
-        signatures = []
-        for _ in range(num_signatures):
-            signature = stack.pop(0)
-            if not is_signature(signature):
-                msg += f"Not enough signatures, needed <{num_signatures}>, received <{len(signatures)}>; Checkmultisig failed"
-                return SimulationStep(script=script, stack=stack, message=msg, failed=True)
-            
-            signatures.append(signature)
-            
-    
-        def is_str(x): return type(x) == str
+    stack.push(Data(value=int(passed)))
+    return msg + "; Pushed <{}> to stack", operation, pubkey, result, signature, int(passed)
 
-        if any([not is_str(data) for data in (pubkeys+signatures)]):
-            msg = f"Failure performing {operation}; Pubkeys and Signatures require type String, but found Int"
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
 
-        multisig_result = check_multisig(pubkeys, signatures, num_signatures, num_pubkeys)
-        if multisig_result:
-            stack.insert(0, Data(value=1))
-            msg += f"Checkmultisig passed; Pushed <1> to stack"
-        else:
-            stack.insert(0, Data(value=0))
-            msg += f"Checkmultisig failed; Pushed <0> to stack"
+def op_checkmultisig(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    operation = opcode.value[3:]
+    prefix = f"Performed {operation}; "
+
+    num_pubkeys = item_num(stack.pop())
+    if num_pubkeys is not None and num_pubkeys > MAX_PUBKEYS_PER_MULTISIG:
+        raise ScriptError(f"{prefix}Pubkey count <{num_pubkeys}> is over the limit of {MAX_PUBKEYS_PER_MULTISIG}; Checkmultisig failed")
+    if num_pubkeys is None or not 0 <= num_pubkeys < len(stack):
+        raise ScriptError(f"{prefix}Too many pubkeys required, number of necessary pubkeys specified: <{num_pubkeys}>, stack size: <{len(stack)}>; Checkmultisig failed")
+
+    # every pubkey counts as an op towards the limit
+    context.op_count += num_pubkeys
+    if context.op_count > MAX_OPS_PER_SCRIPT:
+        raise ScriptError(f"{prefix}Op count limit of {MAX_OPS_PER_SCRIPT} exceeded by the <{num_pubkeys}> pubkeys; Checkmultisig failed")
+                
+    pubkeys = []
+    for _ in range(num_pubkeys):
+        pubkey = stack.pop()
+        if not is_pubkey(pubkey):
+            raise ScriptError(f"{prefix}Not enough pubkeys, needed <{num_pubkeys}>, received <{len(pubkeys)}>; Checkmultisig failed")
+        
+        pubkeys.append(pubkey)
 
-        if opcode == OP_CHECKMULTISIGVERIFY:
-            if multisig_result:
-                msg += "; Verify Passed"
-            else:
-                msg += "; Verify Failed"
-                return SimulationStep(script=script, stack=stack, message=msg, failed=True)
+    num_signatures = item_num(stack.pop())
+    if num_signatures is None or not 0 <= num_signatures < len(stack) or num_signatures > num_pubkeys:
+        raise ScriptError(f"{prefix}Too many signatures required, number of necessary signatures specified: <{num_signatures}>, stack size: <{len(stack)}>; Checkmultisig failed")
+
+    signatures = []
+    for _ in range(num_signatures):
+        signature = stack.pop()
+        if not is_signature(signature) and not is_empty_signature(signature):
+            raise ScriptError(f"{prefix}Not enough signatures, needed <{num_signatures}>, received <{len(signatures)}>; Checkmultisig failed")
         
-        return SimulationStep(script=script, stack=stack, message=msg)
-    
-    else:
-        msg = f"EQUALITY OPERATION ERROR: (OPCODE: {opcode})"
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
+        signatures.append(signature)
 
+    # the extra item CHECKMULTISIG consumes, which has to be empty (NULLDUMMY)
+    dummy = stack.pop()
+    data = item_bytes(dummy)
+    if data is None or len(data) > 0:
+        raise ScriptError(f"{prefix}Dummy element <{dummy}> is not empty; Checkmultisig failed")
 
-def equality_operation(opcode: Opcode, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    operation = opcode.value[3:]
-    msg = f"Performed {operation}; "
+    multisig_result = check_multisig(signatures, pubkeys, num_signatures, num_pubkeys, context)
+    if not multisig_result and any(null_fail(signature) for signature in signatures):
+        raise ScriptError(f"{prefix}Checkmultisig failed with non-empty signatures")
 
-    if opcode == OP_EQUAL:
-        first, second = stack.pop(0), stack.pop(0)
-        if first == second:
-            stack.insert(0, Data(value=1))  # insert 1 if it is not equal
-            msg += f"<{first}> is equal to <{second}>; Pushed <1> to stack"
+    result = "passed" if multisig_result else "failed"
+    msg = "Performed {}; Checkmultisig {}"
+
+    if opcode is OP_CHECKMULTISIGVERIFY:
+        if multisig_result:
+            return msg + "; Verify Passed", operation, result
         else:
-            stack.insert(0, Data(value=0))  # insert 0 if it is not equal
-            msg += f"<{first}> is not equal to <{second}>; Pushed <0> to stack"
+            raise ScriptError(msg + "; Verify Failed", operation, result)
 
-        return SimulationStep(script=script, stack=stack, message=msg)
+    stack.push(Data(value=int(multisig_result)))
+    return msg + "; Pushed <{}> to stack", operation, result, int(multisig_result)
 
-    elif opcode == OP_EQUALVERIFY:
-        first, second = stack.pop(0), stack.pop(0)
-        if first == second:
-            stack.insert(0, Data(value=1))  # insert 1 if it is not equal
-            msg += f"<{first}> is equal to <{second}>; Pushed <1> to stack; Verify Passed"
-            return SimulationStep(script=script, stack=stack, message=msg)
-        else:
-            stack.insert(0, Data(value=0))  # insert 0 if it is not equal
-            msg += f"<{first}> is not equal to <{second}>; Pushed <0> to stack; Verify Failed"
-            return SimulationStep(script=script, stack=stack, message=msg, failed=True)
 
-    else: 
-        msg = f"EQUALITY OPERATION ERROR: (OPCODE: {opcode})"
-        return SimulationStep(script=script, stack=stack, message=msg, failed=True)
+def op_equal(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first, second = stack.pop(), stack.pop()
+    if first == second:
+        stack.push(Data(value=1))  # insert 1 if it is equal
+        return "Performed EQUAL; <{}> is equal to <{}>; Pushed <1> to stack", first, second
+    else:
+        stack.push(Data(value=0))  # insert 0 if it is not equal
+        return "Performed EQUAL; <{}> is not equal to <{}>; Pushed <0> to stack", first, second
 
+def op_equalverify(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    first, second = stack.pop(), stack.pop()
+    if first == second:
+        return "Performed EQUALVERIFY; <{}> is equal to <{}>; Verify Passed", first, second
+    else:
+        raise ScriptError(f"Performed EQUALVERIFY; <{first}> is not equal to <{second}>; Verify Failed")
 
 
-def process_opcode(opcode: Opcode, script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    if opcode.disabled:
-        message = f"{opcode.value} is disabled"
-        return SimulationStep(script=script, stack=stack, message=message, failed=True)
-    
-    if not enough_args(opcode.arg_count, stack):
-        message = f"{opcode.value} requires {opcode.arg_count} arguments but was given {len(stack)}"
-        return SimulationStep(script=script, stack=stack, message=message, failed=True)
-
-
-    if opcode in UNARY_OPS:     
-        return unary_operation(opcode, script, stack)
-    elif opcode in BINARY_OPS:
-        return binary_operation(opcode, script, stack)
-    elif opcode in STACK_OPS:   
-        return stack_operation(opcode, script, stack)
-    elif opcode in SIGNATURE_OPS:
-        return signature_operation(opcode, script, stack)
-    elif opcode in EQUALITY_OPS:
-        return equality_operation(opcode, script, stack)
-    elif opcode == OP_VERIFY:
-        top = stack.pop(0)
-
-        msg = f"Performed verify on {top}; Verify "
-        msg += "passed" if bool(top) else "failed"
-
-        return SimulationStep(script=script, stack=stack, message=msg, failed=bool(top))
-            
-    elif opcode == OP_WITHIN:
-        hi = stack.pop(0)
-        lo = stack.pop(0)
-        x = stack.pop(0)
-
-        if (type(hi) != int) or (type(lo) != int) or (type(x) != int):
-            msg = f"Failed to perform WITHIN; "
-
-            if type(hi) != int: msg += f"High end of range requires type Int, but found type String"
-            
-            if type(hi) != int and type(lo) != int: msg += "; "
-            if type(lo) != int: msg += f"Low end of range requires type Int, but found type String"
-        
-            if type(hi) != int and type(x) != int: msg += "; "
-            if type(x)  != int: msg += f"High end of range requires type Int, but found type String"
+def op_verify(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    top = stack.pop()
 
-            return SimulationStep(script=script, stack=stack, message=msg)
+    if is_false(top):
+        raise ScriptError(f"Performed verify on {top}; Verify failed")
 
-        msg = f"Performed WITHIN on <{hi}>, <{lo}>, and <{x}>; "
+    return "Performed verify on {}; Verify passed", top
 
-        if lo <= x < hi:
-            stack.insert(0, Data(value=1))  # insert 1 if it is in range
-            msg += f"<{x}> is within range [{lo}, {hi}); Pushed <1> to stack"
-        else :
-            stack.insert(0, Data(value=0))  # insert 0 if it is out of range
-            msg += f"<{x}> is NOT within range [{lo}, {hi}); Pushed <0> to stack"
 
-        return SimulationStep(script=script, stack=stack, message=msg)
+def op_within(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    hi = pop_num(stack, "WITHIN")
+    lo = pop_num(stack, "WITHIN")
+    x = pop_num(stack, "WITHIN")
 
-    else:
-        # TODO: implement logic for each opcode
-        stack.insert(0, opcode)
-        msg = f"Logic for {opcode.value} not implemented yet; {opcode.value} pushed to stack"
+    if lo <= x < hi:
+        stack.push(Data(value=1))  # insert 1 if it is in range
+        return "Performed WITHIN on <{}>, <{}>, and <{}>; <{}> is within range [{}, {}); Pushed <1> to stack", hi, lo, x, x, lo, hi
+    else :
+        stack.push(Data(value=0))  # insert 0 if it is out of range
+        return "Performed WITHIN on <{}>, <{}>, and <{}>; <{}> is NOT within range [{}, {}); Pushed <0> to stack", hi, lo, x, x, lo, hi
 
-    return SimulationStep(script=script, stack=stack, message=msg)
 
+# Conditionals only ever run in the branches that are executed: a branch that
+# is skipped is jumped over in one step, to the target the program computed for
+# the IF/NOTIF/ELSE before it. Reaching an ELSE means the branch before it ran,
+# so the one after it is skipped.
+def op_if(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    operation = opcode.value[3:]
+    condition = stack.pop()
+
+    execute = not is_false(condition)
+    if opcode is OP_NOTIF:
+        execute = not execute
+
+    if execute:
+        return "Performed {} on <{}>; Executing the branch that follows", operation, condition
+    context.skip_branch = True
+    return "Performed {} on <{}>; Skipping the branch that follows", operation, condition
+
+def op_else(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    context.skip_branch = True
+    return "Reached ELSE; Skipping the branch that follows",
+
+def op_endif(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    return "Reached ENDIF",
+
+def op_return(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    raise ScriptError("Performed RETURN; Script marked as unspendable")
+
+def op_nop(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    return "Performed {}; Nothing to do", opcode.value[3:]
+
+
+# Locktimes are numbers of up to 5 bytes, so that timestamps fit past 2038.
+# Like the NOPs they took the place of, the locktime opcodes leave the stack
+# as it is, and only fail the script when the lock hasn't passed.
+def peek_locktime(stack: Stack, operation: str) -> int:
+    item = stack.peek()
+    if type(item) is not Data or type(item.value) is str:
+        raise ScriptError(f"Failure trying to perform {operation} on <{item}>; Requires a number")
+    try:
+        locktime = decode_num(item.as_bytes(), max_size=5)
+    except ValueError as error:
+        raise ScriptError(f"Failure trying to perform {operation} on <{item}>; {error}")
+    if locktime < 0:
+        raise ScriptError(f"Failure trying to perform {operation} on <{item}>; Locktime is negative")
+    return locktime
+
+def op_checklocktimeverify(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    locktime = peek_locktime(stack, "CHECKLOCKTIMEVERIFY")
+    tx = context.tx
+    if tx is None:
+        raise ScriptError(f"Performed CHECKLOCKTIMEVERIFY on <{locktime}>; Requires a spending transaction")
+
+    if not locktime_satisfied(tx, context.input_index, locktime):
+        raise ScriptError(f"Performed CHECKLOCKTIMEVERIFY on <{locktime}>; Transaction locktime <{tx.locktime}> with input sequence <{tx.inputs[context.input_index].sequence}> doesn't satisfy it; Verify failed")
+    return "Performed CHECKLOCKTIMEVERIFY on <{}>; Transaction locktime <{}> satisfies it; Verify passed", locktime, tx.locktime
+
+def op_checksequenceverify(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    sequence = peek_locktime(stack, "CHECKSEQUENCEVERIFY")
+    if sequence & SEQUENCE_DISABLE_FLAG:
+        return "Performed CHECKSEQUENCEVERIFY on <{}>; Relative locktime is disabled", sequence
+
+    tx = context.tx
+    if tx is None:
+        raise ScriptError(f"Performed CHECKSEQUENCEVERIFY on <{sequence}>; Requires a spending transaction")
+
+    tx_sequence = tx.inputs[context.input_index].sequence
+    if not sequence_satisfied(tx, context.input_index, sequence):
+        raise ScriptError(f"Performed CHECKSEQUENCEVERIFY on <{sequence}>; Input sequence <{tx_sequence}> of a version <{tx.version}> transaction doesn't satisfy it; Verify failed")
+    return "Performed CHECKSEQUENCEVERIFY on <{}>; Input sequence <{}> satisfies it; Verify passed", sequence, tx_sequence
+
+
+def op_hash(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    operation = opcode.value[3:]
+    item = stack.pop()
+
+    data = item_bytes(item)
+    if data is None:
+        raise ScriptError("Failure trying to perform {} on {}; Requires data, but found an opcode", operation, item)
+
+    digest = Data(value=hash_item(opcode, data))
+    stack.push(digest)
+    return "Performed {} on <{}>; Pushed <{}> to stack", operation, item, digest
+
+
+def op_size(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    item = stack.peek()
+    data = item_bytes(item)
+    if data is None:
+        raise ScriptError("Failure trying to perform SIZE on {}; Requires data, but found an opcode", item)
+
+    size = len(data)
+    stack.push(Data(value=size))
+    return "Performed SIZE on <{}>; Pushed <{}> to stack", item, size
+
+
+# the reserved opcodes fail the script when they are executed
+def op_reserved(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    raise ScriptError(f"{opcode.value} is reserved; Script fails when it is executed")
+
+# opcodes the simulator doesn't model, such as OP_CODESEPARATOR, whose effect
+# on the signed script code isn't taken into account
+def op_not_supported(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    raise ScriptError(f"{opcode.value} is not supported")
+
+
+# Handler for every opcode, indexed by opcode code
+HANDLERS: list[Handler] = [op_not_supported] * 256
+
+for code in NUMBER_CONSTANTS:
+    HANDLERS[code] = op_push_number
+
+for code, handler in {
+    OP_1ADD.code:               unary_operation(lambda a: a + 1),
+    OP_1SUB.code:               unary_operation(lambda a: a - 1),
+    OP_NEGATE.code:             unary_operation(lambda a: -a),
+    OP_ABS.code:                unary_operation(abs),
+    OP_NOT.code:                unary_operation(lambda a: int(a == 0)),
+    OP_0NOTEQUAL.code:          unary_operation(lambda a: int(a != 0)),
+
+    OP_ADD.code:                binary_operation(lambda a, b: a + b),
+    OP_SUB.code:                binary_operation(lambda a, b: a - b),
+    OP_BOOLAND.code:            binary_operation(lambda a, b: int(a != 0 and b != 0)),
+    OP_BOOLOR.code:             binary_operation(lambda a, b: int(a != 0 or b != 0)),
+    OP_NUMEQUAL.code:           binary_operation(lambda a, b: int(a == b)),
+    OP_NUMEQUALVERIFY.code:     binary_operation(lambda a, b: int(a == b), verify=True),
+    OP_NUMNOTEQUAL.code:        binary_operation(lambda a, b: int(a != b)),
+    OP_LESSTHAN.code:           binary_operation(lambda a, b: int(a < b)),
+    OP_GREATERTHAN.code:        binary_operation(lambda a, b: int(a > b)),
+    OP_LESSTHANOREQUAL.code:    binary_operation(lambda a, b: int(a <= b)),
+    OP_GREATERTHANOREQUAL.code: binary_operation(lambda a, b: int(a >= b)),
+    OP_MIN.code:                binary_operation(min),
+    OP_MAX.code:                binary_operation(max),
+
+    OP_DEPTH.code:              op_depth,
+    OP_DUP.code:                op_dup,
+    OP_DROP.code:               op_drop,
+    OP_2DROP.code:              op_2drop,
+    OP_2DUP.code:               op_2dup,
+    OP_2OVER.code:              op_2over,
+    OP_2ROT.code:               op_2rot,
+    OP_2SWAP.code:              op_2swap,
+    OP_3DUP.code:               op_3dup,
+    OP_IFDUP.code:              op_ifdup,
+    OP_NIP.code:                op_nip,
+    OP_OVER.code:               op_over,
+    OP_PICK.code:               op_pick_roll,
+    OP_ROLL.code:               op_pick_roll,
+    OP_ROT.code:                op_rot,
+    OP_SWAP.code:               op_swap,
+    OP_TUCK.code:               op_tuck,
+    OP_TOALTSTACK.code:         op_toaltstack,
+    OP_FROMALTSTACK.code:       op_fromaltstack,
+
+    OP_RIPEMD160.code:          op_hash,
+    OP_SHA1.code:               op_hash,
+    OP_SHA256.code:             op_hash,
+    OP_HASH160.code:            op_hash,
+    OP_HASH256.code:            op_hash,
+
+    OP_CHECKSIG.code:           op_checksig,
+    OP_CHECKSIGVERIFY.code:     op_checksig,
+    OP_CHECKMULTISIG.code:      op_checkmultisig,
+    OP_CHECKMULTISIGVERIFY.code: op_checkmultisig,
+
+    OP_EQUAL.code:              op_equal,
+    OP_EQUALVERIFY.code:        op_equalverify,
+
+    OP_IF.code:                 op_if,
+    OP_NOTIF.code:              op_if,
+    OP_ELSE.code:               op_else,
+    OP_ENDIF.code:              op_endif,
+    OP_RETURN.code:             op_return,
+    OP_NOP.code:                op_nop,
+    OP_CHECKLOCKTIMEVERIFY.code: op_checklocktimeverify,
+    OP_CHECKSEQUENCEVERIFY.code: op_checksequenceverify,
+    OP_NOP1.code:               op_nop,
+    OP_NOP4.code:               op_nop,
+    OP_NOP5.code:               op_nop,
+    OP_NOP6.code:               op_nop,
+    OP_NOP7.code:               op_nop,
+    OP_NOP8.code:               op_nop,
+    OP_NOP9.code:               op_nop,
+    OP_NOP10.code:              op_nop,
+    OP_VERIFY.code:             op_verify,
+    OP_WITHIN.code:             op_within,
+    OP_SIZE.code:               op_size,
+
+    OP_RESERVED.code:           op_reserved,
+    OP_VER.code:                op_reserved,
+    OP_RESERVED1.code:          op_reserved,
+    OP_RESERVED2.code:          op_reserved,
+}.items():
+    HANDLERS[code] = handler
+
+
+def process_opcode(opcode: Opcode, stack: Stack, context: ScriptContext) -> Message:
+    if opcode.disabled:
+        raise ScriptError(f"{opcode.value} is disabled")
+    
+    if not enough_args(opcode.arg_count, stack):
+        raise ScriptError(f"{opcode.value} requires {opcode.arg_count} arguments but was given {len(stack)}")
 
-def simulate_step(script: list[ScriptOp], stack: list[ScriptOp]) -> SimulationStep:
-    script_op = script.pop(0)
+    return HANDLERS[opcode.code](opcode, stack, context)
 
-    if type(script_op) == Data:
-        step = push_data(script_op, script, stack)
-    elif type(script_op) == Opcode:
-        step = process_opcode(script_op, script, stack)
-    else:
-        print(type(script_op))
-        step = SimulationStep(script, stack, message=f"TYPE ERROR: (TYPE={type(script_op)})", failed=True)
 
-    return step
+def simulate_step(script_op: ScriptOp, stack: Stack, context: ScriptContext | None = None) -> Message:
+    if type(script_op) is Data:
+        return push_data(script_op, stack)
+    elif type(script_op) is Opcode:
+        return process_opcode(script_op, stack, context or ScriptContext())
+    else:
+        raise ScriptError(f"TYPE ERROR: (TYPE={type(script_op)})")
 
-def validate(stack: list[ScriptOp]) -> bool:
+def validate(stack: Stack) -> bool:
     # if stack is empty, script is invalid
     if len(stack) == 0:
         return False
     
     # if top of stack is False (zero value), script is invalid
-    top = stack[0]
-    if top == OP_0 or top == Data(value=0):
+    if is_false(stack.peek()):
         return False
     
     # if top of stack is True (non-zero value), script is valid
     return True
 
-def simulate_script(script: list[ScriptOp]) -> Simulation:
-    stack = []
-    steps = [SimulationStep(script=script, stack=stack, message="Initial setup")]
+# The first limit a program breaks before running any of it, as the message of
+# its failure. The script size, op count (without the pubkeys of multisigs)
+# and push sizes are known when it is compiled, as is whether its
+# conditionals are balanced and whether it has ops that always fail.
+def check_program(program: Program) -> Message | None:
+    if program.size > MAX_SCRIPT_SIZE:
+        return "Script is {} bytes, more than the limit of {}", program.size, MAX_SCRIPT_SIZE
+    if program.op_count > MAX_OPS_PER_SCRIPT:
+        return "Script has {} ops, more than the limit of {}", program.op_count, MAX_OPS_PER_SCRIPT
+    if program.max_push > MAX_ELEMENT_SIZE:
+        return "Script pushes {} bytes, more than the element size limit of {}", program.max_push, MAX_ELEMENT_SIZE
+    if program.unbalanced is not None:
+        return "Unbalanced conditional: {} at position {} has no matching IF/ENDIF", program.ops[program.unbalanced], program.unbalanced
+    if program.always_fails is not None:
+        return "{} at position {} fails the script, even in a branch that isn't executed", program.ops[program.always_fails], program.always_fails
+    return None
+
+
+# Executes a script, yielding its steps as they happen: every step in full
+# trace mode, otherwise only the failing or final step the mode asks for.
+# Returns whether the script is valid once it is exhausted.
+def iter_simulation(script: Program | list[ScriptOp], trace: TraceMode = TraceMode.FULL, context: ScriptContext | None = None) -> Generator[SimulationStep, None, bool]:
+    program = script if type(script) is Program else compile_ops(script)
+    context = context or ScriptContext()
+    context.altstack = altstack = Stack()
+    ops, code, consts, jumps = program.ops, program.code, program.consts, program.jumps
+    stack = Stack()
+    full_trace = trace == TraceMode.FULL
+    budget = context.max_steps if context.max_steps is not None else len(code)
+    # each script of a joined program gets a fresh alt stack, and counts its
+    # ops against the limit from its own static op count
+    starts = iter(program.starts)
+    next_start = next(starts, None)
+    op_counts = iter(program.op_counts)
+    context.op_count = next(op_counts)
+
+    message = ("Initial setup",)
+    if full_trace:
+        yield SimulationStep(message, ops, 0, stack, altstack)
+
+    # scripts over the static limits are rejected before running any op
+    error = check_program(program)
+    if error is not None:
+        yield SimulationStep(error, ops, 0, stack, altstack, failed=True)
+        return False
 
     # simulate script execution, step by step
-    while script:
-        step = simulate_step(script, stack)
-        steps.append(step)
-        
-        if step.failed:
-            return Simulation(steps=steps, valid=False)
+    pc = 0
+    while pc < len(code):
+        if budget == 0:
+            yield SimulationStep(("Step budget of {} ops used up", context.max_steps), ops, pc, stack, altstack, failed=True)
+            return False
+        budget -= 1
+
+        if pc == next_start:
+            context.altstack = altstack = Stack()
+            context.op_count = next(op_counts)
+            next_start = next(starts, None)
+
+        instruction = code[pc]
+        pc += 1
+
+        try:
+            if instruction < 0:
+                message = push_data(consts[~instruction], stack)
+            else:
+                message = process_opcode(OPCODES_BY_CODE[instruction], stack, context)
+                if context.skip_branch:
+                    context.skip_branch = False
+                    pc = jumps[pc - 1]
+
+            if len(stack) + len(altstack) > MAX_STACK_SIZE:
+                raise ScriptError("Stack size limit of {} items exceeded", MAX_STACK_SIZE)
+        except ScriptError as error:
+            yield SimulationStep(error.message, ops, pc, stack, altstack, failed=True)
+            return False
+
+        if full_trace:
+            yield SimulationStep(message, ops, pc, stack, altstack)
         
     # verify if script is valid at the end of executing it
     valid_script = validate(stack)
 
-    return Simulation(steps=steps, valid=valid_script)
+    if trace == TraceMode.FINAL or (trace == TraceMode.ON_FAILURE and not valid_script):
+        yield SimulationStep(message, ops, pc, stack, altstack)
+
+    return valid_script
+
+
+def simulate_script(script: Program | list[ScriptOp], trace: TraceMode = TraceMode.FULL, context: ScriptContext | None = None) -> Simulation:
+    steps = []
+    simulation = iter_simulation(script, trace, context)
+
+    while True:
+        try:
+            steps.append(next(simulation))
+        except StopIteration as result:
+            return Simulation(steps=steps, valid=result.value)
 
 
 def print_simulation(sim: Simulation) -> None:
@@ -520,4 +1041,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,130 @@
+from enum import Enum
+from opcodes import *
+from program import Program
+from secp256k1 import BatchVerifier
+from simulator import ScriptContext, Simulation, SimulationStep, Stack, TraceMode, check_multisig, check_program, check_sig, hash_item, is_pubkey, is_signature, item_bytes, item_num, simulate_script
+
+
+# Standard forms of scripts (unlocking script followed by locking script)
+class ScriptType(str, Enum):
+    P2PK = "p2pk"
+    P2PKH = "p2pkh"
+    MULTISIG = "multisig"
+    NONSTANDARD = "nonstandard"
+
+
+# The number pushed by an instruction, as data or by one of OP_1..OP_16
+def small_int(program: Program, instruction: int) -> int | None:
+    if instruction >= 0:
+        return None
+    return item_num(program.consts[~instruction])
+
+
+P2PKH_CODE = (OP_DUP.code, OP_HASH160.code, None, OP_EQUALVERIFY.code, OP_CHECKSIG.code)
+
+# Matches the compiled code of a program against the standard forms:
+#   p2pk        <sig> <pubkey> CHECKSIG
+#   p2pkh       <sig> <pubkey> DUP HASH160 <pubkey hash> EQUALVERIFY CHECKSIG
+#   multisig    <dummy> <sig>...x m <m> <pubkey>...x n <n> CHECKMULTISIG
+def classify(program: Program) -> ScriptType:
+    code = program.code
+
+    if len(code) == 3 and code[0] < 0 and code[1] < 0 and code[2] == OP_CHECKSIG.code:
+        return ScriptType.P2PK
+
+    if (len(code) == 7 and code[0] < 0 and code[1] < 0 and code[4] < 0
+            and all(c == expected for c, expected in zip(code[2:], P2PKH_CODE) if expected is not None)):
+        return ScriptType.P2PKH
+
+    if multisig_counts(program) is not None:
+        return ScriptType.MULTISIG
+
+    return ScriptType.NONSTANDARD
+
+
+# (m, n) of a multisig program, or None if the program isn't one
+def multisig_counts(program: Program) -> tuple[int, int] | None:
+    code = program.code
+    if len(code) < 6 or code[-1] != OP_CHECKMULTISIG.code:
+        return None
+
+    n = small_int(program, code[-2])
+    if n is None or not (1 <= n <= 20) or len(code) < n + 5:
+        return None
+
+    m = small_int(program, code[-n - 3])
+    if m is None or not (1 <= m <= n) or len(code) != m + n + 4:
+        return None
+
+    if code[0] >= 0:
+        return None
+    if any(c >= 0 for c in code[1:m + 1]) or any(c >= 0 for c in code[m + 2:m + n + 2]):
+        return None
+
+    return m, n
+
+
+# Validity of a standard script computed directly from its constants, or None
+# when the generic interpreter has to run it. The fast paths only cover the
+# cases where the interpreter is known to reach the same result.
+def fast_validate(program: Program, script_type: ScriptType, context: ScriptContext | None = None) -> bool | None:
+    if script_type == ScriptType.P2PK:
+        signature, pubkey = program.consts
+        return check_sig(signature, pubkey, context)
+
+    if script_type == ScriptType.P2PKH:
+        signature, pubkey, pubkey_hash = program.consts
+        data = item_bytes(pubkey)
+        if data is None or Data(value=hash_item(OP_HASH160, data)) != pubkey_hash:
+            return False
+        return check_sig(signature, pubkey, context)
+
+    if script_type == ScriptType.MULTISIG:
+        m, n = multisig_counts(program)
+        code = program.code
+        signatures = [program.consts[~c] for c in code[1:m + 1]]
+        pubkeys = [program.consts[~c] for c in code[m + 2:m + n + 2]]
+        if not all(is_signature(signature) for signature in signatures) or not all(is_pubkey(pubkey) for pubkey in pubkeys):
+            return None
+        if len(item_bytes(program.consts[~code[0]])) > 0:
+            return None
+        return check_multisig(signatures, pubkeys, m, n, context)
+
+    return None
+
+
+# Simulates a program, skipping the interpreter for valid standard scripts when
+# the trace mode doesn't need any of their steps, as long as they are within
+# the limits and the step budget
+def evaluate(program: Program, trace: TraceMode, context: ScriptContext | None = None) -> tuple[Simulation, ScriptType]:
+    script_type = classify(program)
+
+    within_budget = context is None or context.max_steps is None or context.max_steps >= len(program)
+    if trace == TraceMode.ON_FAILURE and within_budget and check_program(program) is None and fast_validate(program, script_type, context):
+        return Simulation(steps=[], valid=True), script_type
+
+    return simulate_script(program, trace, context), script_type
+
+
+# Evaluates a program of a batch, where an interpreter error in one script must
+# not take down the others: it fails that script instead, at its initial setup
+def evaluate_guarded(program: Program, trace: TraceMode, context: ScriptContext) -> tuple[Simulation, ScriptType]:
+    try:
+        return evaluate(program, trace, context)
+    except Exception as error:
+        step = SimulationStep(("Simulation failed: {}", error), program.ops, 0, Stack(), failed=True)
+        return Simulation(steps=[step], valid=False), classify(program)
+
+
+# Evaluates programs whose signatures commit to the same sighash, verifying all
+# their Schnorr signatures together once every program has run. Until then
+# those checks pass, which under NULLFAIL only misleads scripts that are
+# invalid anyway: the ones with a bad signature are marked invalid afterwards,
+# keeping the steps they were simulated with.
+def evaluate_batch(programs: list[Program], trace: TraceMode, sighash: bytes | None = None, max_steps: int | None = None) -> list[tuple[Simulation, ScriptType]]:
+    batch = BatchVerifier()
+    results = [evaluate_guarded(program, trace, ScriptContext(sighash, batch, index, max_steps)) for index, program in enumerate(programs)]
+
+    for index in batch.verify():
+        results[index][0].valid = False
+    return results
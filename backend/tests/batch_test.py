@@ -0,0 +1,32 @@
+import simulator
+from batch import read_chunks, validate_chunks, validate_line
+from opcodes import OP_NOP
+from program import ScriptEncoding
+
+
+def test_validate_line():
+    assert validate_line(0, b"1 1 OP_ADD", ScriptEncoding.ASM) == (0, True, None, None, None)
+    assert validate_line(1, b"1 OP_0 OP_VERIFY", ScriptEncoding.ASM)[:4] == (1, False, 3, "OP_VERIFY")
+    assert validate_line(2, b"4c", ScriptEncoding.HEX)[:4] == (2, False, None, None)
+    assert validate_line(3, b"OP_VERIFY", ScriptEncoding.ASM)[:4] == (3, False, 1, "OP_VERIFY")
+    assert validate_line(4, b"OP_CHECKSIG", ScriptEncoding.ASM)[:4] == (4, False, 1, "OP_CHECKSIG")
+    assert validate_line(6, b"1 OP_IF", ScriptEncoding.ASM)[:4] == (6, False, 0, None)
+
+    def broken(opcode, stack, context):
+        raise TypeError("broken handler")
+    handler, simulator.HANDLERS[OP_NOP.code] = simulator.HANDLERS[OP_NOP.code], broken
+    try:
+        assert validate_line(5, b"1 OP_NOP", ScriptEncoding.ASM) == (5, False, None, None, "broken handler")
+    finally:
+        simulator.HANDLERS[OP_NOP.code] = handler
+
+
+def test_read_and_validate_mapped_file(tmp_path):
+    path = tmp_path / "scripts.hex"
+    path.write_bytes(b"5151\n\n00\r\n76\n")
+
+    with open(path, "rb") as source:
+        chunks = read_chunks(source, use_mmap=True, copy=False)
+        results = list(validate_chunks(chunks, ScriptEncoding.HEX, workers=0))
+
+    assert [(index, valid) for index, valid, *_ in results] == [(0, True), (2, False), (3, False)]
@@ -0,0 +1,53 @@
+import asyncio
+import json
+from bench import Case, asgi_get, benchmark_function, compare, corpus, run
+from workers import PROGRAM_CACHE, SimulationPool
+
+
+def test_corpus_runs():
+    cases = [Case("add", "opcodes", "1 2 OP_ADD"), Case("push", "stress", "4c0101", "hex")]
+    results = run(cases, ["parse", "simulate", "endpoint"], repeat=1, min_time=0)
+
+    assert [(result["name"], result["benchmark"]) for result in results] == [
+        ("add", "parse"), ("add", "simulate"), ("add", "endpoint"),
+        ("push", "parse"), ("push", "simulate"), ("push", "endpoint"),
+    ]
+    assert all(result["median_us"] > 0 and result["calls"] >= 1 for result in results)
+    # every script of the corpus parses
+    assert len({(case.group, case.name) for case in corpus()}) == len(corpus())
+
+
+def test_endpoint_client():
+    import server
+    status, body = asyncio.run(asgi_get(server.app, "/simulate", {"script": "1 2 OP_ADD 3 OP_EQUAL"}))
+
+    assert status == 200
+    assert json.loads(body)["valid"]
+
+
+def test_endpoint_runs_inline():
+    import server
+    pool = server.POOL
+    server.POOL = SimulationPool(workers=2)
+    try:
+        endpoint = benchmark_function("endpoint", Case("add", "opcodes", "1 2 OP_ADD"))
+        endpoint()
+
+        assert server.POOL.workers == 0
+        # the program was compiled in this process, whose caches are cleared
+        assert len(PROGRAM_CACHE) == 1
+    finally:
+        server.POOL = pool
+
+
+def test_compare():
+    baseline = [{"name": "add", "group": "opcodes", "benchmark": "simulate", "median_us": 10.0}]
+    results = [
+        {"name": "add", "group": "opcodes", "benchmark": "simulate", "median_us": 13.0},
+        {"name": "sub", "group": "opcodes", "benchmark": "simulate", "median_us": 10.0},
+    ]
+    comparison = compare(results, baseline)
+
+    assert len(comparison) == 1
+    assert comparison[0]["ratio"] == 1.3 and comparison[0]["regression"]
+    assert not compare(results, baseline, threshold=1.5)[0]["regression"]
@@ -0,0 +1,35 @@
+from cache import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(capacity=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_size_aware_eviction():
+    cache = LRUCache(capacity=5, sizeof=len)
+    cache.put("a", [1, 2, 3])
+    cache.put("b", [1, 2, 3])
+
+    assert "a" not in cache
+    assert cache.size == 3
+
+    cache.put("c", [1, 2, 3, 4, 5, 6])
+    assert "c" not in cache
+
+
+def test_ttl_expiry():
+    cache = LRUCache(capacity=2, ttl=-1)
+    cache.put("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -0,0 +1,22 @@
+import json
+import logging
+from log import JsonFormatter, SamplingFilter
+
+
+def test_json_formatter_includes_extra_fields():
+    logger = logging.getLogger("btc_script.test")
+    record = logger.makeRecord("btc_script.test", logging.INFO, __file__, 1, "simulated %s", ("script",), None, extra={"valid": True})
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "simulated script"
+    assert entry["level"] == "INFO"
+    assert entry["valid"] == True
+
+
+def test_sampling_keeps_warnings():
+    sampler = SamplingFilter(rate=0)
+    info = logging.LogRecord("btc_script", logging.INFO, __file__, 1, "info", None, None)
+    warning = logging.LogRecord("btc_script", logging.WARNING, __file__, 1, "warning", None, None)
+
+    assert sampler.filter(info) == False
+    assert sampler.filter(warning) == True
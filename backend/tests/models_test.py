@@ -0,0 +1,18 @@
+from opcodes import *
+from models import simulation_to_model
+from simulator import simulate_script
+
+
+def test_simulation_to_model():
+    sim = simulate_script([Data(value=1), OP_DUP])
+    model = simulation_to_model(sim).model_dump()
+
+    assert model["valid"] == True
+    assert model["steps"][1]["message"] == "Pushed <1> to stack"
+    assert model["steps"][1]["script"] == [
+        {"category": "stack", "value": "OP_DUP", "code": 0x76, "arg_count": 1, "disabled": False}
+    ]
+    assert model["steps"][2]["stack"] == [
+        {"category": "data", "value": 1},
+        {"category": "data", "value": 1},
+    ]
@@ -0,0 +1,58 @@
+from opcodes import *
+from program import compile_bytes
+
+
+def test_deserialize_p2pkh():
+    pubkey_hash = bytes(range(20))
+    raw = bytes([0x76, 0xa9, 0x14]) + pubkey_hash + bytes([0x88, 0xac])
+
+    ops = deserialize_script(raw)
+
+    assert ops == [OP_DUP, OP_HASH160, Data(value=pubkey_hash), OP_EQUALVERIFY, OP_CHECKSIG]
+    assert type(ops[2].value) is memoryview
+    assert ops[2].value.obj is raw
+
+
+def test_deserialize_pushdata():
+    raw = bytes.fromhex("4c02abcd" "4d0300010203" "4e01000000ff" "00")
+
+    assert deserialize_script(raw) == [
+        Data(value=b"\xab\xcd"),
+        Data(value=b"\x01\x02\x03"),
+        Data(value=b"\xff"),
+        OP_0,
+    ]
+
+
+def test_deserialize_errors():
+    for raw in (b"\x4c", b"\x4d\x01", b"\x05abc", b"\xba"):
+        try:
+            deserialize_script(raw)
+        except ScriptParseError:
+            pass
+        else:
+            assert False, f"{raw.hex()} should not parse"
+
+
+def test_compile_bytes():
+    program = compile_bytes(bytes.fromhex("0201027c"))
+
+    assert program.code == (~0, OP_SWAP.code)
+    assert program.consts == (Data(value=b"\x01\x02"),)
+
+
+def test_script_numbers():
+    for n in (0, 1, -1, 127, 128, -128, 255, 2**31 - 1, -(2**31 - 1)):
+        assert decode_num(encode_num(n)) == n
+
+    assert encode_num(-128) == b"\x80\x80"
+    for raw in (b"\x01\x00", b"\x80", b"\x00\x00\x00\x00\x01"):
+        try:
+            decode_num(raw)
+        except ValueError:
+            pass
+        else:
+            assert False, f"{raw.hex()} should not decode"
+
+    assert Data(value=1) == Data(value=b"\x01")
+    assert hash(Data(value=1)) == hash(Data(value=b"\x01"))
@@ -0,0 +1,59 @@
+from opcodes import *
+from program import compile_script
+from simulator import simulate_script
+
+
+def test_compile_script():
+    program = compile_script("1 SIG OP_DUP 1")
+
+    assert program.code == (~0, ~1, OP_DUP.code, ~2)
+    assert program.consts == (Data(value=1), Data(value="SIG"), Data(value=1))
+
+
+def test_jump_targets():
+    program = compile_script("1 OP_IF 2 OP_ELSE 3 OP_IF 4 OP_ENDIF OP_ENDIF")
+
+    assert program.jumps == {1: 4, 3: 9, 5: 8}
+
+
+def test_program_reuse():
+    locking = compile_script("PKA OP_CHECKSIG")
+
+    assert simulate_script(compile_script("SIGA") + locking).valid == True
+    assert simulate_script(compile_script("SIGB") + locking).valid == False
+    assert simulate_script(compile_script("SIGA") + locking).valid == True
+
+
+def test_joined_scripts_get_their_own_altstack():
+    program = compile_script("1 OP_TOALTSTACK") + compile_script("OP_FROMALTSTACK")
+
+    assert program.starts == (2,)
+    assert not simulate_script(program).valid
+    assert simulate_script(compile_script("1 OP_TOALTSTACK OP_FROMALTSTACK") + compile_script("OP_DUP")).valid
+
+
+def test_joined_scripts_count_their_own_ops():
+    pubkeys = " ".join(f"PK{i}" for i in range(20))
+    multisig = f"0 0 {pubkeys} 20 OP_CHECKMULTISIG"
+    program = compile_script("1" + " OP_NOP" * 195 + " OP_DROP") + compile_script(multisig)
+
+    assert program.op_counts == (196, 1)
+    assert simulate_script(program).valid
+    assert not simulate_script(compile_script("1 OP_DROP") + compile_script("OP_NOP " * 185 + multisig)).valid
+
+
+def test_unbalanced_conditionals():
+    assert compile_script("1 OP_IF 2 OP_ELSE 3 OP_ENDIF").unbalanced is None
+    assert compile_script("1 OP_IF 2 OP_IF 3 OP_ENDIF").unbalanced == 1
+    assert compile_script("1 OP_ELSE 2").unbalanced == 1
+    assert (compile_script("1 OP_IF") + compile_script("OP_ENDIF")).unbalanced == 1
+
+
+def test_always_failing_ops():
+    assert compile_script("1 OP_IF 2 OP_ENDIF").always_fails is None
+    assert compile_script("0 OP_IF OP_CAT OP_ENDIF 1").always_fails == 2
+    assert (compile_script("1") + compile_script("0 OP_IF OP_VERIF OP_ENDIF")).always_fails == 3
+
+    sim = simulate_script(compile_script("0 OP_IF OP_CAT OP_ENDIF 1"))
+    assert not sim.valid
+    assert sim.steps[-1].message == "OP_CAT at position 2 fails the script, even in a branch that isn't executed"
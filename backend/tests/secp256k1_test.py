@@ -0,0 +1,93 @@
+from program import compile_bytes
+from secp256k1 import BatchVerifier, point_mul, serialize_pubkey, sign_ecdsa, sign_schnorr, verify_ecdsa, verify_schnorr, verify_schnorr_batch
+from simulator import ScriptContext, TraceMode, simulate_script
+from templates import evaluate_batch
+
+
+SIGHASH = bytes(range(32))
+
+def xonly(secret: int) -> bytes:
+    return point_mul(secret)[0].to_bytes(32, "big")
+
+def push(data: bytes) -> bytes:
+    return bytes([len(data)]) + data
+
+
+def test_bip340_vector():
+    pubkey = bytes.fromhex("F9308A019258C31049344F85F89D5229B531C845836F99B08601F113BCE036F9")
+    signature = bytes.fromhex("E907831F80848D1069A5371B402410364BDF1C5F8307B0084C55F1CE2DCA8215"
+                              "25F66A4A85EA8B71E482A74F382D2CE5EBEEE8FDB2172F477DF4900D310536C0")
+
+    assert xonly(3) == pubkey
+    assert sign_schnorr(3, bytes(32)) == signature
+    assert verify_schnorr(bytes(32), signature, pubkey)
+    assert not verify_schnorr(SIGHASH, signature, pubkey)
+
+
+def test_ecdsa():
+    signature = sign_ecdsa(5, SIGHASH)
+
+    assert verify_ecdsa(SIGHASH, signature, serialize_pubkey(point_mul(5)))
+    assert verify_ecdsa(SIGHASH, signature, serialize_pubkey(point_mul(5), compressed=False))
+    assert not verify_ecdsa(SIGHASH, signature, serialize_pubkey(point_mul(6)))
+    assert not verify_ecdsa(bytes(32), signature, serialize_pubkey(point_mul(5)))
+
+
+def test_schnorr_batch():
+    items = [(SIGHASH, sign_schnorr(secret, SIGHASH), xonly(secret)) for secret in range(1, 9)]
+    assert verify_schnorr_batch(items)
+
+    items[3] = (SIGHASH, items[4][1], items[3][2])
+    assert not verify_schnorr_batch(items)
+
+    batch = BatchVerifier()
+    for owner, item in enumerate(items):
+        batch.add(owner, *item)
+    assert batch.verify() == {3}
+
+
+def test_checksig_with_sighash():
+    pubkey = serialize_pubkey(point_mul(7))
+    program = compile_bytes(push(sign_ecdsa(7, SIGHASH) + b"\x01") + push(pubkey) + b"\xac")
+
+    assert simulate_script(program, TraceMode.FINAL, ScriptContext(SIGHASH)).valid
+    # a non-empty signature that fails is an error (NULLFAIL)
+    sim = simulate_script(program, TraceMode.FINAL, ScriptContext(bytes(32)))
+    assert not sim.valid and sim.steps[-1].failed
+
+
+def test_evaluate_batch():
+    programs = [compile_bytes(push(sign_schnorr(secret, SIGHASH)) + push(xonly(secret)) + b"\xac") for secret in range(1, 5)]
+    programs.append(compile_bytes(push(sign_schnorr(1, SIGHASH)) + push(xonly(2)) + b"\xac"))
+
+    results = evaluate_batch(programs, TraceMode.ON_FAILURE, SIGHASH)
+
+    assert [sim.valid for sim, _ in results] == [True] * 4 + [False]
+
+
+def test_batch_checkmultisig():
+    pubkeys = b"".join(push(xonly(secret)) for secret in range(1, 4))
+    def multisig(*secrets):
+        return compile_bytes(b"\x00" + b"".join(push(sign_schnorr(secret, SIGHASH)) for secret in secrets) + b"\x52" + pubkeys + b"\x53\xae")
+
+    # 2-of-3s whose first signature, in the order they are matched, isn't for
+    # the first pubkey it's tried against: script order on the fast path, the
+    # order they're popped in by the interpreter
+    programs = [multisig(2, 3), multisig(1, 2), multisig(1, 4)]
+    for trace in (TraceMode.ON_FAILURE, TraceMode.FINAL):
+        results = evaluate_batch(programs, trace, SIGHASH)
+        assert [sim.valid for sim, _ in results] == [True, True, False]
+
+
+def test_empty_signatures():
+    pubkey = push(serialize_pubkey(point_mul(3)))
+    def result(script):
+        sim = simulate_script(compile_bytes(script))
+        return sim.valid, sim.steps[-1].message
+
+    # an empty signature fails the check without failing the script
+    assert result(b"\x00" + pubkey + b"\xac\x91")[0]
+    assert result(b"\x00\x00\x51" + pubkey + b"\x51\xae\x91")[0]
+    # but the verify variants fail on the verify
+    assert result(b"\x51\x00" + pubkey + b"\xad")[1].endswith("failed with signature <0>; Verify Failed")
+    assert result(b"\x51\x00\x00\x51" + pubkey + b"\x51\xaf") == (False, "Performed CHECKMULTISIGVERIFY; Checkmultisig failed; Verify Failed")
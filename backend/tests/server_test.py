@@ -0,0 +1,98 @@
+import asyncio
+import json
+import server
+from bench import asgi_get, asgi_request
+from workers import SimulationPool
+
+
+def stream(script: str) -> tuple[int, list[dict]]:
+    status, body = asyncio.run(asgi_get(server.app, "/simulate/stream", {"script": script}))
+    return status, [json.loads(line) for line in body.splitlines()]
+
+
+def test_stream_goes_through_pool_limits():
+    pool = server.POOL
+    timeout, max_queue = pool.timeout, pool.max_queue
+    try:
+        status, records = stream("1 2 OP_ADD")
+        assert status == 200 and records[-1] == {"valid": True, "script_type": "nonstandard"}
+        assert pool.pending == 0
+
+        pool.timeout = 0
+        status, records = stream("1 2 OP_ADD")
+        assert records == [{"error": "Simulation timed out after 0s"}]
+        assert pool.pending == 0
+
+        pool.max_queue = 0
+        status, records = stream("1 2 OP_ADD")
+        assert status == 503
+    finally:
+        pool.timeout, pool.max_queue = timeout, max_queue
+
+
+# an inline pool that records the scripts sent to it
+class RecordingPool(SimulationPool):
+    def __init__(self) -> None:
+        super().__init__(workers=0)
+        self.batches = []
+
+    async def map_chunks(self, job, items: list, *args) -> list:
+        self.batches.append(list(items))
+        return await super().map_chunks(job, items, *args)
+
+
+def post_batch(body: bytes, content_type: str = "application/json", params: dict | None = None) -> tuple[int, object]:
+    status, response = asyncio.run(asgi_request(server.app, "POST", "/simulate/batch", params or {}, body, content_type))
+    return status, json.loads(response)
+
+
+def test_batch_simulation():
+    pool, server.POOL = server.POOL, RecordingPool()
+    server.RESULT_CACHE.clear()
+    try:
+        scripts = ["1 2 OP_ADD", "0 OP_VERIFY", "2 3 OP_ADD", "1 2 OP_ADD"]
+        status, results = post_batch(json.dumps(scripts).encode())
+        assert status == 200
+        assert [result["valid"] for result in results] == [True, False, True, True]
+        assert [result["steps"][-1]["stack"] for result in results] == [
+            [{"category": "data", "value": 3}], [], [{"category": "data", "value": 5}], [{"category": "data", "value": 3}]]
+
+        # the duplicate was only simulated once
+        assert [len(batch) for batch in server.POOL.batches] == [3]
+
+        # NDJSON bodies give the same results, and reuse the cached ones
+        body = "\n".join(json.dumps(script) for script in reversed(scripts)).encode() + b"\n\n"
+        status, ndjson_results = post_batch(body, "application/x-ndjson")
+        assert status == 200
+        assert ndjson_results == results[::-1]
+        assert server.POOL.batches[-1] == []
+
+        status, _ = post_batch(json.dumps(["4 OP_DUP", "1 2 OP_ADD"]).encode())
+        assert status == 200
+        assert len(server.POOL.batches[-1]) == 1
+    finally:
+        server.POOL = pool
+
+
+def test_batch_simulation_errors():
+    pool, server.POOL = server.POOL, RecordingPool()
+    try:
+        status, response = post_batch(b"[1")
+        assert status == 400 and response["detail"].startswith("Invalid batch body")
+
+        status, response = post_batch(b'"1"\n[1', "application/x-ndjson")
+        assert status == 400 and response["detail"].startswith("Invalid batch body")
+
+        for body in (b'{"script": "1"}', b'["1", 2]'):
+            status, response = post_batch(body)
+            assert status == 400 and response["detail"] == "Batch body must be a list of script strings"
+
+        status, response = post_batch(b'["51", "zz"]', params={"encoding": "hex"})
+        assert status == 400
+
+        status, response = post_batch(b"[]", params={"sighash": "00"})
+        assert status == 400
+
+        assert server.POOL.batches == []
+    finally:
+        server.POOL = pool
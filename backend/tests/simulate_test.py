@@ -1,5 +1,6 @@
 from opcodes import *
-from simulator import Simulation, SimulationStep, simulate_script, simulate_step
+from program import compile_bytes, compile_script
+from simulator import HASH_CACHE, SIGNATURE_CACHE, ScriptContext, ScriptError, Simulation, SimulationStep, Stack, TraceMode, check_multisig, iter_simulation, simulate_script, simulate_step
 
 
 def test_add_simulation():
@@ -35,3 +36,188 @@ def test_P2PK_simulation():
     assert steps == expected_steps
     assert sim.valid == True
 
+
+
+def test_stack_operations_simulation():
+    cases = [
+        # SCRIPT                        FINAL STACK (top first)
+        ("1 2 3 OP_ROT",                [1, 3, 2]),
+        ("1 2 3 4 5 6 OP_2ROT",         [2, 1, 6, 5, 4, 3]),
+        ("1 2 3 2 OP_PICK",             [1, 3, 2, 1]),
+        ("1 2 3 2 OP_ROLL",             [1, 3, 2]),
+        ("1 2 OP_TUCK",                 [2, 1, 2]),
+        ("1 2 3 4 OP_2SWAP",            [2, 1, 4, 3]),
+    ]
+
+    for script, expected_stack in cases:
+        sim = simulate_script(construct_script(script))
+        assert [data.value for data in sim.steps[-1].stack] == expected_stack
+
+
+def test_steps_record_history():
+    sim = simulate_script(construct_script("1 2 OP_ADD"))
+
+    scripts = [[op.value for op in step.script] for step in sim.steps]
+    stacks = [[data.value for data in step.stack] for step in sim.steps]
+
+    assert scripts == [[1, 2, "OP_ADD"], [2, "OP_ADD"], ["OP_ADD"], []]
+    assert stacks == [[], [1], [2, 1], [3]]
+
+
+def test_trace_modes():
+    valid_script = construct_script("1 2 OP_ADD")
+    invalid_script = construct_script("1 OP_VERIFY OP_0 OP_VERIFY 2")
+
+    assert len(simulate_script(valid_script, TraceMode.FULL).steps) == 4
+    assert simulate_script(valid_script, TraceMode.ON_FAILURE).steps == []
+
+    final = simulate_script(valid_script, TraceMode.FINAL)
+    assert final.valid == True
+    assert [step.message for step in final.steps] == ["Performed ADD on <1> and <2>; Pushed <3> to stack"]
+
+    failure = simulate_script(invalid_script, TraceMode.ON_FAILURE)
+    assert failure.valid == False
+    assert len(failure.steps) == 1
+    assert failure.steps[0].failed
+    assert [op.value for op in failure.steps[0].script] == [2]
+
+
+def test_checkmultisig_simulation():
+    sim = simulate_script(construct_script("OP_0 SIGA SIGB 2 PKA PKB PKC 3 OP_CHECKMULTISIG"))
+
+    assert sim.steps[-1].message == "Performed CHECKMULTISIG; Checkmultisig passed; Pushed <1> to stack"
+    assert sim.valid == True
+
+    # the dummy is consumed, and has to be empty
+    sim = simulate_script(compile_script("OP_0 SIGA 1 PKA 1 OP_CHECKMULTISIG"))
+    assert [data.value for data in sim.steps[-1].stack] == [1]
+    sim = simulate_script(compile_script("1 SIGA 1 PKA 1 OP_CHECKMULTISIG"))
+    assert not sim.valid and "Dummy element <1> is not empty" in sim.steps[-1].message
+
+    pubkeys = " ".join(f"PK{i}" for i in range(21))
+    sim = simulate_script(compile_script(f"OP_0 SIG0 1 {pubkeys} 21 OP_CHECKMULTISIG"))
+    assert sim.steps[-1].message == "Performed CHECKMULTISIG; Pubkey count <21> is over the limit of 20; Checkmultisig failed"
+
+    sim = simulate_script(compile_script("OP_0 SIGA 2 PKA 1 OP_CHECKMULTISIG"))
+    assert "number of necessary signatures specified: <2>" in sim.steps[-1].message
+
+
+def test_checkmultisig_order():
+    pubkeys = [Data("PKA"), Data("PKB"), Data("PKC")]
+
+    assert check_multisig([Data("SIGA"), Data("SIGC")], pubkeys, 2, 3)
+    assert not check_multisig([Data("SIGC"), Data("SIGA")], pubkeys, 2, 3)
+    assert not check_multisig([Data("SIGA"), Data("SIGA")], pubkeys, 2, 3)
+
+
+def test_signature_cache():
+    SIGNATURE_CACHE.clear()
+    simulate_script(construct_script("SIGA PKA OP_CHECKSIG"))
+    hits = SIGNATURE_CACHE.hits
+    simulate_script(construct_script("SIGA PKA OP_CHECKSIG"))
+
+    assert ("SIGA", "PKA") in SIGNATURE_CACHE
+    assert SIGNATURE_CACHE.hits == hits + 1
+
+
+def test_iter_simulation():
+    simulation = iter_simulation(construct_script("1 OP_DUP"))
+
+    assert next(simulation).message == "Initial setup"
+    assert next(simulation).message == "Pushed <1> to stack"
+    assert [data.value for data in next(simulation).stack] == [1, 1]
+
+    try:
+        next(simulation)
+    except StopIteration as result:
+        assert result.value == True
+    else:
+        assert False, "simulation should be exhausted"
+
+
+def test_hash_opcodes():
+    HASH_CACHE.clear()
+    sim = simulate_script(construct_script("abc OP_RIPEMD160 abc OP_SHA256 OP_SHA1"))
+
+    assert [data.value.hex() for data in sim.steps[-1].stack] == [
+        "e588477c58c166189f52daaf15c16719274c2c2e",
+        "df62d400e51d3582d53c2d89cfeb6e10d32a3ca6",
+    ]
+    assert len(HASH_CACHE) == 3
+
+
+def test_flow_control():
+    def final_stack(script: str) -> list:
+        sim = simulate_script(construct_script(script))
+        return [data.value for data in sim.steps[-1].stack]
+
+    assert final_stack("1 OP_IF 2 OP_ELSE 3 OP_ENDIF") == [2]
+    assert final_stack("0 OP_IF 2 OP_ELSE 3 OP_ENDIF") == [3]
+    assert final_stack("0 OP_NOTIF 2 OP_ENDIF") == [2]
+    assert final_stack("1 OP_IF 0 OP_IF 5 OP_ELSE 6 OP_ENDIF OP_ENDIF") == [6]
+    # every ELSE toggles whether the branch that follows runs
+    assert final_stack("0 OP_IF 2 OP_ELSE 3 OP_ELSE 4 OP_ENDIF") == [3]
+
+    skipped = simulate_script(construct_script("0 OP_IF 2 2 2 OP_ENDIF 1"))
+    assert len(skipped.steps) == 4
+
+    assert not simulate_script(construct_script("1 OP_RETURN")).valid
+    assert simulate_script(construct_script("1 OP_ENDIF")).steps[-1].failed
+
+
+def test_altstack():
+    sim = simulate_script(construct_script("1 2 OP_TOALTSTACK 3 OP_FROMALTSTACK"))
+
+    assert [data.value for data in sim.steps[3].altstack] == [2]
+    assert [data.value for data in sim.steps[4].altstack] == [2]
+    assert sim.steps[1].altstack == []
+    assert [data.value for data in sim.steps[-1].stack] == [2, 3, 1]
+    assert sim.steps[-1].altstack == []
+
+    assert not simulate_script(construct_script("1 OP_FROMALTSTACK")).valid
+
+
+def test_consensus_limits():
+    assert simulate_script(compile_script("1 " + "OP_NOP " * 201)).valid
+    assert simulate_script(compile_script("1 " + "OP_NOP " * 202)).steps[-1].message == "Script has 202 ops, more than the limit of 201"
+    assert simulate_script(compile_script("1 " * 1001)).steps[-1].message == "Stack size limit of 1000 items exceeded"
+    assert simulate_script(compile_script("SIG" + "A" * 520)).steps[-1].failed
+    assert simulate_script(compile_script("1 2 3"), context=ScriptContext(max_steps=2)).steps[-1].message == "Step budget of 2 ops used up"
+
+
+def test_stack_underflow():
+    for script in ["OP_CHECKSIG", "1 OP_CHECKSIG", "OP_VERIFY", "OP_CHECKSIGVERIFY", "OP_CHECKMULTISIG"]:
+        sim = simulate_script(compile_script(script))
+        assert not sim.valid and sim.steps[-1].failed
+
+    try:
+        Stack().pop()
+    except ScriptError as error:
+        assert "stack underflow" in error.message[0]
+    else:
+        assert False, "popping an empty stack should fail the script"
+
+
+def test_size_and_unsupported_opcodes():
+    sim = simulate_script(compile_script("SIGABC OP_SIZE"))
+    assert [data.value for data in sim.steps[-1].stack] == [6, "SIGABC"]
+
+    for script, message in [("1 OP_CODESEPARATOR", "OP_CODESEPARATOR is not supported"), ("1 OP_VER", "OP_VER is reserved; Script fails when it is executed")]:
+        sim = simulate_script(compile_script(script))
+        assert not sim.valid and sim.steps[-1].message == message
+    # only when executed
+    assert simulate_script(compile_script("0 OP_IF OP_RESERVED OP_ENDIF 1")).valid
+
+
+def test_script_number_arithmetic():
+    def result(script):
+        program = compile_script(script) if type(script) is str else compile_bytes(script)
+        return simulate_script(program).steps[-1].stack
+
+    assert result("5 3 OP_SUB") == [Data(value=2)]
+    assert result("2 5 OP_LESSTHAN") == [Data(value=1)]
+    assert result("OP_2 OP_3 OP_ADD") == [Data(value=5)]
+    assert result("OP_1NEGATE OP_1ADD") == [Data(value=0)]
+    # numbers pushed as bytes, including the 4 byte limit on operands
+    assert result(bytes.fromhex("0181") + bytes([OP_ABS.code])) == [Data(value=1)]
+    assert not simulate_script(compile_bytes(bytes.fromhex("050000000001") + bytes([OP_1ADD.code]))).valid
@@ -0,0 +1,71 @@
+from hashes import hash160
+from opcodes import *
+from program import compile_bytes, compile_ops, compile_script
+import simulator
+from simulator import TraceMode, simulate_script
+from templates import ScriptType, classify, evaluate, evaluate_batch, fast_validate
+
+
+def test_classify():
+    assert classify(compile_script("SIGA PKA OP_CHECKSIG")) == ScriptType.P2PK
+    assert classify(compile_script("SIGA PKA OP_DUP OP_HASH160 HASHA OP_EQUALVERIFY OP_CHECKSIG")) == ScriptType.P2PKH
+    assert classify(compile_script("OP_0 SIGA SIGB 2 PKA PKB PKC 3 OP_CHECKMULTISIG")) == ScriptType.MULTISIG
+    assert classify(compile_script("OP_0 SIGA OP_1 PKA OP_1 OP_CHECKMULTISIG")) == ScriptType.MULTISIG
+    assert classify(compile_script("OP_0 SIGA 2 PKA PKB 2 OP_CHECKMULTISIG")) == ScriptType.NONSTANDARD
+    assert classify(compile_script("1 2 OP_ADD")) == ScriptType.NONSTANDARD
+
+
+def test_fast_path_matches_interpreter():
+    scripts = [
+        "SIGA PKA OP_CHECKSIG",
+        "SIGA PKB OP_CHECKSIG",
+        "1 PKA OP_CHECKSIG",
+        "OP_0 SIGA SIGB 2 PKA PKB PKC 3 OP_CHECKMULTISIG",
+        "OP_0 SIGA SIGD 2 PKA PKB PKC 3 OP_CHECKMULTISIG",
+        "OP_0 SIGA 1 1 1 OP_CHECKMULTISIG",
+        "1 SIGA SIGB 2 PKA PKB PKC 3 OP_CHECKMULTISIG",
+    ]
+    for script in scripts:
+        program = compile_script(script)
+        expected = simulate_script(program, TraceMode.FINAL).valid
+        assert fast_validate(program, classify(program)) in (None, expected)
+        assert evaluate(program, TraceMode.ON_FAILURE)[0].valid == expected
+
+
+def test_evaluate_keeps_requested_trace():
+    sim, script_type = evaluate(compile_script("SIGA PKA OP_CHECKSIG"), TraceMode.FULL)
+    assert script_type == ScriptType.P2PK
+    assert len(sim.steps) == 4
+
+    sim, _ = evaluate(compile_script("SIGA PKA OP_CHECKSIG"), TraceMode.ON_FAILURE)
+    assert sim.valid and sim.steps == []
+
+
+def test_p2pkh_fast_path():
+    pubkey_hash = hash160(b"PKA")
+    unlocking = bytes([4]) + b"SIGA" + bytes([3]) + b"PKA"
+    locking = bytes([0x76, 0xa9, 0x14]) + pubkey_hash + bytes([0x88, 0xac])
+    program = compile_bytes(unlocking + locking)
+
+    assert classify(program) == ScriptType.P2PKH
+    assert fast_validate(program, ScriptType.P2PKH) is False
+
+    program = compile_script("SIGA PKA OP_DUP OP_HASH160") + compile_ops([Data(value=pubkey_hash), OP_EQUALVERIFY, OP_CHECKSIG])
+    assert fast_validate(program, ScriptType.P2PKH) is True
+    assert simulate_script(program, TraceMode.FINAL).valid
+
+
+def test_batch_isolates_interpreter_errors():
+    def broken(opcode, stack, context):
+        raise TypeError("broken handler")
+
+    programs = [compile_script(script) for script in ["1 1 OP_ADD", "1 OP_NOP", "OP_VERIFY", "SIGA PKA OP_CHECKSIG"]]
+    handler, simulator.HANDLERS[OP_NOP.code] = simulator.HANDLERS[OP_NOP.code], broken
+    try:
+        results = evaluate_batch(programs, TraceMode.FINAL)
+    finally:
+        simulator.HANDLERS[OP_NOP.code] = handler
+
+    assert [sim.valid for sim, _ in results] == [True, False, False, True]
+    assert results[1][0].steps[-1].failed
+    assert results[1][0].steps[-1].message == "Simulation failed: broken handler"
@@ -0,0 +1,82 @@
+from opcodes import Data
+from program import compile_bytes, compile_ops, compile_script
+from secp256k1 import point_mul, sign_schnorr
+from simulator import ScriptContext, TraceMode, simulate_script
+from transaction import Transaction, TxIn, TxOut, parse_transaction
+
+
+# The native P2WPKH example of BIP143: input 0 spends a P2PK output, input 1 a P2WPKH one
+BIP143_TX = bytes.fromhex(
+    "01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f00000000494830450221008b9d1dc26ba6a9cb6212"
+    "7b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a99f2b1c0a19c0489bc22ede944ccf4ecbab4cc618ef3ed01eeff"
+    "ffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b3"
+    "7df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac000247304402"
+    "203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a0220573a954c4518331561406f90300e8f3358f51928d43c212a"
+    "8caed02de67eebee0121025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee635711000000"
+)
+BIP143_PREVOUTS = [
+    TxOut(625_000_000, bytes.fromhex("2103c9f4836b9a4f77fc0d81f7bcb01b7f1b35916864b9476c241ce9fc198bd25432ac")),
+    TxOut(600_000_000, bytes.fromhex("00141d0f172a0ecb48aee1be1f2687d2963ae33f71a1")),
+]
+
+
+def test_parse_transaction():
+    tx = parse_transaction(BIP143_TX, BIP143_PREVOUTS)
+
+    assert tx.version == 1 and tx.locktime == 17
+    assert [txin.sequence for txin in tx.inputs] == [0xffffffee, 0xffffffff]
+    assert len(tx.inputs[1].witness) == 2
+    assert tx.serialize() == BIP143_TX
+    assert tx.signature_hash(1, 1).hex() == "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670"
+
+    try:
+        parse_transaction(BIP143_TX[:-1])
+    except ValueError:
+        pass
+    else:
+        assert False, "a truncated transaction should not parse"
+
+
+def test_inputs_share_transaction():
+    tx = parse_transaction(BIP143_TX, BIP143_PREVOUTS)
+
+    legacy = compile_bytes(tx.inputs[0].script_sig) + compile_bytes(tx.prevouts[0].script_pubkey)
+    assert simulate_script(legacy, TraceMode.FINAL, ScriptContext(tx=tx, input_index=0)).valid
+
+    witness = compile_ops([Data(value=item) for item in tx.inputs[1].witness]) + compile_bytes(tx.script_code(1))
+    assert simulate_script(witness, TraceMode.FINAL, ScriptContext(tx=tx, input_index=1)).valid
+    # signed for input 1, not input 0
+    assert not simulate_script(witness, TraceMode.FINAL, ScriptContext(tx=tx, input_index=0)).valid
+
+
+def test_schnorr_signature_hash():
+    secret = 7
+    pubkey = point_mul(secret)[0].to_bytes(32, "big")
+    prevout = TxOut(1000, b"\x51\x20" + pubkey)
+    tx = Transaction(2, [TxIn(bytes(32), 0, b"", 0xffffffff)], [TxOut(900, b"\x51")], 0, [prevout])
+
+    signature = sign_schnorr(secret, tx.signature_hash(0, 0, schnorr=True))
+    program = compile_bytes(bytes([64]) + signature + bytes([32]) + pubkey + b"\xac")
+    assert simulate_script(program, context=ScriptContext(tx=tx)).valid
+    # the hash type byte changes the message
+    assert not simulate_script(compile_bytes(bytes([65]) + signature + b"\x01" + bytes([32]) + pubkey + b"\xac"), context=ScriptContext(tx=tx)).valid
+
+
+def test_locktime_opcodes():
+    def valid(script, locktime=0, sequence=0, version=2):
+        tx = Transaction(version, [TxIn(bytes(32), 0, b"", sequence)], [], locktime)
+        return simulate_script(compile_script(script), context=ScriptContext(tx=tx)).valid
+
+    assert valid("100 OP_CHECKLOCKTIMEVERIFY", locktime=100)
+    assert not valid("101 OP_CHECKLOCKTIMEVERIFY", locktime=100)
+    # heights and timestamps don't compare
+    assert not valid("100 OP_CHECKLOCKTIMEVERIFY", locktime=600_000_000)
+    assert not valid("100 OP_CHECKLOCKTIMEVERIFY", locktime=100, sequence=0xffffffff)
+    assert not valid("-1 OP_CHECKLOCKTIMEVERIFY", locktime=100)
+    assert not simulate_script(compile_script("100 OP_CHECKLOCKTIMEVERIFY")).valid
+
+    assert valid("10 OP_CHECKSEQUENCEVERIFY", sequence=10)
+    assert not valid("11 OP_CHECKSEQUENCEVERIFY", sequence=10)
+    assert not valid("10 OP_CHECKSEQUENCEVERIFY", sequence=10, version=1)
+    # relative locktimes with the disable flag pass as NOPs
+    assert simulate_script(compile_script(f"{2**31} OP_CHECKSEQUENCEVERIFY")).valid
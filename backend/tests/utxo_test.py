@@ -0,0 +1,25 @@
+from transaction import TxOut
+from utxo import Snapshot, UTXOStore, build_store, open_utxo, write_snapshot
+
+
+def test_build_and_query_store(tmp_path):
+    entries = [(bytes([i % 251, i // 251]) + bytes(30) + (i % 3).to_bytes(4, "little"), TxOut(i, bytes([0x51]) * (i % 700))) for i in range(3000)]
+    # a later record for the same outpoint replaces the earlier one
+    entries.append((entries[5][0], TxOut(99, b"\x52")))
+    with open(tmp_path / "snapshot.bin", "wb") as output:
+        write_snapshot(output, entries)
+
+    # small runs, so that the build merges several of them
+    assert build_store(str(tmp_path / "snapshot.bin"), str(tmp_path / "store.bin"), run_records=500) == 3000
+    store = open_utxo(str(tmp_path / "store.bin"))
+    assert type(store) is UTXOStore
+    assert type(open_utxo(str(tmp_path / "snapshot.bin"))) is Snapshot
+
+    assert store.get(entries[100][0]).amount == 100
+    assert store.get(entries[100][0]).script_pubkey == bytes([0x51]) * 100
+    assert store.get(entries[5][0]).amount == 99
+    assert store.get(b"\xff" * 36) is None and store.get(bytes(35) + b"\x07") is None
+
+    outpoints = [outpoint for outpoint, _ in reversed(entries[:2000])] + [b"\xfe" * 36]
+    amounts = [None if txout is None else txout.amount for txout in store.get_many(outpoints)]
+    assert amounts == [99 if i == 5 else i for i in reversed(range(2000))] + [None]
@@ -0,0 +1,112 @@
+from concurrent.futures import ProcessPoolExecutor
+from hashes import hash160
+from secp256k1 import G, BatchVerifier, lift_x, multi_mul, point_mul, serialize_pubkey, sign_ecdsa, sign_schnorr, tagged_hash
+from transaction import Transaction, TxIn, TxOut, ser_bytes, ser_compact_size
+from utxo import Snapshot, UTXOStore, build_store, write_snapshot
+from validate import validate_file, validate_input
+
+
+def push(data: bytes) -> bytes:
+    return bytes([len(data)]) + data
+
+def p2pkh(pubkey: bytes) -> bytes:
+    return b"\x76\xa9\x14" + hash160(pubkey) + b"\x88\xac"
+
+
+# A block with a coinbase and two transactions: the first spends a P2PKH, a
+# P2WPKH and a taproot output from the snapshot, the second spends an output of
+# the first with a signature of the wrong message
+def build_block(tmp_path):
+    pubkey = serialize_pubkey(point_mul(11))
+    xonly = point_mul(12)[0].to_bytes(32, "big")
+
+    funding = [
+        TxOut(1000, p2pkh(pubkey)),
+        TxOut(2000, b"\x00\x14" + hash160(pubkey)),
+        TxOut(3000, b"\x51\x20" + xonly),
+    ]
+    outpoints = [bytes([i]) * 32 + bytes(4) for i in range(1, 4)]
+    with open(tmp_path / "utxo.bin", "wb") as output:
+        write_snapshot(output, zip(outpoints, funding))
+
+    tx = Transaction(2, [TxIn(outpoint[:32], 0, b"", 0xffffffff) for outpoint in outpoints], [TxOut(5000, p2pkh(pubkey))], 0, funding)
+    tx.inputs[0].script_sig = push(sign_ecdsa(11, tx.signature_hash(0, 1)) + b"\x01") + push(pubkey)
+    tx.inputs[1].witness = [sign_ecdsa(11, tx.signature_hash(1, 1)) + b"\x01", pubkey]
+    tx.inputs[2].witness = [sign_schnorr(12, tx.signature_hash(2, 0, schnorr=True))]
+
+    spend = Transaction(2, [TxIn(tx.txid, 0, b"", 0xffffffff)], [TxOut(4000, b"\x51")], 0, [tx.outputs[0]])
+    spend.inputs[0].script_sig = push(sign_ecdsa(11, bytes(32)) + b"\x01") + push(pubkey)
+
+    coinbase = Transaction(1, [TxIn(bytes(32), 0xffffffff, b"\x01\x01", 0xffffffff)], [TxOut(50, b"\x51")], 0)
+    block = bytes(80) + ser_compact_size(3) + coinbase.serialize() + tx.serialize() + spend.serialize()
+    (tmp_path / "block.dat").write_bytes(block)
+    return str(tmp_path / "block.dat"), Snapshot(str(tmp_path / "utxo.bin"))
+
+
+def test_validate_block(tmp_path):
+    path, snapshot = build_block(tmp_path)
+    reports = list(validate_file(path, "block", snapshot, {}, set(), None, 0))
+
+    assert [(report["index"], report["valid"], report["inputs"]) for report in reports] == [(0, True, 0), (1, True, 3), (2, False, 1)]
+    assert reports[2]["failures"][0]["input"] == 0
+    assert reports[2]["failures"][0]["failing_opcode"] == "OP_CHECKSIG"
+
+    # the outputs the block spent are gone the second time around
+    spent = set()
+    list(validate_file(path, "block", snapshot, {}, spent, None, 0))
+    again = list(validate_file(path, "block", snapshot, {}, spent, None, 0))
+    assert [failure["error"] for failure in again[1]["failures"]] == ["Spent output not found"] * 3
+
+
+def test_validate_block_on_pool(tmp_path):
+    path, _ = build_block(tmp_path)
+    build_store(str(tmp_path / "utxo.bin"), str(tmp_path / "utxo.store"))
+    store = UTXOStore(str(tmp_path / "utxo.store"))
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        reports = list(validate_file(path, "block", store, {}, set(), executor, 2))
+
+    assert [report["valid"] for report in reports] == [True, True, False]
+
+
+# An output committing to a single tapscript leaf, and the control block spending it
+def taproot_leaf(leaf: bytes) -> tuple[bytes, bytes]:
+    internal = point_mul(5)[0].to_bytes(32, "big")
+    tweak = tagged_hash("TapTweak", internal + tagged_hash("TapLeaf", b"\xc0" + ser_bytes(leaf)))
+    output = multi_mul([(1, lift_x(int.from_bytes(internal, "big"))), (int.from_bytes(tweak, "big"), G)])
+    return b"\x51\x20" + output[0].to_bytes(32, "big"), bytes([0xc0 | output[1] % 2]) + internal
+
+
+def test_validate_input_failures():
+    script, control = taproot_leaf(b"\x51\xba")
+    prevouts = [TxOut(1, b"\xba"), TxOut(1, b"\x4c\x05"), TxOut(1, b"\xac"), TxOut(1, script), TxOut(1, b"\x51\x63")]
+    tx = Transaction(2, [TxIn(bytes([i]) * 32, 0, b"", 0xffffffff) for i in range(5)], [TxOut(1, b"\x51")], 0, prevouts)
+    tx.inputs[3].witness = [b"\x51\xba", control]
+
+    results = [validate_input(tx, index, BatchVerifier(), 0) for index in range(5)]
+    assert [result[1] for result in results] == [False] * 5
+    assert results[0][4] == "Unknown opcode 0xba at byte 0"
+    assert results[2][3] == "OP_CHECKSIG"
+    assert results[3][4] == "Tapscript opcode 0xba is not supported"
+    assert results[4][2:4] == (0, None)
+
+
+def test_signature_versions():
+    xonly = point_mul(12)[0].to_bytes(32, "big")
+    pubkey = serialize_pubkey(point_mul(12))
+    leaf = push(pubkey) + b"\xac"
+    script, control = taproot_leaf(leaf)
+    prevouts = [TxOut(1, push(xonly) + b"\xac"), TxOut(1, script)]
+    tx = Transaction(2, [TxIn(bytes([i]) * 32, 0, b"", 0xffffffff) for i in range(2)], [TxOut(1, b"\x51")], 0, prevouts)
+
+    # a 32 byte key in a legacy script isn't a Schnorr key
+    tx.inputs[0].script_sig = push(sign_schnorr(12, tx.signature_hash(0, 0, schnorr=True)))
+    # and a 33 byte key in tapscript is of an unknown type, which passes
+    tx.inputs[1].witness = [b"\x01" * 64, leaf, control]
+
+    results = [validate_input(tx, index, BatchVerifier(), 0) for index in range(2)]
+    assert [result[1] for result in results] == [False, True]
+
+
+def test_validate_empty_file(tmp_path):
+    (tmp_path / "empty.dat").write_bytes(b"")
+    assert list(validate_file(str(tmp_path / "empty.dat"), "tx", None, {}, set(), None, 0)) == []
@@ -0,0 +1,38 @@
+import asyncio
+from program import normalize_script
+from simulator import TraceMode
+from workers import PROGRAM_CACHE, SimulationPool, merge_cache_stats, simulate_chunk
+
+
+def test_map_chunks_keeps_order():
+    scripts = [normalize_script(f"{i} OP_VERIFY {i}") for i in range(10)]
+
+    for workers in (0, 2):
+        pool = SimulationPool(workers=workers)
+        results = asyncio.run(pool.map_chunks(simulate_chunk, scripts, TraceMode.FINAL))
+        pool.shutdown()
+
+        assert [result.valid for result in results] == [False] + [True] * 9
+        assert [result.steps[0].stack[0].value for result in results[1:]] == list(range(1, 10))
+
+
+def test_cache_stats_include_workers():
+    PROGRAM_CACHE.clear()
+    scripts = [normalize_script(f"{i} {i} OP_ADD") for i in range(8)]
+
+    pool = SimulationPool(workers=2)
+    asyncio.run(pool.map_chunks(simulate_chunk, scripts, TraceMode.FINAL))
+    stats = pool.cache_stats()
+    pool.shutdown()
+
+    # the scripts were compiled in the workers, not in this process
+    assert len(PROGRAM_CACHE) == 0
+    assert stats["programs"]["entries"] == 8
+    assert stats["programs"]["misses"] == PROGRAM_CACHE.misses + 8
+
+
+def test_merge_cache_stats():
+    first = {"programs": {"entries": 1, "hits": 2}}
+    second = {"programs": {"entries": 3, "hits": 4}}
+    assert merge_cache_stats(first, second) == {"programs": {"entries": 4, "hits": 6}}
+    assert first == {"programs": {"entries": 1, "hits": 2}}
@@ -0,0 +1,437 @@
+from enum import IntEnum
+from hashes import hash256, sha256
+from typing import Iterator
+from opcodes import Data, ScriptParseError, deserialize_script
+from secp256k1 import G, lift_x, multi_mul, tagged_hash
+
+
+# Signature hash types, the last byte of a signature
+SIGHASH_DEFAULT = 0x00          # taproot only: ALL, without the byte in the signature
+SIGHASH_ALL = 0x01
+SIGHASH_NONE = 0x02
+SIGHASH_SINGLE = 0x03
+SIGHASH_ANYONECANPAY = 0x80
+
+# Sequence numbers with this bit set don't enforce a relative locktime
+SEQUENCE_DISABLE_FLAG = 1 << 31
+# Relative locktimes count 512 second units with this bit set, blocks otherwise
+SEQUENCE_TYPE_FLAG = 1 << 22
+# Absolute locktimes below this are block heights, timestamps otherwise
+LOCKTIME_THRESHOLD = 500_000_000
+
+TAPSCRIPT_LEAF_VERSION = 0xc0
+
+
+# The rules a script's signatures are checked under, which pick the signature
+# scheme and hash: ECDSA with the legacy or the BIP143 hash, or Schnorr with
+# the BIP341 one (for tapscript, and for key path spends checked as a CHECKSIG
+# of the output key)
+class SigVersion(IntEnum):
+    BASE = 0
+    WITNESS_V0 = 1
+    TAPSCRIPT = 2
+
+
+# Raised for transactions that can't be parsed
+class TransactionParseError(ValueError):
+    pass
+
+
+class TxIn:
+    __slots__ = ("txid", "vout", "script_sig", "sequence", "witness")
+
+    def __init__(self, txid: bytes, vout: int, script_sig: bytes, sequence: int, witness: list[bytes] | None = None) -> None:
+        self.txid = txid            # in internal byte order, as serialized
+        self.vout = vout
+        self.script_sig = script_sig
+        self.sequence = sequence
+        self.witness = witness or []
+
+    # the output spent, as it is serialized: txid followed by vout
+    @property
+    def outpoint(self) -> bytes:
+        return self.txid + self.vout.to_bytes(4, "little")
+
+    @property
+    def coinbase(self) -> bool:
+        return self.txid == bytes(32) and self.vout == 0xffffffff
+
+class TxOut:
+    __slots__ = ("amount", "script_pubkey")
+
+    def __init__(self, amount: int, script_pubkey: bytes) -> None:
+        self.amount = amount        # in satoshis
+        self.script_pubkey = script_pubkey
+
+    def serialize(self) -> bytes:
+        return self.amount.to_bytes(8, "little") + ser_bytes(self.script_pubkey)
+
+
+def ser_compact_size(n: int) -> bytes:
+    if n < 0xfd:
+        return bytes([n])
+    if n <= 0xffff:
+        return b"\xfd" + n.to_bytes(2, "little")
+    if n <= 0xffffffff:
+        return b"\xfe" + n.to_bytes(4, "little")
+    return b"\xff" + n.to_bytes(8, "little")
+
+def ser_bytes(data: bytes) -> bytes:
+    return ser_compact_size(len(data)) + data
+
+
+# A transaction spending the outputs in prevouts, one per input. It is parsed
+# once and then shared by the evaluations of all of its inputs' scripts: the
+# hashes every signature hash is built from (the BIP143 and BIP341 midstates
+# and the serialized outpoints and outputs of the legacy algorithm) are
+# computed the first time they are needed, and the signature hash of each
+# input is memoized by (input, hash type, signature version).
+class Transaction:
+    __slots__ = ("version", "inputs", "outputs", "locktime", "prevouts", "_txid", "_legacy", "_bip143", "_bip341", "_digests")
+
+    def __init__(self, version: int, inputs: list[TxIn], outputs: list[TxOut], locktime: int, prevouts: list[TxOut] | None = None) -> None:
+        self.version = version
+        self.inputs = inputs
+        self.outputs = outputs
+        self.locktime = locktime
+        self.prevouts = prevouts
+        self._txid = None
+        self._legacy = None
+        self._bip143 = None
+        self._bip341 = None
+        self._digests = {}
+
+    def __repr__(self) -> str:
+        return f"Transaction({self.txid[::-1].hex()}, {len(self.inputs)} inputs, {len(self.outputs)} outputs)"
+
+    @property
+    def segwit(self) -> bool:
+        return any(txin.witness for txin in self.inputs)
+
+    # hash of the serialization without witnesses, in internal byte order
+    @property
+    def txid(self) -> bytes:
+        if self._txid is None:
+            self._txid = hash256(self.serialize(witness=False))
+        return self._txid
+
+    def serialize(self, witness: bool = True) -> bytes:
+        witness = witness and self.segwit
+        parts = [self.version.to_bytes(4, "little"), b"\x00\x01" if witness else b"", ser_compact_size(len(self.inputs))]
+        for txin in self.inputs:
+            parts += [txin.txid, txin.vout.to_bytes(4, "little"), ser_bytes(txin.script_sig), txin.sequence.to_bytes(4, "little")]
+        parts.append(ser_compact_size(len(self.outputs)))
+        parts += [txout.serialize() for txout in self.outputs]
+        if witness:
+            for txin in self.inputs:
+                parts.append(ser_compact_size(len(txin.witness)))
+                parts += [ser_bytes(item) for item in txin.witness]
+        parts.append(self.locktime.to_bytes(4, "little"))
+        return b"".join(parts)
+
+    def prevout(self, index: int) -> TxOut | None:
+        return self.prevouts[index] if self.prevouts is not None else None
+
+    # The script of the output an input spends, or the redeem script when it's
+    # a P2SH output. Empty when the spent output isn't known.
+    def spent_script(self, index: int) -> bytes:
+        txin = self.inputs[index]
+        prevout = self.prevout(index)
+        script = prevout.script_pubkey if prevout is not None else b""
+
+        if len(script) == 23 and script[:2] == b"\xa9\x14" and script[-1] == 0x87 and txin.script_sig:
+            try:
+                ops = deserialize_script(txin.script_sig)
+            except ScriptParseError:
+                return script
+            if ops and type(ops[-1]) is Data:
+                return bytes(ops[-1].value)
+        return script
+
+    # Whether an input spends a segwit v0 output (P2WPKH or P2WSH, possibly
+    # nested in P2SH). Without the spent output, inputs with a witness are.
+    def spends_witness_v0(self, index: int) -> bool:
+        if self.prevouts is None:
+            return bool(self.inputs[index].witness)
+        script = self.spent_script(index)
+        return len(script) in (22, 34) and script[0] == 0 and script[1] == len(script) - 2
+
+    # The script signatures of an input commit to: the script of a P2WSH
+    # output (the last witness item), the equivalent P2PKH script of a P2WPKH
+    # output, and otherwise the spent script itself
+    def script_code(self, index: int) -> bytes:
+        script = self.spent_script(index)
+        if len(script) == 22 and script[:2] == b"\x00\x14":
+            return b"\x76\xa9\x14" + script[2:] + b"\x88\xac"
+        witness = self.inputs[index].witness
+        if len(script) == 34 and script[:2] == b"\x00\x20" and witness:
+            return witness[-1]
+        return script
+
+    # The message a signature with the given hash type signs under sigversion.
+    # Without one it is inferred: the BIP341 hash for Schnorr signatures, the
+    # BIP143 one for ECDSA signatures of segwit v0 inputs, and the legacy one
+    # otherwise.
+    def signature_hash(self, index: int, hashtype: int, schnorr: bool = False, sigversion: SigVersion | None = None) -> bytes | None:
+        if sigversion is None:
+            sigversion = SigVersion.TAPSCRIPT if schnorr else SigVersion(int(self.spends_witness_v0(index)))
+        key = (index, hashtype, sigversion)
+        if key in self._digests:
+            return self._digests[key]
+
+        if sigversion == SigVersion.TAPSCRIPT:
+            digest = self.bip341_hash(index, hashtype)
+        elif sigversion == SigVersion.WITNESS_V0:
+            digest = self.bip143_hash(index, hashtype)
+        else:
+            digest = self.legacy_hash(index, hashtype)
+        self._digests[key] = digest
+        return digest
+
+    # The original algorithm serializes a copy of the whole transaction for
+    # every signature. The outpoints and outputs are serialized once, so that
+    # each input only pays for concatenating them. OP_CODESEPARATOR and the
+    # removal of the signature from the script code aren't modeled.
+    def legacy_hash(self, index: int, hashtype: int) -> bytes:
+        base = hashtype & 0x1f
+        if base == SIGHASH_SINGLE and index >= len(self.outputs):
+            # the one Bitcoin signs instead of failing, kept for compatibility
+            return (1).to_bytes(32, "little")
+
+        if self._legacy is None:
+            outpoints = [txin.txid + txin.vout.to_bytes(4, "little") for txin in self.inputs]
+            self._legacy = outpoints, [txout.serialize() for txout in self.outputs]
+        outpoints, outputs = self._legacy
+
+        script_code = self.script_code(index)
+        inputs = [(index, self.inputs[index])] if hashtype & SIGHASH_ANYONECANPAY else enumerate(self.inputs)
+        parts = [self.version.to_bytes(4, "little"), ser_compact_size(1 if hashtype & SIGHASH_ANYONECANPAY else len(self.inputs))]
+        for i, txin in inputs:
+            sequence = txin.sequence if i == index or base not in (SIGHASH_NONE, SIGHASH_SINGLE) else 0
+            parts += [outpoints[i], ser_bytes(script_code) if i == index else b"\x00", sequence.to_bytes(4, "little")]
+
+        if base == SIGHASH_NONE:
+            parts.append(b"\x00")
+        elif base == SIGHASH_SINGLE:
+            parts.append(ser_compact_size(index + 1))
+            parts += [b"\xff" * 8 + b"\x00"] * index
+            parts.append(outputs[index])
+        else:
+            parts.append(ser_compact_size(len(outputs)))
+            parts += outputs
+
+        parts += [self.locktime.to_bytes(4, "little"), hashtype.to_bytes(4, "little")]
+        return hash256(b"".join(parts))
+
+    # BIP143 (segwit v0): the hashes of all outpoints, sequences and outputs
+    # are the same for every input, so they're computed once
+    def bip143_hash(self, index: int, hashtype: int) -> bytes:
+        if self._bip143 is None:
+            self._bip143 = (
+                hash256(b"".join(txin.txid + txin.vout.to_bytes(4, "little") for txin in self.inputs)),
+                hash256(b"".join(txin.sequence.to_bytes(4, "little") for txin in self.inputs)),
+                hash256(b"".join(txout.serialize() for txout in self.outputs)),
+            )
+        hash_prevouts, hash_sequence, hash_outputs = self._bip143
+
+        base = hashtype & 0x1f
+        anyonecanpay = hashtype & SIGHASH_ANYONECANPAY
+        if anyonecanpay:
+            hash_prevouts = bytes(32)
+        if anyonecanpay or base in (SIGHASH_NONE, SIGHASH_SINGLE):
+            hash_sequence = bytes(32)
+        if base == SIGHASH_SINGLE:
+            hash_outputs = hash256(self.outputs[index].serialize()) if index < len(self.outputs) else bytes(32)
+        elif base == SIGHASH_NONE:
+            hash_outputs = bytes(32)
+
+        txin = self.inputs[index]
+        prevout = self.prevout(index)
+        amount = prevout.amount if prevout is not None else 0
+        return hash256(b"".join([
+            self.version.to_bytes(4, "little"), hash_prevouts, hash_sequence,
+            txin.txid, txin.vout.to_bytes(4, "little"), ser_bytes(self.script_code(index)),
+            amount.to_bytes(8, "little"), txin.sequence.to_bytes(4, "little"),
+            hash_outputs, self.locktime.to_bytes(4, "little"), hashtype.to_bytes(4, "little"),
+        ]))
+
+    # BIP341 (taproot): like BIP143, with single SHA256 midstates that also
+    # commit to the amounts and scripts of every spent output. Inputs whose
+    # witness has a script and a control block are tapscript spends, which
+    # also commit to the hash of the leaf script.
+    def bip341_hash(self, index: int, hashtype: int) -> bytes | None:
+        if self.prevouts is None or hashtype not in (0x00, 0x01, 0x02, 0x03, 0x81, 0x82, 0x83):
+            return None
+        base = hashtype & 0x03
+        anyonecanpay = hashtype & SIGHASH_ANYONECANPAY
+        if base == SIGHASH_SINGLE and index >= len(self.outputs):
+            return None
+
+        if self._bip341 is None:
+            self._bip341 = (
+                sha256(b"".join(txin.txid + txin.vout.to_bytes(4, "little") for txin in self.inputs)),
+                sha256(b"".join(prevout.amount.to_bytes(8, "little") for prevout in self.prevouts)),
+                sha256(b"".join(ser_bytes(prevout.script_pubkey) for prevout in self.prevouts)),
+                sha256(b"".join(txin.sequence.to_bytes(4, "little") for txin in self.inputs)),
+                sha256(b"".join(txout.serialize() for txout in self.outputs)),
+            )
+
+        txin = self.inputs[index]
+        witness = txin.witness
+        annex = witness[-1] if len(witness) >= 2 and witness[-1][:1] == b"\x50" else None
+        script_path = len(witness) - (annex is not None) >= 2
+
+        parts = [b"\x00", bytes([hashtype]), self.version.to_bytes(4, "little"), self.locktime.to_bytes(4, "little")]
+        if not anyonecanpay:
+            parts += self._bip341[:4]
+        if base not in (SIGHASH_NONE, SIGHASH_SINGLE):
+            parts.append(self._bip341[4])
+
+        parts.append(bytes([2 * script_path + (annex is not None)]))
+        if anyonecanpay:
+            prevout = self.prevouts[index]
+            parts += [txin.txid, txin.vout.to_bytes(4, "little"), prevout.serialize(), txin.sequence.to_bytes(4, "little")]
+        else:
+            parts.append(index.to_bytes(4, "little"))
+        if annex is not None:
+            parts.append(sha256(ser_bytes(annex)))
+        if base == SIGHASH_SINGLE:
+            parts.append(sha256(self.outputs[index].serialize()))
+
+        if script_path:
+            script, control = witness[-3:-1] if annex is not None else witness[-2:]
+            parts += [tagged_hash("TapLeaf", bytes([control[0] & 0xfe if control else 0]) + ser_bytes(script)), b"\x00", b"\xff" * 4]
+
+        return tagged_hash("TapSighash", b"".join(parts))
+
+
+# Reads a serialized transaction field by field, failing on truncated input
+class _Reader:
+    __slots__ = ("view", "position")
+
+    def __init__(self, data: bytes | memoryview) -> None:
+        self.view = memoryview(data)
+        self.position = 0
+
+    def read(self, size: int) -> bytes:
+        end = self.position + size
+        if end > len(self.view):
+            raise TransactionParseError(f"Transaction ends at byte {len(self.view)}, expected {size} more bytes at byte {self.position}")
+        data = bytes(self.view[self.position:end])
+        self.position = end
+        return data
+
+    def read_int(self, size: int) -> int:
+        return int.from_bytes(self.read(size), "little")
+
+    def read_compact_size(self) -> int:
+        n = self.read_int(1)
+        if n < 0xfd:
+            return n
+        return self.read_int({0xfd: 2, 0xfe: 4, 0xff: 8}[n])
+
+    def read_bytes(self) -> bytes:
+        return self.read(self.read_compact_size())
+
+
+def read_transaction(reader: _Reader, prevouts: list[TxOut] | None = None) -> Transaction:
+    version = reader.read_int(4)
+    count = reader.read_compact_size()
+
+    # segwit serialization: a 0 input count marker followed by the 1 flag
+    segwit = count == 0
+    if segwit:
+        if reader.read_int(1) != 1:
+            raise TransactionParseError("Invalid segwit flag")
+        count = reader.read_compact_size()
+
+    inputs = []
+    for _ in range(count):
+        txid, vout = reader.read(32), reader.read_int(4)
+        inputs.append(TxIn(txid, vout, reader.read_bytes(), reader.read_int(4)))
+
+    outputs = []
+    for _ in range(reader.read_compact_size()):
+        amount = reader.read_int(8)
+        outputs.append(TxOut(amount, reader.read_bytes()))
+
+    if segwit:
+        for txin in inputs:
+            txin.witness = [reader.read_bytes() for _ in range(reader.read_compact_size())]
+
+    locktime = reader.read_int(4)
+    if prevouts is not None and len(prevouts) != len(inputs):
+        raise TransactionParseError(f"Transaction has {len(inputs)} inputs, but {len(prevouts)} spent outputs were given")
+    return Transaction(version, inputs, outputs, locktime, prevouts)
+
+def parse_transaction(raw: bytes | memoryview, prevouts: list[TxOut] | None = None) -> Transaction:
+    reader = _Reader(raw)
+    tx = read_transaction(reader, prevouts)
+    if reader.position != len(reader.view):
+        raise TransactionParseError(f"{len(reader.view) - reader.position} bytes left after the end of the transaction")
+    return tx
+
+
+BLOCK_HEADER_SIZE = 80
+
+# Parses transactions laid end to end, yielding each one with its offset and
+# size in data, so that it can be parsed again from the same bytes later on.
+# Without a count, they are read until the end of data.
+def iter_transactions(data: bytes | memoryview, offset: int = 0, count: int | None = None) -> Iterator[tuple[int, int, Transaction]]:
+    reader = _Reader(data)
+    reader.position = offset
+    while reader.position < len(reader.view) if count is None else count > 0:
+        start = reader.position
+        tx = read_transaction(reader)
+        yield start, reader.position - start, tx
+        if count is not None:
+            count -= 1
+
+# The transactions of a serialized block, after its 80 byte header and count
+def iter_block(data: bytes | memoryview) -> Iterator[tuple[int, int, Transaction]]:
+    reader = _Reader(data)
+    reader.position = BLOCK_HEADER_SIZE
+    count = reader.read_compact_size()
+    yield from iter_transactions(data, reader.position, count)
+
+
+# BIP341: whether a taproot output key commits to a leaf script, given the
+# control block of its spend. The leaf hash is combined with the merkle path in
+# the control block into the root, which tweaks the internal key into the
+# output key.
+def taproot_commits(output_key: bytes, control: bytes, script: bytes) -> bool:
+    if len(control) < 33 or (len(control) - 33) % 32 or len(control) > 33 + 128 * 32:
+        return False
+    internal = lift_x(int.from_bytes(control[1:33], "big"))
+    if internal is None:
+        return False
+
+    node = tagged_hash("TapLeaf", bytes([control[0] & 0xfe]) + ser_bytes(script))
+    for position in range(33, len(control), 32):
+        sibling = control[position:position + 32]
+        node = tagged_hash("TapBranch", min(node, sibling) + max(node, sibling))
+
+    tweak = int.from_bytes(tagged_hash("TapTweak", control[1:33] + node), "big")
+    point = multi_mul([(1, internal), (tweak, G)])
+    return point is not None and point[0].to_bytes(32, "big") == output_key and point[1] % 2 == control[0] & 1
+
+
+# Whether a locktime of the given kind (height or time) has passed, as
+# OP_CHECKLOCKTIMEVERIFY checks it against the spending transaction
+def locktime_satisfied(tx: Transaction, index: int, locktime: int) -> bool:
+    if (locktime < LOCKTIME_THRESHOLD) != (tx.locktime < LOCKTIME_THRESHOLD):
+        return False
+    if locktime > tx.locktime:
+        return False
+    # a final input disables the transaction's locktime
+    return tx.inputs[index].sequence != 0xffffffff
+
+# Whether a relative locktime has passed, as OP_CHECKSEQUENCEVERIFY checks it
+# against the sequence of the input (BIP112)
+def sequence_satisfied(tx: Transaction, index: int, sequence: int) -> bool:
+    tx_sequence = tx.inputs[index].sequence
+    if tx.version < 2 or tx_sequence & SEQUENCE_DISABLE_FLAG:
+        return False
+    if (sequence & SEQUENCE_TYPE_FLAG) != (tx_sequence & SEQUENCE_TYPE_FLAG):
+        return False
+    return (sequence & 0xffff) <= (tx_sequence & 0xffff)
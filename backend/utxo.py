@@ -0,0 +1,332 @@
+import argparse
+import heapq
+import mmap
+import os
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from cache import LRUCache
+from typing import IO, Iterable, Iterator
+from transaction import TxOut
+
+
+# Snapshot files list unspent outputs as consecutive records of
+#
+#   outpoint (txid in internal byte order, then vout as 4 bytes LE)
+#   amount (8 bytes LE), script length (compact size), script
+#
+# in any order. An outpoint is the same 36 bytes inputs serialize to refer to
+# the output they spend.
+OUTPOINT_SIZE = 36
+
+def write_snapshot(output: IO[bytes], entries: Iterable[tuple[bytes, TxOut]]) -> int:
+    count = 0
+    for outpoint, txout in entries:
+        output.write(outpoint + txout.serialize())
+        count += 1
+    return count
+
+
+# Yields the outpoint of every record with the offset of its amount
+def iter_records(data: bytes | memoryview) -> Iterator[tuple[bytes, int]]:
+    view = memoryview(data)
+    position, end = 0, len(view)
+    while position < end:
+        outpoint = bytes(view[position:position + OUTPOINT_SIZE])
+        offset = position + OUTPOINT_SIZE
+        size, header = read_compact_size(view, offset + 8)
+        position = offset + 8 + header + size
+        if len(outpoint) != OUTPOINT_SIZE or position > end:
+            raise ValueError(f"Snapshot record at byte {offset - OUTPOINT_SIZE} runs past the end of the file")
+        yield outpoint, offset
+
+# the value of the compact size at position, and the number of bytes it takes
+def read_compact_size(view: memoryview, position: int) -> tuple[int, int]:
+    if position >= len(view):
+        return 0, len(view)
+    n = view[position]
+    if n < 0xfd:
+        return n, 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[n]
+    return int.from_bytes(view[position + 1:position + 1 + size], "little"), 1 + size
+
+# the offset just past the record whose amount is at offset
+def record_end(view: memoryview, offset: int) -> int:
+    size, header = read_compact_size(view, offset + 8)
+    return offset + 8 + header + size
+
+# the output stored at the offset of an amount
+def read_txout(view: memoryview, offset: int) -> TxOut:
+    size, header = read_compact_size(view, offset + 8)
+    start = offset + 8 + header
+    return TxOut(int.from_bytes(view[offset:offset + 8], "little"), bytes(view[start:start + size]))
+
+
+# A snapshot file mapped into memory, with an index from outpoints to the
+# offsets of their records. Only the index lives on the heap: outputs are read
+# from the mapped file, whose pages the OS loads as they're needed and shares
+# between processes mapping the same file.
+class Snapshot:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._mapped = map_path(path)
+        self._view = memoryview(self._mapped)
+        self._offsets = dict(iter_records(self._view))
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __contains__(self, outpoint: bytes) -> bool:
+        return outpoint in self._offsets
+
+    def get(self, outpoint: bytes) -> TxOut | None:
+        offset = self._offsets.get(outpoint)
+        return None if offset is None else read_txout(self._view, offset)
+
+    # Looks up many outpoints at once. They're read in file order, so that a
+    # batch touches each page of the file once, however it's ordered.
+    def get_many(self, outpoints: list[bytes]) -> list[TxOut | None]:
+        offsets = [self._offsets.get(outpoint) for outpoint in outpoints]
+        results = [None] * len(outpoints)
+        for i in sorted((i for i, offset in enumerate(offsets) if offset is not None), key=offsets.__getitem__):
+            results[i] = read_txout(self._view, offsets[i])
+        return results
+
+
+def map_path(path: str) -> mmap.mmap | bytes:
+    with open(path, "rb") as source:
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) if source.seek(0, 2) else b""
+
+
+# Store files hold the records of a snapshot sorted by outpoint, so that they
+# can be looked up without an index of every outpoint in memory:
+#
+#   header      magic, number of records, number of pages, directory offset
+#   pages       runs of whole records of up to PAGE_SIZE bytes (a record
+#               larger than that gets a page of its own)
+#   directory   the first outpoint of every page and the page's offset
+#   fanout      for each 2 byte outpoint prefix, the number of pages starting
+#               with a smaller prefix
+#
+# An outpoint is on the last page starting at or before it. The fanout table
+# narrows the binary search over the directory to the pages around its
+# prefix, which are only a handful since txids are uniformly distributed.
+STORE_MAGIC = b"BTCUTXO1"
+HEADER_SIZE = 32
+PAGE_SIZE = 4096
+DIRECTORY_ENTRY_SIZE = OUTPOINT_SIZE + 8
+FANOUT_SIZE = 0x10000 + 1
+
+# Records sorted in memory at a time while building a store
+RUN_RECORDS = 1_000_000
+
+# Decoded pages kept by each open store
+PAGE_CACHE_CAPACITY = int(os.environ.get("BTC_SCRIPT_UTXO_PAGE_CACHE_CAPACITY", 16_384))
+
+
+# Writes sorted records into pages, keeping the directory in memory
+class StoreWriter:
+    def __init__(self, output: IO[bytes]) -> None:
+        self.output = output
+        self.directory = bytearray()
+        self.pages = 0
+        self.count = 0
+        self._page = bytearray()
+        self._first = b""
+        self._offset = HEADER_SIZE
+        output.write(bytes(HEADER_SIZE))
+
+    def add(self, outpoint: bytes, record: bytes | memoryview) -> None:
+        if self._page and len(self._page) + len(record) > PAGE_SIZE:
+            self._flush()
+        if not self._page:
+            self._first = outpoint
+        self._page += record
+        self.count += 1
+
+    def _flush(self) -> None:
+        self.directory += self._first + self._offset.to_bytes(8, "little")
+        self.output.write(self._page)
+        self._offset += len(self._page)
+        self.pages += 1
+        self._page = bytearray()
+
+    def close(self) -> None:
+        if self._page:
+            self._flush()
+
+        fanout = bytearray()
+        page = 0
+        for prefix in range(FANOUT_SIZE):
+            while page < self.pages and int.from_bytes(self.directory[page * DIRECTORY_ENTRY_SIZE:page * DIRECTORY_ENTRY_SIZE + 2], "big") < prefix:
+                page += 1
+            fanout += page.to_bytes(4, "little")
+
+        self.output.write(self.directory)
+        self.output.write(fanout)
+        self.output.seek(0)
+        self.output.write(STORE_MAGIC + self.count.to_bytes(8, "little") + self.pages.to_bytes(8, "little") + self._offset.to_bytes(8, "little"))
+
+
+# Yields (outpoint, record) for records of a snapshot, sorted by outpoint and
+# otherwise in their original order
+def sorted_run(view: memoryview, records: list[tuple[bytes, int]]) -> Iterator[tuple[bytes, bytes | memoryview]]:
+    records.sort(key=lambda record: record[0])
+    for outpoint, offset in records:
+        yield outpoint, view[offset - OUTPOINT_SIZE:record_end(view, offset)]
+
+
+# Bulk loads a snapshot into a store. The snapshot is sorted in runs of
+# run_records, written to temporary files next to the store, which are then
+# merged into its pages, so memory stays bounded however large the snapshot
+# is. Of records with the same outpoint, the last one in the snapshot is kept.
+def build_store(snapshot_path: str, store_path: str, run_records: int = RUN_RECORDS) -> int:
+    view = memoryview(map_path(snapshot_path))
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(store_path))) as tmpdir:
+        runs = []
+        records = []
+        for record in iter_records(view):
+            records.append(record)
+            if len(records) == run_records:
+                runs.append(write_run(tmpdir, len(runs), view, records))
+                records = []
+        if records:
+            runs.append(write_run(tmpdir, len(runs), view, records))
+
+        merged = heapq.merge(*(iter_run(path, run) for run, path in enumerate(runs)))
+        with open(store_path, "wb") as output:
+            writer = StoreWriter(output)
+            previous = None
+            for outpoint, _, _, record in merged:
+                if previous is not None and previous[0] != outpoint:
+                    writer.add(*previous)
+                previous = outpoint, record
+            if previous is not None:
+                writer.add(*previous)
+            writer.close()
+
+    return writer.count
+
+def write_run(tmpdir: str, run: int, view: memoryview, records: list[tuple[bytes, int]]) -> str:
+    path = os.path.join(tmpdir, f"run{run}")
+    with open(path, "wb") as output:
+        for _, record in sorted_run(view, records):
+            output.write(record)
+    return path
+
+# the records of a run as (outpoint, run, position, record), which merge in
+# snapshot order when outpoints are equal
+def iter_run(path: str, run: int) -> Iterator[tuple[bytes, int, int, memoryview]]:
+    view = memoryview(map_path(path))
+    for position, (outpoint, offset) in enumerate(iter_records(view)):
+        yield outpoint, run, position, view[offset - OUTPOINT_SIZE:record_end(view, offset)]
+
+
+# The first outpoints of the pages of a store, as a sequence for bisect
+class PageKeys:
+    __slots__ = ("view", "offset", "pages")
+
+    def __init__(self, view: memoryview, offset: int, pages: int) -> None:
+        self.view = view
+        self.offset = offset
+        self.pages = pages
+
+    def __len__(self) -> int:
+        return self.pages
+
+    def __getitem__(self, page: int) -> bytes:
+        start = self.offset + page * DIRECTORY_ENTRY_SIZE
+        return bytes(self.view[start:start + OUTPOINT_SIZE])
+
+    def page_offset(self, page: int) -> int:
+        start = self.offset + page * DIRECTORY_ENTRY_SIZE + OUTPOINT_SIZE
+        return int.from_bytes(self.view[start:start + 8], "little")
+
+
+# A store file mapped into memory. Lookups read the page an outpoint would be
+# on, which is decoded into a dict from outpoints to the offsets of their
+# records and kept in an LRU cache, so that outpoints of recently used pages
+# (e.g. several outputs of the same transaction) are found without decoding
+# it again.
+class UTXOStore:
+    def __init__(self, path: str, cache_pages: int = PAGE_CACHE_CAPACITY) -> None:
+        self.path = path
+        self._mapped = map_path(path)
+        view = self._view = memoryview(self._mapped)
+        if bytes(view[:len(STORE_MAGIC)]) != STORE_MAGIC:
+            raise ValueError(f"{path} is not a UTXO store")
+
+        self.count = int.from_bytes(view[8:16], "little")
+        pages = int.from_bytes(view[16:24], "little")
+        self._directory = int.from_bytes(view[24:32], "little")
+        self._keys = PageKeys(view, self._directory, pages)
+        self._fanout = self._directory + pages * DIRECTORY_ENTRY_SIZE
+        self.pages = LRUCache(cache_pages)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, outpoint: bytes) -> bool:
+        return self.get(outpoint) is not None
+
+    # the page an outpoint would be on, None if it's before the first page
+    def page_of(self, outpoint: bytes) -> int | None:
+        prefix = int.from_bytes(outpoint[:2], "big")
+        position = self._fanout + prefix * 4
+        lo = int.from_bytes(self._view[position:position + 4], "little")
+        hi = int.from_bytes(self._view[position + 4:position + 8], "little")
+        page = bisect_right(self._keys, outpoint, max(lo - 1, 0), hi) - 1
+        return page if page >= 0 else None
+
+    def page(self, page: int) -> dict[bytes, int]:
+        records = self.pages.get(page)
+        if records is None:
+            start = self._keys.page_offset(page)
+            end = self._keys.page_offset(page + 1) if page + 1 < len(self._keys) else self._directory
+            records = {outpoint: start + offset for outpoint, offset in iter_records(self._view[start:end])}
+            self.pages.put(page, records)
+        return records
+
+    def get(self, outpoint: bytes) -> TxOut | None:
+        page = self.page_of(outpoint)
+        offset = None if page is None else self.page(page).get(outpoint)
+        return None if offset is None else read_txout(self._view, offset)
+
+    # Looks up many outpoints at once, in sorted order, so that each page is
+    # read once per batch and pages are visited in file order
+    def get_many(self, outpoints: list[bytes]) -> list[TxOut | None]:
+        results = [None] * len(outpoints)
+        page, records = None, {}
+        for i in sorted(range(len(outpoints)), key=outpoints.__getitem__):
+            outpoint = outpoints[i]
+            if page is None or records is None or outpoint not in records:
+                page = self.page_of(outpoint)
+                records = self.page(page) if page is not None else None
+            offset = records.get(outpoint) if records is not None else None
+            if offset is not None:
+                results[i] = read_txout(self._view, offset)
+        return results
+
+
+# Opens a UTXO file, as a store if it is one and as a snapshot otherwise
+def open_utxo(path: str) -> "UTXOStore | Snapshot":
+    with open(path, "rb") as source:
+        magic = source.read(len(STORE_MAGIC))
+    return UTXOStore(path) if magic == STORE_MAGIC else Snapshot(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build a UTXO store from a snapshot file")
+    parser.add_argument("snapshot", help="snapshot file to load")
+    parser.add_argument("store", help="store file to write")
+    parser.add_argument("--run-records", type=int, default=RUN_RECORDS, help="records sorted in memory at a time")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    count = build_store(args.snapshot, args.store, args.run_records)
+    print(f"{count} outputs stored in {time.monotonic() - start:.2f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
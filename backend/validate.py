@@ -0,0 +1,381 @@
+import argparse
+import json
+import mmap
+import os
+import sys
+from batch import run_ordered, write_records
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator
+from hashes import sha256
+from opcodes import NUMBER_CONSTANTS, OP_CHECKMULTISIG, OP_CHECKMULTISIGVERIFY, OP_CHECKSIG, Data, ScriptOp, ScriptParseError, deserialize_script
+from program import Program, compile_bytes, compile_ops
+from secp256k1 import BatchVerifier
+from simulator import ScriptContext, TraceMode
+from templates import evaluate
+from transaction import TAPSCRIPT_LEAF_VERSION, SigVersion, Transaction, TransactionParseError, TxOut, iter_block, iter_transactions, parse_transaction, taproot_commits
+from utxo import Snapshot, UTXOStore, open_utxo
+from workers import get_program
+
+
+# Validates every input of every transaction in raw block or transaction
+# files, without going through the web server:
+#
+#   python validate.py block.dat --utxo snapshot.bin --workers 8
+#   python validate.py tx1.bin tx2.bin --kind tx --utxo snapshot.bin
+#
+# Each input is evaluated as Bitcoin would: its scriptSig followed by the
+# script of the output it spends, looked up in the UTXO snapshot or among the
+# outputs of earlier transactions in the files, then the redeem script of a
+# P2SH output and the witness of a segwit or taproot one. Results are reported
+# per transaction, as JSON lines.
+
+# Inputs per job sent to a worker. Small transactions are grouped into one
+# job, and the inputs of large ones are split over several.
+JOB_INPUTS = 64
+
+
+# Raised for inputs that can't be spent the way their output requires
+class SpendError(Exception):
+    pass
+
+
+# Result of validating one input, as (input index, valid, failing_step, failing_opcode, error)
+InputResult = tuple[int, bool, int | None, str | None, str | None]
+
+# What a worker needs to validate inputs start..stop of a transaction: where it
+# is in the mapped file and the outputs it spends, as (amount, script) pairs
+Task = tuple[int, int, tuple[tuple[int, bytes], ...], int, int]
+
+
+# The value pushed by a push-only op, None for any other op
+def push_value(op: ScriptOp) -> Data | None:
+    if type(op) is Data:
+        return op
+    return NUMBER_CONSTANTS.get(op.code)
+
+def push_program(items: list[bytes | memoryview]) -> Program:
+    return compile_ops([Data(value=item) for item in items])
+
+
+def is_p2sh(script: bytes) -> bool:
+    return len(script) == 23 and script[:2] == b"\xa9\x14" and script[-1] == 0x87
+
+# (version, program) of a witness output script, None for other scripts
+def witness_program(script: bytes) -> tuple[int, bytes] | None:
+    if not 4 <= len(script) <= 42 or script[1] != len(script) - 2:
+        return None
+    if script[0] == 0:
+        return 0, script[2:]
+    if 0x51 <= script[0] <= 0x60:
+        return script[0] - 0x50, script[2:]
+    return None
+
+
+# Opcodes whose tapscript semantics the interpreter doesn't implement:
+# OP_CHECKSIGADD, the OP_SUCCESSx codes that make a leaf succeed
+# unconditionally, and the multisig opcodes tapscript disables. Leaves using
+# them fail as unsupported rather than being run with the legacy semantics.
+OP_CHECKSIGADD = 0xba
+TAPSCRIPT_SUCCESS = {0x50, 0x62, 0x89, 0x8a, 0x8d, 0x8e, *range(0x7e, 0x82), *range(0x83, 0x87), *range(0x95, 0x9a), *range(0xbb, 0xff)}
+TAPSCRIPT_UNSUPPORTED = TAPSCRIPT_SUCCESS | {OP_CHECKSIGADD, OP_CHECKMULTISIG.code, OP_CHECKMULTISIGVERIFY.code}
+
+# The first opcode of a leaf script in TAPSCRIPT_UNSUPPORTED, skipping over pushes
+def unsupported_tapscript_op(leaf: bytes) -> int | None:
+    i, end = 0, len(leaf)
+    while i < end:
+        code = leaf[i]
+        i += 1
+        if code in TAPSCRIPT_UNSUPPORTED:
+            return code
+        if 0x01 <= code <= 0x4b:
+            i += code
+        elif code in (0x4c, 0x4d, 0x4e):
+            width = 1 << (code - 0x4c)
+            i += width + int.from_bytes(leaf[i:i + width], "little")
+    return None
+
+
+# The programs spending an input runs, all of which have to be valid: the
+# scriptSig followed by the output script, then for P2SH outputs the redeem
+# script on the stack the scriptSig left, and for witness outputs the script
+# they commit to on the witness stack. Each comes with the signature version
+# its signatures are checked under.
+def spend_programs(tx: Transaction, index: int) -> list[tuple[Program, SigVersion]]:
+    txin = tx.inputs[index]
+    script = tx.prevouts[index].script_pubkey
+    programs = []
+
+    try:
+        sig_ops = deserialize_script(txin.script_sig)
+    except ScriptParseError as error:
+        raise SpendError(f"Invalid scriptSig: {error}")
+
+    if witness_program(script) is None:
+        programs.append((compile_bytes(txin.script_sig) + get_program(script), SigVersion.BASE))
+        if not is_p2sh(script):
+            return programs
+
+        pushes = [push_value(op) for op in sig_ops]
+        if not pushes or None in pushes:
+            raise SpendError("P2SH scriptSig has to only push data")
+        script = bytes(pushes[-1].as_bytes())
+        if witness_program(script) is None:
+            programs.append((compile_ops(pushes[:-1]) + get_program(script), SigVersion.BASE))
+            return programs
+    elif txin.script_sig:
+        raise SpendError("Native witness spends require an empty scriptSig")
+
+    version, program = witness_program(script)
+    witness = txin.witness
+
+    if version == 0 and len(program) == 20:
+        if len(witness) != 2:
+            raise SpendError(f"P2WPKH spends take 2 witness items, found {len(witness)}")
+        return programs + [(push_program(witness) + get_program(tx.script_code(index)), SigVersion.WITNESS_V0)]
+
+    if version == 0 and len(program) == 32:
+        if not witness or sha256(witness[-1]) != program:
+            raise SpendError("Witness script doesn't match the P2WSH output")
+        return programs + [(push_program(witness[:-1]) + get_program(witness[-1]), SigVersion.WITNESS_V0)]
+
+    if version == 1 and len(program) == 32 and not is_p2sh(tx.prevouts[index].script_pubkey):
+        stack = witness[:-1] if len(witness) >= 2 and witness[-1][:1] == b"\x50" else witness
+        if len(stack) == 1:
+            # key path: a signature for the output key
+            return programs + [(push_program([stack[0], program]) + compile_ops([OP_CHECKSIG]), SigVersion.TAPSCRIPT)]
+        if not stack:
+            raise SpendError("Taproot spends require a witness")
+
+        control, leaf = stack[-1], stack[-2]
+        if not taproot_commits(program, control, leaf):
+            raise SpendError("Control block doesn't commit the output key to the leaf script")
+        if control[0] & 0xfe != TAPSCRIPT_LEAF_VERSION:
+            return programs
+        code = unsupported_tapscript_op(leaf)
+        if code is not None:
+            raise SpendError(f"Tapscript opcode 0x{code:02x} is not supported")
+        return programs + [(push_program(stack[:-2]) + get_program(leaf), SigVersion.TAPSCRIPT)]
+
+    if version == 0:
+        raise SpendError(f"Witness v0 programs are 20 or 32 bytes, found {len(program)}")
+    # unknown witness versions are left for future soft forks, and anyone can spend them
+    return programs
+
+
+# Files are mapped once per process. Workers map the file they're given by
+# path, so transactions reach them as offsets into pages shared with the
+# parent, rather than as copies pickled through the pool. Empty files can't be
+# mapped, and read as no bytes at all.
+MAPPED_FILES: dict[str, memoryview] = {}
+
+def map_file(path: str) -> memoryview:
+    view = MAPPED_FILES.get(path)
+    if view is None:
+        with open(path, "rb") as source:
+            if os.fstat(source.fileno()).st_size == 0:
+                view = memoryview(b"")
+            else:
+                view = memoryview(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+        MAPPED_FILES[path] = view
+    return view
+
+
+# Failures are reported per input: scripts that don't parse or can't be spent,
+# and errors of the interpreter, never take down the rest of the job
+def validate_input(tx: Transaction, index: int, batch: BatchVerifier, owner: int) -> InputResult:
+    try:
+        programs = spend_programs(tx, index)
+    except (SpendError, ScriptParseError) as error:
+        return index, False, None, None, str(error)
+
+    for program, sigversion in programs:
+        try:
+            simulation, _ = evaluate(program, TraceMode.ON_FAILURE, ScriptContext(batch=batch, owner=owner, tx=tx, input_index=index, sigversion=sigversion))
+        except Exception as error:
+            return index, False, None, None, f"Simulation failed: {error}"
+        for step in simulation.steps:
+            if step.failed:
+                return index, False, step.position, None if step.op is None else str(step.op), step.message
+        if not simulation.valid:
+            return index, False, None, None, "Script left a false value on the stack"
+
+    return index, True, None, None, None
+
+
+# Validates the inputs of the tasks of a job, verifying the Schnorr
+# signatures of all of them in one batch. Each transaction is parsed once per
+# job, and its signature hashes are shared by all of its inputs in the job.
+def validate_job(path: str, tasks: list[Task]) -> list[list[InputResult]]:
+    view = map_file(path)
+    batch = BatchVerifier()
+    results = []
+    owners = []
+
+    for offset, size, prevouts, start, stop in tasks:
+        tx = parse_transaction(view[offset:offset + size], [TxOut(amount, script) for amount, script in prevouts])
+        task_results = []
+        for index in range(start, stop):
+            owners.append((len(results), len(task_results)))
+            task_results.append(validate_input(tx, index, batch, len(owners) - 1))
+        results.append(task_results)
+
+    for owner in batch.verify():
+        task, position = owners[owner]
+        index, valid, *_ = results[task][position]
+        if valid:
+            results[task][position] = index, False, None, None, "Schnorr signature verification failed"
+    return results
+
+
+# A transaction read from a file: its position in the file, offset and size,
+# and the outputs its inputs spend (None where they weren't found)
+class Entry:
+    __slots__ = ("position", "offset", "size", "tx", "prevouts")
+
+    def __init__(self, position: int, offset: int, size: int, tx: Transaction) -> None:
+        self.position = position
+        self.offset = offset
+        self.size = size
+        self.tx = tx
+        self.prevouts: list[TxOut | None] = []
+
+
+def read_entries(view: memoryview, kind: str) -> list[Entry]:
+    transactions = iter_block(view) if kind == "block" else iter_transactions(view)
+    return [Entry(position, offset, size, tx) for position, (offset, size, tx) in enumerate(transactions)]
+
+
+# Finds the outputs spent by every input of the entries. Outputs created by
+# earlier transactions (in this file or the ones before it) are found in
+# created, which the entries' own outputs are then added to, and the rest are
+# looked up in the snapshot all at once. Outputs already spent are removed
+# from created, or remembered in spent for those of the snapshot, so that
+# spending one twice finds nothing the second time.
+def resolve_prevouts(entries: list[Entry], snapshot: Snapshot | UTXOStore | None, created: dict[bytes, TxOut], spent: set[bytes]) -> None:
+    lookups = []
+    for entry in entries:
+        tx = entry.tx
+        for index, txin in enumerate(tx.inputs):
+            outpoint = txin.outpoint
+            prevout = created.pop(outpoint, None)
+            if prevout is None and snapshot is not None and not txin.coinbase and outpoint not in spent:
+                spent.add(outpoint)
+                lookups.append((entry, index, outpoint))
+            entry.prevouts.append(prevout)
+
+        txid = tx.txid
+        for vout, txout in enumerate(tx.outputs):
+            created[txid + vout.to_bytes(4, "little")] = txout
+
+    found = snapshot.get_many([outpoint for _, _, outpoint in lookups]) if lookups else []
+    for (entry, index, _), prevout in zip(lookups, found):
+        entry.prevouts[index] = prevout
+
+
+# Groups the inputs of the entries into jobs of about JOB_INPUTS inputs each,
+# as lists of tasks along with the entries they belong to. Coinbase inputs
+# aren't validated, nor are inputs whose spent output wasn't found.
+def plan_jobs(entries: list[Entry], job_inputs: int = JOB_INPUTS) -> Iterator[tuple[list[Task], list[Entry]]]:
+    tasks, owners, inputs = [], [], 0
+    for entry in entries:
+        count = 0 if entry.tx.inputs[0].coinbase else len(entry.tx.inputs)
+        prevouts = tuple((txout.amount, txout.script_pubkey) if txout is not None else (0, b"") for txout in entry.prevouts)
+
+        start = 0
+        while True:
+            stop = min(count, start + job_inputs - inputs)
+            tasks.append((entry.offset, entry.size, prevouts, start, stop))
+            owners.append(entry)
+            inputs += stop - start
+            if inputs >= job_inputs:
+                yield tasks, owners
+                tasks, owners, inputs = [], [], 0
+            start = stop
+            if start >= count:
+                break
+
+    if tasks:
+        yield tasks, owners
+
+
+# Runs the jobs on a process pool and yields the results of their tasks in
+# order. Only the tasks are sent to the workers, not the entries they belong to.
+def run_jobs(path: str, jobs: Iterator[tuple[list[Task], list[Entry]]], executor: ProcessPoolExecutor | None, workers: int) -> Iterator[tuple[Task, Entry, list[InputResult]]]:
+    items = ((tasks, (tasks, owners)) for tasks, owners in jobs)
+    for (tasks, owners), results in run_ordered(partial(validate_job, path), items, executor, workers):
+        yield from zip(tasks, owners, results)
+
+
+# Collects the results of the tasks of each transaction into its report
+def transaction_reports(path: str, results: Iterator[tuple[Task, Entry, list[InputResult]]]) -> Iterator[dict]:
+    failures = []
+    for (*_, stop), entry, task_results in results:
+        failures += [result for result in task_results if not result[1]]
+
+        tx = entry.tx
+        coinbase = tx.inputs[0].coinbase
+        if stop < len(tx.inputs) and not coinbase:
+            continue
+
+        for index, prevout in enumerate(entry.prevouts):
+            if prevout is None and not coinbase:
+                failures = [failure for failure in failures if failure[0] != index]
+                failures.append((index, False, None, None, "Spent output not found"))
+        failures.sort()
+
+        yield {
+            "file": path,
+            "index": entry.position,
+            "txid": tx.txid[::-1].hex(),
+            "valid": not failures,
+            "inputs": 0 if coinbase else len(tx.inputs),
+            "failures": [dict(zip(("input", "valid", "failing_step", "failing_opcode", "error"), failure)) for failure in failures],
+        }
+        failures = []
+
+
+def validate_file(path: str, kind: str, snapshot: Snapshot | UTXOStore | None, created: dict[bytes, TxOut], spent: set[bytes],
+                  executor: ProcessPoolExecutor | None, workers: int) -> Iterator[dict]:
+    entries = read_entries(map_file(path), kind)
+    resolve_prevouts(entries, snapshot, created, spent)
+    yield from transaction_reports(path, run_jobs(path, plan_jobs(entries), executor, workers))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Validate the inputs of the transactions in raw block or transaction files")
+    parser.add_argument("files", nargs="+", help="raw block files, or files of raw transactions laid end to end")
+    parser.add_argument("--kind", choices=["block", "tx"], default="block", help="what the files hold")
+    parser.add_argument("--utxo", help="UTXO snapshot or store file with the outputs the transactions spend")
+    parser.add_argument("--output", help="file to write reports to, stdout by default")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes, 0 to validate inline")
+    parser.add_argument("--progress", type=float, default=5.0, help="seconds between progress reports, 0 to disable")
+    args = parser.parse_args()
+
+    snapshot = open_utxo(args.utxo) if args.utxo else None
+    executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers > 0 else None
+    output = sys.stdout if args.output is None else open(args.output, "w")
+    created, spent = {}, set()
+
+    def reports() -> Iterator[dict]:
+        for path in args.files:
+            try:
+                yield from validate_file(path, args.kind, snapshot, created, spent, executor, args.workers)
+            except (TransactionParseError, OSError) as error:
+                print(f"{path}: {error}", file=sys.stderr)
+
+    with output:
+        stats = write_records(reports(), lambda report: output.write(json.dumps(report) + "\n"), lambda report: report["valid"], args.progress,
+                              "transactions", "inputs", lambda report: report["inputs"])
+    if executor is not None:
+        executor.shutdown()
+
+    print(
+        f"{stats['transactions']} transactions ({stats['valid']} valid, {stats['invalid']} invalid), {stats['inputs']} inputs "
+        f"in {stats['seconds']:.2f}s, {stats['inputs_per_second']:.0f} inputs/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from cache import LRUCache
+from models import SimulationModel, simulation_to_model
+from program import Program, compile_normalized
+from simulator import HASH_CACHE, SIGNATURE_CACHE, ScriptContext, TraceMode
+from templates import evaluate, evaluate_batch
+from transaction import Transaction, TxOut, parse_transaction
+
+
+# Pool settings, overridable through environment variables. With 0 workers,
+# jobs run inline on the calling thread.
+WORKERS = int(os.environ.get("BTC_SCRIPT_WORKERS", os.cpu_count() or 1))
+MAX_QUEUE = int(os.environ.get("BTC_SCRIPT_MAX_QUEUE", 1000))
+JOB_TIMEOUT = float(os.environ.get("BTC_SCRIPT_JOB_TIMEOUT", 30))
+PROGRAM_CACHE_CAPACITY = int(os.environ.get("BTC_SCRIPT_PROGRAM_CACHE_CAPACITY", 1_000_000))
+TRANSACTION_CACHE_CAPACITY = int(os.environ.get("BTC_SCRIPT_TRANSACTION_CACHE_CAPACITY", 100_000_000))
+CACHE_TTL = float(os.environ.get("BTC_SCRIPT_CACHE_TTL", 3600))
+
+
+# Compiled programs, keyed by normalized script and weighed by their number of
+# ops. Each worker process keeps its own cache.
+PROGRAM_CACHE = LRUCache(PROGRAM_CACHE_CAPACITY, CACHE_TTL, sizeof=len)
+
+def get_program(key: tuple[str, ...] | bytes) -> Program:
+    program = PROGRAM_CACHE.get(key)
+    if program is None:
+        program = compile_normalized(key)
+        PROGRAM_CACHE.put(key, program)
+    return program
+
+
+# Parsed spending transactions, keyed by their serialization and the
+# (amount, script) of the outputs they spend, and weighed by their size in
+# bytes. Requests for the different inputs of a transaction share its parse
+# and signature hash midstates.
+TransactionKey = tuple[bytes, tuple[tuple[int, bytes], ...] | None]
+
+TRANSACTION_CACHE = LRUCache(TRANSACTION_CACHE_CAPACITY, CACHE_TTL, sizeof=lambda tx: len(tx.serialize()))
+
+def get_transaction(key: TransactionKey) -> Transaction:
+    tx = TRANSACTION_CACHE.get(key)
+    if tx is None:
+        raw, prevouts = key
+        tx = parse_transaction(raw, None if prevouts is None else [TxOut(amount, script) for amount, script in prevouts])
+        TRANSACTION_CACHE.put(key, tx)
+    return tx
+
+
+# Jobs run in the worker processes. They return the API models, which pickle
+# cheaply, rather than the simulator's structurally shared steps.
+
+def simulate_job(key: tuple[str, ...] | bytes, trace: TraceMode, sighash: bytes | None = None, max_steps: int | None = None,
+                 tx: TransactionKey | None = None, input_index: int = 0) -> SimulationModel:
+    context = ScriptContext(sighash, max_steps=max_steps, tx=None if tx is None else get_transaction(tx), input_index=input_index)
+    return simulation_to_model(*evaluate(get_program(key), trace, context))
+
+# the Schnorr signatures of a chunk are verified as one batch
+def simulate_chunk(chunk: list[tuple[str, ...] | bytes], trace: TraceMode, sighash: bytes | None = None, max_steps: int | None = None) -> list[SimulationModel]:
+    results = evaluate_batch([get_program(key) for key in chunk], trace, sighash, max_steps)
+    return [simulation_to_model(*result) for result in results]
+
+
+# Stats of the caches of the current process. Each worker process fills its own
+# caches, so the pool gathers them from the workers along with job results.
+def cache_stats() -> dict[str, dict[str, int]]:
+    return {'programs': PROGRAM_CACHE.stats(), 'signatures': SIGNATURE_CACHE.stats(), 'hashes': HASH_CACHE.stats(), 'transactions': TRANSACTION_CACHE.stats()}
+
+# Sums the cache stats of several processes
+def merge_cache_stats(*stats: dict[str, dict[str, int]]) -> dict[str, dict[str, int]]:
+    merged = {}
+    for process_stats in stats:
+        for name, counters in process_stats.items():
+            totals = merged.setdefault(name, dict.fromkeys(counters, 0))
+            for counter, value in counters.items():
+                totals[counter] += value
+    return merged
+
+# Empties the caches a forked worker inherits, so that it only reports its own work
+def init_worker() -> None:
+    for cache in (PROGRAM_CACHE, SIGNATURE_CACHE, HASH_CACHE, TRANSACTION_CACHE):
+        cache.clear()
+        cache.hits = cache.misses = 0
+
+# Runs a job in a worker, returning the worker's pid and cache stats with its result
+def report_job(job, *args):
+    result = job(*args)
+    return os.getpid(), cache_stats(), result
+
+
+# Raised when more jobs are waiting than the pool accepts
+class PoolBusy(Exception):
+    pass
+
+
+# Runs jobs on a process pool from async code, so CPU-bound simulations don't
+# block the event loop. At most max_queue jobs may be pending at once, and the
+# caller stops waiting for a job after timeout seconds. A job that times out
+# keeps running in its worker until it finishes. The pool keeps the cache stats
+# each worker reported with its latest job.
+class SimulationPool:
+    def __init__(self, workers: int = WORKERS, max_queue: int = MAX_QUEUE, timeout: float = JOB_TIMEOUT) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self.worker_stats: dict[int, dict[str, dict[str, int]]] = {}
+        self._executor = None
+
+    async def run(self, job, *args):
+        if self.workers == 0:
+            return job(*args)
+
+        self.reserve()
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+
+        try:
+            future = asyncio.wrap_future(self._executor.submit(report_job, job, *args))
+            pid, stats, result = await asyncio.wait_for(future, self.timeout)
+            self.worker_stats[pid] = stats
+            return result
+        finally:
+            self.release()
+
+    # Stats of the caches of this process, which runs inline jobs and streamed
+    # simulations, summed with the latest ones reported by each worker
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        return merge_cache_stats(cache_stats(), *self.worker_stats.values())
+
+    # Takes a place among the pending jobs, for work run outside the pool's
+    # processes as well, such as streamed simulations. Every reserve has to be
+    # followed by a release once the work is done.
+    def reserve(self) -> None:
+        if self.pending >= self.max_queue:
+            raise PoolBusy(f"{self.pending} jobs already pending")
+        self.pending += 1
+
+    def release(self) -> None:
+        self.pending -= 1
+
+    # Splits items into chunks spread over the workers, runs job(chunk, *args)
+    # for each of them, and returns the concatenated results in order
+    async def map_chunks(self, job, items: list, *args) -> list:
+        if not items:
+            return []
+
+        chunk_size = max(1, len(items) // (max(self.workers, 1) * 4))
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = await asyncio.gather(*(self.run(job, chunk, *args) for chunk in chunks))
+        return [result for chunk_results in results for result in chunk_results]
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+            self.worker_stats.clear()
@@ -148,6 +148,7 @@ function Simulate({simulationSteps, setActiveStep}) {
             <Stack minHeight={250} direction='row' justifyContent='center' alignItems='flex-start' spacing={2}>
                 <ScriptStack stack={currentSimulationStep.script} title='Script'/>
                 <ScriptStack stack={currentSimulationStep.stack} title='Stack' />
+                {(currentSimulationStep.altstack?.length > 0) && <ScriptStack stack={currentSimulationStep.altstack} title='Alt Stack' />}
             </Stack>
 
 